@@ -1,5 +1,7 @@
 import math
 
+from result_io import read_points
+
 def parse_xyz(filepath):
     print(f"Reading {filepath}...")
     with open(filepath, 'r') as f:
@@ -48,26 +50,11 @@ def parse_xyz(filepath):
 
 def parse_txt(filepath):
     print(f"Reading {filepath}...")
-    min_x, max_x = float('inf'), float('-inf')
-    min_y, max_y = float('inf'), float('-inf')
-    
-    count = 0
-    with open(filepath, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) == 3:
-                try:
-                    x = float(parts[0])
-                    y = float(parts[1])
-                    if x < min_x: min_x = x
-                    if x > max_x: max_x = x
-                    if y < min_y: min_y = y
-                    if y > max_y: max_y = y
-                    count += 1
-                except ValueError:
-                    continue
-    print(f"Parsed {count} points from TXT")
-    return (min_x, max_x, min_y, max_y)
+    x, y, _ = read_points(filepath)
+    print(f"Parsed {len(x)} points from TXT")
+    if len(x) == 0:
+        return (float('inf'), float('-inf'), float('inf'), float('-inf'))
+    return (float(x.min()), float(x.max()), float(y.min()), float(y.max()))
 
 def analyze():
     print("Parsing XYZ...")
@@ -1,12 +1,48 @@
 import streamlit as st
+import hashlib
+import json
+import math
 import os
+import shutil
 import tempfile
-from process_xyz import process_xyz
+import time
+from binning import parse_exclusion_zones
+from jobs import CANCELLED, DONE, FINISHED, QUEUED, JobQueue
+from perf import PERF_KEY
+from process_xyz import OUTPUT_SUFFIXES, profile_suffix
+from result_io import PROCESSED_EXTENSIONS, PROCESSED_SUFFIXES
+from result_cache import ResultCache, cached_process_xyz
+from stage_cache import StageCache
 import matplotlib.pyplot as plt
 from PIL import Image
 import zipfile
 import io
 
+# 内存中保存的分析结果上限
+RESULTS_MEMO_BYTES = 256 * 1024**2
+# 并行绘图线程数
+PLOT_WORKERS = min(4, os.cpu_count() or 1)
+# 同时运行的分析任务数 (其余排队) 和页面轮询任务进度的间隔
+JOB_WORKERS = 2
+JOB_POLL_SECONDS = 0.3
+# 界面显示低分辨率预览,"保存图表"时按所选规格重新绘制
+PREVIEW_PROFILE = "preview"
+EXPORT_PROFILES = {"archival": "PNG (300 dpi)", "svg": "SVG (矢量)", "pdf": "PDF (矢量)"}
+# 进度条上显示的阶段名 (输出文件按扩展名显示为绘图/保存数据)
+STAGE_LABELS = {
+    "parse": "读取数据",
+    "physical": "坐标转换",
+    "binning": "分箱与边缘清除",
+    "points": "读取预处理数据",
+    "processed.txt": "保存预处理数据",
+    "detilt": "去倾斜",
+    "sfma": "SFMA扫描",
+    "tilt": "局部角",
+    "nce": "NCE",
+    "stats": "统计",
+    "cache": "读取缓存",
+}
+
 # 设置页面配置
 st.set_page_config(page_title="面形分析工具", page_icon="", layout="wide")
 
@@ -74,15 +110,526 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+
+@st.cache_resource
+def get_stage_cache():
+    """分阶段缓存,服务器上所有会话共用"""
+    return StageCache()
+
+
+@st.cache_resource
+def get_result_cache():
+    """磁盘结果缓存,服务器上所有会话共用"""
+    return ResultCache()
+
+
+@st.cache_resource
+def get_job_queue():
+    """后台分析任务队列,服务器上所有会话共用"""
+    return JobQueue(
+        workers=JOB_WORKERS,
+        stage_cache=get_stage_cache(),
+        result_cache=get_result_cache(),
+        plot_workers=PLOT_WORKERS,
+    )
+
+
+@st.cache_resource
+def get_results_memo():
+    """
+    内存中的分析结果,以 (上传内容哈希, 文件名, 参数) 为键,所有会话共用
+
+    不使用 st.cache_data: 未命中时分析过程中要把指标和图像逐个推送到页面
+    """
+    return StageCache(max_bytes=RESULTS_MEMO_BYTES)
+
+
+def run_analysis(
+    file_bytes,
+    file_name,
+    params,
+    on_metrics=None,
+    on_output=None,
+    on_progress=None,
+    cancel=None,
+):
+    """
+    分析上传的文件,返回指标和全部输出文件的内容
+
+    以上传内容和参数为键缓存在内存中,重复点击或页面重跑时不再读写磁盘;
+    未命中时分析过程中调用 on_metrics(指标)、on_output(后缀, 文件内容) 和
+    on_progress (见 process_xyz),命中时不调用。cancel 取消后抛出 AnalysisCancelled,
+    不缓存结果。临时目录在读取输出文件后即删除
+    """
+    key = (
+        hashlib.sha256(file_bytes).hexdigest(),
+        file_name,
+        json.dumps(params, sort_keys=True),
+    )
+    return get_results_memo().get(
+        key,
+        lambda: analyze_upload(
+            file_bytes, file_name, params, on_metrics, on_output, on_progress, cancel
+        ),
+    )
+
+
+def analyze_upload(
+    file_bytes,
+    file_name,
+    params,
+    on_metrics=None,
+    on_output=None,
+    on_progress=None,
+    cancel=None,
+):
+    """在临时目录中运行分析,输出文件生成后立即读入内存并回调 on_output"""
+    files = {}
+
+    def read_output(suffix, path):
+        with open(path, "rb") as f:
+            files[suffix] = f.read()
+        if on_output is not None:
+            on_output(suffix, files[suffix])
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # 保存上传的文件
+        input_path = os.path.join(temp_dir, file_name)
+        with open(input_path, "wb") as f:
+            f.write(file_bytes)
+
+        # 设置输出路径
+        output_filename = output_name(file_name)
+        output_path = os.path.join(temp_dir, output_filename)
+
+        metrics = cached_process_xyz(
+            input_path,
+            output_path,
+            cache=get_result_cache(),
+            stage_cache=get_stage_cache(),
+            plot_workers=PLOT_WORKERS,
+            on_metrics=on_metrics,
+            on_output=read_output,
+            on_progress=on_progress,
+            cancel=cancel,
+            **params,
+        )
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        "metrics": metrics,
+        "files": files,
+        "render_profile": params.get("render_profile", "archival"),
+        "output_filename": output_filename,
+        "file_name_suffix": file_name.split(".")[0],
+    }
+
+
+def images_zip(results):
+    """全部图像打包为ZIP,扩展名按结果的输出规格"""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zf:
+        for suffix in OUTPUT_SUFFIXES:
+            if suffix.endswith(".png") and suffix in results["files"]:
+                name = results["output_filename"].replace(
+                    ".txt", profile_suffix(suffix, results["render_profile"])
+                )
+                zf.writestr(name, results["files"][suffix])
+    return zip_buffer.getvalue()
+
+
+def output_name(file_name):
+    """预处理数据的文件名,其他输出文件在此基础上替换后缀"""
+    return os.path.splitext(file_name)[0] + "-processed.txt"
+
+
+def chart_specs(sfma_threshold_nm, tilt_threshold_urad):
+    """结果页的图表,每行两张: (标题, 图像后缀, 缺失提示, 数据后缀, 数据下载提示)"""
+    return [
+        # 第一行：SFMA面形 和 SFMA高阈值
+        (
+            ("SFMA面形", "-sfma.png", "未生成SFMA面形", "-sfma.txt", "下载SFMA数据(TXT)"),
+            (
+                f"SFMA面形 (>{sfma_threshold_nm}nm)",
+                "-sfma-high.png",
+                "未生成SFMA高阈值图",
+                None,
+                None,
+            ),
+        ),
+        # 第二行：局部角分布 和 局部角分布高阈值
+        (
+            (
+                "局部角分布",
+                "-tilt.png",
+                "未生成局部角分布",
+                "-tilt.txt",
+                "下载局部角数据(TXT)",
+            ),
+            (
+                f"局部角分布 (>{tilt_threshold_urad}μrad)",
+                "-tilt-high.png",
+                "未生成高局部角分布图",
+                None,
+                None,
+            ),
+        ),
+        # 第三行：NCE面形
+        (("NCE面形", "-nce.png", "未生成NCE面形", "-nce.txt", "下载NCE数据(TXT)"),),
+    ]
+
+
+def results_layout(output_filename, sfma_threshold_nm, tilt_threshold_urad):
+    """
+    搭建结果页布局,各部分先放置占位元素,返回填写内容的 view
+
+    分析过程中指标和各输出文件完成后分别填入对应位置
+    """
+    view = {
+        "output_filename": output_filename,
+        "slots": {},
+        "titles": {},
+        "missing": {},
+        "helps": {},
+        "filled": set(),
+    }
+    slots = view["slots"]
+
+    # 显示结果标题和下载按钮
+    h_col1, h_col2, h_col3, h_col4 = st.columns([5, 1, 1, 1])
+    with h_col1:
+        st.header("分析结果")
+    slots["export"] = h_col2.empty()
+    slots[""] = h_col3.empty()
+    view["helps"][""] = "下载预处理数据(TXT)"
+    slots["-results.npz"] = h_col4.empty()
+    view["helps"]["-results.npz"] = "下载全部面形、参数和指标(NPZ,可用 result_io.load_results 读取)"
+
+    # 1. 指标值
+    slots["metrics"] = st.empty()
+
+    # 2. 图表
+    for row in chart_specs(sfma_threshold_nm, tilt_threshold_urad):
+        for col, spec in zip(st.columns(2), row):
+            title, image_suffix, missing, data_suffix, data_help = spec
+            with col:
+                if data_suffix is None:
+                    st.subheader(title)
+                else:
+                    sub_c1, sub_c2 = st.columns([2, 1])
+                    with sub_c1:
+                        st.subheader(title)
+                    slots[data_suffix] = sub_c2.empty()
+                    view["helps"][data_suffix] = data_help
+                slots[image_suffix] = st.empty()
+                slots[image_suffix].caption("正在绘制...")
+                view["titles"][image_suffix] = title
+                view["missing"][image_suffix] = missing
+
+    # 3. 性能记录 (折叠)
+    slots["perf"] = st.empty()
+    return view
+
+
+def show_metrics(view, metrics):
+    """填入指标值"""
+    if not metrics:
+        view["slots"]["metrics"].empty()
+        return
+    with view["slots"]["metrics"].container():
+        m_col1, m_col2, m_col3 = st.columns(3)
+        with m_col1:
+            st.metric("SFMA (m+3σ)", f"{metrics['sfma'] * 1e9:.2f} nm")
+        with m_col2:
+            st.metric("局部角分布 (m+3σ)", f"{metrics['tilt']:.2f} μrad")
+        with m_col3:
+            st.metric("NCE (m+3σ)", f"{metrics['nce'] * 1e9:.2f} nm")
+        if math.isfinite(metrics["scale"]):
+            st.caption(f"数据分辨率: {metrics['scale'] * 1e3:.5f} mm")
+
+        st.markdown("---")
+
+
+def progress_text(stage, done, total):
+    """进度条文字: SFMA 显示已扫描列数,局部角显示已计算行数"""
+    if stage.endswith(".png"):
+        label = "绘图"
+    elif stage.endswith((".txt", ".npz")) and stage not in STAGE_LABELS:
+        label = "保存数据"
+    else:
+        label = STAGE_LABELS.get(stage, stage)
+    if total > 1:
+        unit = "列" if stage == "sfma" else "行"
+        label += f" {done}/{total} {unit}"
+    return label
+
+
+def current_job_id():
+    """本会话的任务ID;页面刷新后 session_state 清空,从地址栏参数恢复"""
+    if st.session_state.get("job_id") is None:
+        st.session_state.job_id = st.query_params.get("job")
+    return st.session_state.job_id
+
+
+def cancel_stale_job(file_id):
+    """上传了另一个文件时取消本会话中仍在排队或运行的任务"""
+    job_id = current_job_id()
+    if job_id is None or file_id is None:
+        return
+    status = get_job_queue().status(job_id)
+    if status is not None and tuple(status["meta"]["file_id"]) != file_id:
+        get_job_queue().cancel(job_id)
+
+
+def submit_job(file_bytes, file_name, file_id, params, meta):
+    """提交新的分析任务 (取消本会话的上一个任务),任务ID记入会话和地址栏"""
+    previous = current_job_id()
+    if previous is not None:
+        get_job_queue().cancel(previous)
+    job_id = get_job_queue().submit(
+        file_bytes, file_name, params, dict(meta, file_id=list(file_id))
+    )
+    st.session_state.job_id = job_id
+    st.session_state.analysis_results = None
+    st.query_params["job"] = job_id
+    return job_id
+
+
+def job_results(job_id, status):
+    """已完成任务的结果,结构同 analyze_upload,另含保存图表所需的上传文件和参数"""
+    result = get_job_queue().result(job_id)
+    file_name = status["file_name"]
+    return {
+        "job_id": job_id,
+        "metrics": result["metrics"],
+        "files": result["files"],
+        "render_profile": status["params"].get("render_profile", "archival"),
+        "output_filename": output_name(file_name),
+        "file_name_suffix": file_name.split(".")[0],
+        "sfma_threshold_nm": status["meta"]["sfma_threshold_nm"],
+        "tilt_threshold_urad": status["meta"]["tilt_threshold_urad"],
+        "file_bytes": result["input"],
+        "file_name": file_name,
+        "params": status["params"],
+    }
+
+
+def job_progress_text(status):
+    if status["status"] == QUEUED:
+        ahead = status["queue_position"]
+        return f"排队中,前面还有 {ahead} 个任务" if ahead else "排队中..."
+    if status["stage"] is None:
+        return "正在分析数据,请稍候..."
+    return progress_text(status["stage"], status["done"], status["total"])
+
+
+def watch_job(job_id, export_profile):
+    """
+    显示任务: 已完成的直接显示结果;排队或运行中的轮询进度,
+    指标和输出文件生成后逐个填入,完成后补全结果。
+    页面重跑或刷新只中断轮询,任务在后台继续运行
+    """
+    job_queue = get_job_queue()
+    status = job_queue.status(job_id)
+    if status is None:
+        st.warning("任务不存在或已被清理")
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+        return
+
+    # 地址栏带有任务ID (?job=...),刷新或重新打开该地址可再次查看
+    st.caption(f"任务 {job_id}")
+
+    results = st.session_state.analysis_results
+    if results is not None and results["job_id"] == job_id:
+        show_results(results, export_profile)
+        return
+
+    progress_bar = None
+    if status["status"] not in FINISHED:
+        progress_bar = st.progress(
+            status["progress"], text=job_progress_text(status)
+        )
+        if st.button("停止分析", key="btn_stop"):
+            job_queue.cancel(job_id)
+
+    results_area = st.empty()
+    with results_area.container():
+        view = results_layout(
+            output_name(status["file_name"]),
+            status["meta"]["sfma_threshold_nm"],
+            status["meta"]["tilt_threshold_urad"],
+        )
+
+    while True:
+        if status["metrics"] is not None and "metrics" not in view["filled"]:
+            view["filled"].add("metrics")
+            show_metrics(view, status["metrics"])
+        for suffix, path in status["outputs"].items():
+            if suffix not in view["filled"]:
+                with open(path, "rb") as f:
+                    show_output(view, suffix, f.read())
+        if status["status"] in FINISHED:
+            break
+        progress_bar.progress(status["progress"], text=job_progress_text(status))
+        time.sleep(JOB_POLL_SECONDS)
+        status = job_queue.status(job_id)
+
+    if status["status"] == DONE:
+        results = job_results(job_id, status)
+        finish_results(view, results, export_profile)
+        st.session_state.analysis_results = results
+    elif status["status"] == CANCELLED:
+        results_area.empty()
+        st.info("分析已取消")
+    else:
+        results_area.empty()
+        st.error(f"❌ 分析过程中出现错误: {status['error']}")
+
+    if progress_bar is not None:
+        progress_bar.empty()
+        if status["status"] == DONE:
+            st.toast("分析完成!", icon="✅", duration=1)
+
+
+def show_perf(slot, metrics):
+    """填入性能记录: 各阶段耗时、内存峰值和 cProfile 统计"""
+    if not metrics:
+        slot.empty()
+        return
+    perf = metrics.get(PERF_KEY)
+    with slot.container():
+        with st.expander("性能"):
+            if perf is None:
+                st.caption("结果取自缓存,没有重新计算")
+                return
+
+            summary = f"总耗时 {perf['seconds']:.2f} s"
+            if perf["peak_mb"] is not None:
+                summary += f", 内存峰值 {perf['peak_mb']:.1f} MB"
+            elif not perf["cprofile"]:
+                summary += " (图表并行绘制,各阶段耗时相互重叠)"
+            st.caption(summary)
+
+            rows = []
+            for record in perf["stages"]:
+                row = {
+                    "阶段": record["stage"],
+                    "耗时 (s)": f"{record['seconds']:.3f}",
+                    "缓存": "命中" if record["cached"] else "",
+                }
+                if "peak_mb" in record:
+                    row["内存峰值 (MB)"] = f"{record['peak_mb']:.1f}"
+                rows.append(row)
+            st.table(rows)
+
+            if perf["cprofile"]:
+                st.code(perf["cprofile"], language=None)
+
+
+def show_output(view, suffix, content):
+    """填入一个输出文件: 图像直接显示,数据文件和结果文件提供下载"""
+    slot = view["slots"].get(suffix)
+    if slot is None or suffix in view["filled"]:
+        return
+    view["filled"].add(suffix)
+
+    if suffix.endswith(".png"):
+        slot.image(content, caption=view["titles"][suffix], use_container_width=True)
+        return
+
+    binary = suffix.endswith(".npz")
+    key = "btn_processed_data" if suffix == "" else f"btn_{suffix[1:-4]}_data"
+    slot.download_button(
+        "保存结果" if binary else "保存数据",
+        content,
+        file_name=view["output_filename"].replace(".txt", suffix),
+        mime="application/octet-stream" if binary else "text/plain",
+        help=view["helps"][suffix],
+        key=key,
+    )
+
+
+def show_export(slot, results, export_profile):
+    """
+    保存图表: 界面中的图像是低分辨率预览,点击后按 export_profile 重新绘制
+    全部图表 (计算阶段取自缓存,只重新绘图) 并提供ZIP下载
+    """
+    exports = results.setdefault("exports", {})
+    if export_profile not in exports:
+        clicked = slot.button(
+            "保存图表",
+            help=f"生成所有分析图表 ({EXPORT_PROFILES[export_profile]})",
+            key="btn_export",
+        )
+        if not clicked:
+            return
+        slot.caption("正在生成...")
+        exported = run_analysis(
+            results["file_bytes"],
+            results["file_name"],
+            dict(
+                results["params"],
+                render_profile=export_profile,
+                track_memory=False,
+                cprofile=False,
+            ),
+        )
+        exports[export_profile] = images_zip(exported)
+
+    slot.download_button(
+        "下载图表",
+        data=exports[export_profile],
+        file_name=f"{results['file_name_suffix']}_images.zip",
+        mime="application/zip",
+        help=f"下载所有分析图表 ({EXPORT_PROFILES[export_profile]}, ZIP)",
+        key="btn_export_zip",
+    )
+
+
+def finish_results(view, results, export_profile):
+    """补全尚未填入的部分 (缓存命中时为全部内容),未生成的图像显示提示"""
+    if "metrics" not in view["filled"]:
+        view["filled"].add("metrics")
+        show_metrics(view, results["metrics"])
+    for suffix, content in results["files"].items():
+        show_output(view, suffix, content)
+    for suffix, missing in view["missing"].items():
+        if suffix not in view["filled"]:
+            view["slots"][suffix].warning(missing)
+    show_perf(view["slots"]["perf"], results["metrics"])
+
+    show_export(view["slots"]["export"], results, export_profile)
+
+
+def show_results(results, export_profile):
+    """显示分析结果 (全部来自内存,不读写磁盘)"""
+    view = results_layout(
+        results["output_filename"],
+        results["sfma_threshold_nm"],
+        results["tilt_threshold_urad"],
+    )
+    finish_results(view, results, export_profile)
+
+
 # 侧边栏 - 参数设置
 with st.sidebar:
     # 文件上传区域
     uploaded_file = st.file_uploader(
         "上传zygo文件",
-        type=["xyz"],
-        help="请选择要分析的zygo文件",
+        type=["xyz"] + [ext[1:] for ext in PROCESSED_EXTENSIONS],
+        help="请选择要分析的zygo文件,或已处理的数据 (*-processed.txt / *-results.npz)",
         label_visibility="collapsed",
     )
+    if uploaded_file is not None and uploaded_file.name.lower().endswith(
+        PROCESSED_EXTENSIONS
+    ):
+        if uploaded_file.name.lower().endswith(PROCESSED_SUFFIXES):
+            st.caption("已处理的数据直接进入SFMA/局部角/NCE计算,分箱和边缘清除参数不起作用")
+        else:
+            st.warning("只接受本工具输出的 *-processed.txt 或 *-results.npz 作为已处理的数据")
 
     slit_height = st.number_input(
         "调平狭缝宽度 (mm)",
@@ -93,6 +640,12 @@ with st.sidebar:
         step=0.1,
     )
 
+    use_header_scale = st.checkbox(
+        "使用文件头分辨率",
+        value=True,
+        help="从zygo文件头读取数据分辨率,取消勾选后使用下方输入值",
+    )
+
     scale_mm = st.number_input(
         "数据分辨率 (mm)",
         min_value=0.01,
@@ -100,6 +653,7 @@ with st.sidebar:
         value=0.175,
         format="%.3f",
         step=0.001,
+        disabled=use_header_scale,
     )
 
     # 子口径参数
@@ -134,6 +688,14 @@ with st.sidebar:
         step=0.1,
     )
 
+    # 排除区域(缺口、夹持区等)
+    exclusion_text = st.text_area(
+        "排除区域 (mm)",
+        value="",
+        placeholder="annulus 140 150\npolygon -5,-150 5,-150 5,-145 -5,-145",
+        help="每行一个区域: annulus 内半径 外半径 / polygon x1,y1 x2,y2 ...",
+    )
+
     # 阈值设置
     sfma_threshold_nm = st.number_input(
         "SFMA阈值 (nm)",
@@ -153,6 +715,43 @@ with st.sidebar:
         step=0.1,
     )
 
+    # 并行设置
+    sfma_workers = st.number_input(
+        "SFMA并行进程数",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=1,
+        step=1,
+        help="大于1时SFMA扫描按列分配到多个进程计算",
+    )
+    memory_budget_mb = st.number_input(
+        "内存预算 (MB)",
+        min_value=0,
+        value=0,
+        step=64,
+        help="大于0时分块处理放不进内存的大面形 (拼接、高分辨率数据),0 为整体载入内存",
+    )
+
+    # 性能分析 (结果页底部的"性能"中显示)
+    track_memory = st.checkbox(
+        "记录内存峰值",
+        value=False,
+        help="用 tracemalloc 记录各阶段的内存峰值;不使用缓存,分析变慢,图表依次绘制",
+    )
+    use_cprofile = st.checkbox(
+        "cProfile 函数统计",
+        value=False,
+        help="统计整个分析中耗时最多的函数;不使用缓存,图表依次绘制",
+    )
+
+    # 保存图表的格式 (界面中显示低分辨率预览)
+    export_profile = st.selectbox(
+        "保存图表格式",
+        list(EXPORT_PROFILES),
+        format_func=EXPORT_PROFILES.get,
+        help="点击结果页的\"保存图表\"时按此格式重新绘制全部图表",
+    )
+
     # 分析按钮
     analyze_button = st.button("开始分析", type="primary", use_container_width=True)
 
@@ -160,15 +759,59 @@ with st.sidebar:
 if "analysis_results" not in st.session_state:
     st.session_state.analysis_results = None
 
+# 上传了另一个文件时,之前的任务不再需要
+uploaded_id = (
+    None if uploaded_file is None else (uploaded_file.name, uploaded_file.size)
+)
+cancel_stale_job(uploaded_id)
+
+if analyze_button and uploaded_file is not None:
+    # 将mm转换为m
+    params = {
+        "scale": None if use_header_scale else scale_mm * 0.001,  # mm -> m
+        "step_x": sub_x * 0.001,  # mm -> m
+        "step_y": sub_y * 0.001,  # mm -> m
+        "slit_height": slit_height * 0.001,  # mm -> m
+        "edge_clearance": edge_clearance * 0.001,  # mm -> m
+        "sfma_threshold": sfma_threshold_nm * 1e-9,  # nm -> m
+        "tilt_threshold": tilt_threshold_urad * 1e-6,  # urad -> rad
+        "sfma_workers": sfma_workers,
+        "memory_budget": memory_budget_mb * 1024**2 if memory_budget_mb > 0 else None,
+        "render_profile": PREVIEW_PROFILE,
+        "track_memory": track_memory,
+        "cprofile": use_cprofile,
+    }
+    try:
+        params["exclusion_zones"] = parse_exclusion_zones(exclusion_text)
+        # 提交到后台任务队列,页面只轮询进度
+        submit_job(
+            uploaded_file.getvalue(),
+            uploaded_file.name,
+            uploaded_id,
+            params,
+            {
+                "sfma_threshold_nm": sfma_threshold_nm,
+                "tilt_threshold_urad": tilt_threshold_urad,
+            },
+        )
+    except Exception as e:
+        st.error(f"❌ 分析过程中出现错误: {str(e)}")
+        st.exception(e)
+
 # 主界面
-if uploaded_file is None:
+job_id = current_job_id()
+if job_id is not None:
+    # 任务结果按任务ID取出,页面刷新后仍可显示
+    watch_job(job_id, export_profile)
+
+elif uploaded_file is None:
     # 显示使用说明
     st.title("面形分析工具")
     with st.expander("使用说明", expanded=True):
         st.markdown(
             """
         ### 使用步骤:
-        1. 点击左侧 **"上传zygo文件"** 按钮选择文件
+        1. 点击左侧 **"上传zygo文件"** 按钮选择文件 (也可以上传已处理的 `*-processed.txt` 或 `*-results.npz`,跳过分箱直接重新分析)
         2. 调整参数
         3. 点击 **"开始分析"** 按钮
         4. 等待处理完成,查看分析结果
@@ -177,350 +820,7 @@ if uploaded_file is None:
         ### 输出结果:
         - SFMA面形
         - 局部角分布
+        - NCE面形
         - 处理后的数据文件
         """
         )
-
-else:
-    if analyze_button:
-        # 创建持久化临时目录保存文件
-        import shutil
-
-        temp_dir = tempfile.mkdtemp()
-        try:
-            # 保存上传的文件
-            input_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(input_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-
-            # 设置输出路径
-            output_filename = uploaded_file.name.replace(".xyz", "-processed.txt")
-            output_path = os.path.join(temp_dir, output_filename)
-            file_name_suffix = uploaded_file.name.split(".")[0]
-            # 显示进度
-            with st.spinner("正在分析数据,请稍候..."):
-                try:
-                    # 调用处理函数,传递用户配置的参数
-                    # 将mm转换为m
-                    metrics = process_xyz(
-                        input_path,
-                        output_path,
-                        scale=scale_mm * 0.001,  # mm -> m
-                        step_x=sub_x * 0.001,  # mm -> m
-                        step_y=sub_y * 0.001,  # mm -> m
-                        slit_height=slit_height * 0.001,  # mm -> m
-                        edge_clearance=edge_clearance * 0.001,  # mm -> m
-                        sfma_threshold=sfma_threshold_nm * 1e-9,  # nm -> m
-                        tilt_threshold=tilt_threshold_urad * 1e-6,  # urad -> rad
-                    )
-
-                    st.toast("分析完成!", icon="✅", duration=1)
-
-                    # 显示结果
-                    # 图片路径
-                    img_base = output_path.replace(".txt", "")
-                    img_sfma = img_base + "-sfma.png"
-                    img_sfma_high = img_base + "-sfma-high.png"
-                    img_tilt = img_base + "-tilt.png"
-                    img_tilt_high = img_base + "-tilt-high.png"
-
-                    # 准备所有图像的ZIP文件
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, "w") as zf:
-                        if os.path.exists(img_sfma):
-                            zf.write(img_sfma, os.path.basename(img_sfma))
-                        if os.path.exists(img_sfma_high):
-                            zf.write(img_sfma_high, os.path.basename(img_sfma_high))
-                        if os.path.exists(img_tilt):
-                            zf.write(img_tilt, os.path.basename(img_tilt))
-                        if os.path.exists(img_tilt_high):
-                            zf.write(img_tilt_high, os.path.basename(img_tilt_high))
-
-                    # 显示结果标题和下载按钮
-                    h_col1, h_col2, h_col3 = st.columns([6, 1, 1])
-                    with h_col1:
-                        st.header("分析结果")
-                    with h_col2:
-                        st.download_button(
-                            "保存图表",
-                            data=zip_buffer.getvalue(),
-                            file_name=f"{file_name_suffix}_images.zip",
-                            mime="application/zip",
-                            help="下载所有分析图表(ZIP)",
-                        )
-                    with h_col3:
-                        if os.path.exists(output_path):
-                            with open(output_path, "rb") as f:
-                                st.download_button(
-                                    "保存数据",
-                                    f,
-                                    file_name=output_filename,
-                                    mime="text/plain",
-                                    help="下载预处理数据(TXT)",
-                                )
-
-                    if metrics:
-                        # 1. 展示指标值
-                        m_col1, m_col2 = st.columns(2)
-                        with m_col1:
-                            st.metric("SFMA (m+3σ)", f"{metrics['sfma'] * 1e9:.2f} nm")
-                        with m_col2:
-                            st.metric(
-                                "局部角分布 (m+3σ)", f"{metrics['tilt']:.2f} μrad"
-                            )
-
-                        st.markdown("---")
-
-                    # 3. 展示图表
-                    # 第一行：SFMA面形 和 SFMA高阈值
-                    col1, col2 = st.columns(2)
-
-                    with col1:
-                        sub_c1, sub_c2 = st.columns([2, 1])
-                        with sub_c1:
-                            st.subheader("SFMA面形")
-                        with sub_c2:
-                            sfma_txt_path = output_path.replace(".txt", "-sfma.txt")
-                            if os.path.exists(sfma_txt_path):
-                                with open(sfma_txt_path, "rb") as f:
-                                    st.download_button(
-                                        "保存数据",
-                                        f,
-                                        file_name=output_filename.replace(
-                                            ".txt", "-sfma.txt"
-                                        ),
-                                        mime="text/plain",
-                                        help="下载SFMA数据(TXT)",
-                                        key="btn_sfma_data",
-                                    )
-
-                        if os.path.exists(img_sfma):
-                            st.image(
-                                img_sfma,
-                                caption="SFMA面形",
-                                use_container_width=True,
-                            )
-                        else:
-                            st.warning("未生成SFMA面形")
-
-                    with col2:
-                        st.subheader(f"SFMA面形 (>{sfma_threshold_nm}nm)")
-                        if os.path.exists(img_sfma_high):
-                            st.image(
-                                img_sfma_high,
-                                caption=f"SFMA面形 (>{sfma_threshold_nm}nm)",
-                                use_container_width=True,
-                            )
-                        else:
-                            st.warning("未生成SFMA高阈值图")
-
-                    # 第二行：局部角分布 和 局部角分布高阈值
-                    col3, col4 = st.columns(2)
-
-                    with col3:
-                        sub_c3, sub_c4 = st.columns([2, 1])
-                        with sub_c3:
-                            st.subheader("局部角分布")
-                        with sub_c4:
-                            tilt_txt_path = output_path.replace(".txt", "-tilt.txt")
-                            if os.path.exists(tilt_txt_path):
-                                with open(tilt_txt_path, "rb") as f:
-                                    st.download_button(
-                                        "保存数据",
-                                        f,
-                                        file_name=output_filename.replace(
-                                            ".txt", "-tilt.txt"
-                                        ),
-                                        mime="text/plain",
-                                        help="下载局部角数据(TXT)",
-                                        key="btn_tilt_data",
-                                    )
-
-                        if os.path.exists(img_tilt):
-                            st.image(
-                                img_tilt,
-                                caption="局部角分布",
-                                use_container_width=True,
-                            )
-                        else:
-                            st.warning("未生成局部角分布")
-
-                    with col4:
-                        st.subheader(f"局部角分布 (>{tilt_threshold_urad}μrad)")
-                        img_tilt_high = img_base + "-tilt-high.png"
-                        if os.path.exists(img_tilt_high):
-                            st.image(
-                                img_tilt_high,
-                                caption=f"局部角分布 (>{tilt_threshold_urad}μrad)",
-                                use_container_width=True,
-                            )
-                        else:
-                            st.warning("未生成高局部角分布图")
-
-                    # 保存结果到session state
-                    st.session_state.analysis_results = {
-                        "metrics": metrics,
-                        "temp_dir": temp_dir,
-                        "output_path": output_path,
-                        "output_filename": output_filename,
-                        "file_name_suffix": file_name_suffix,
-                        "img_base": img_base,
-                        "img_sfma": img_sfma,
-                        "img_sfma_high": img_sfma_high,
-                        "img_tilt": img_tilt,
-                        "img_tilt_high": img_tilt_high,
-                        "sfma_threshold_nm": sfma_threshold_nm,
-                        "tilt_threshold_urad": tilt_threshold_urad,
-                    }
-
-                except Exception as e:
-                    st.error(f"❌ 分析过程中出现错误: {str(e)}")
-                    st.exception(e)
-                    if "temp_dir" in locals():
-                        shutil.rmtree(temp_dir, ignore_errors=True)
-        except:
-            if "temp_dir" in locals():
-                shutil.rmtree(temp_dir, ignore_errors=True)
-            raise
-
-    # 显示已保存的结果
-    if st.session_state.analysis_results is not None:
-        results = st.session_state.analysis_results
-        metrics = results["metrics"]
-        output_path = results["output_path"]
-        output_filename = results["output_filename"]
-        file_name_suffix = results["file_name_suffix"]
-        img_base = results["img_base"]
-        img_sfma = results["img_sfma"]
-        img_sfma_high = results["img_sfma_high"]
-        img_tilt = results["img_tilt"]
-        img_tilt_high = results["img_tilt_high"]
-        sfma_threshold_nm = results["sfma_threshold_nm"]
-        tilt_threshold_urad = results["tilt_threshold_urad"]
-
-        # 准备所有图像的ZIP文件
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zf:
-            if os.path.exists(img_sfma):
-                zf.write(img_sfma, os.path.basename(img_sfma))
-            if os.path.exists(img_sfma_high):
-                zf.write(img_sfma_high, os.path.basename(img_sfma_high))
-            if os.path.exists(img_tilt):
-                zf.write(img_tilt, os.path.basename(img_tilt))
-            if os.path.exists(img_tilt_high):
-                zf.write(img_tilt_high, os.path.basename(img_tilt_high))
-
-        # 显示结果标题和下载按钮
-        h_col1, h_col2, h_col3 = st.columns([6, 1, 1])
-        with h_col1:
-            st.header("分析结果")
-        with h_col2:
-            st.download_button(
-                "保存图表",
-                data=zip_buffer.getvalue(),
-                file_name=f"{file_name_suffix}_images.zip",
-                mime="application/zip",
-                help="下载所有分析图表(ZIP)",
-            )
-        with h_col3:
-            if os.path.exists(output_path):
-                with open(output_path, "rb") as f:
-                    st.download_button(
-                        "保存数据",
-                        f,
-                        file_name=output_filename,
-                        mime="text/plain",
-                        help="下载预处理数据(TXT)",
-                    )
-
-        if metrics:
-            # 1. 展示指标值
-            m_col1, m_col2 = st.columns(2)
-            with m_col1:
-                st.metric("SFMA (m+3σ)", f"{metrics['sfma'] * 1e9:.2f} nm")
-            with m_col2:
-                st.metric("局部角分布 (m+3σ)", f"{metrics['tilt']:.2f} μrad")
-
-            st.markdown("---")
-
-        # 3. 展示图表
-        # 第一行：SFMA面形 和 SFMA高阈值
-        col1, col2 = st.columns(2)
-
-        with col1:
-            sub_c1, sub_c2 = st.columns([2, 1])
-            with sub_c1:
-                st.subheader("SFMA面形")
-            with sub_c2:
-                sfma_txt_path = output_path.replace(".txt", "-sfma.txt")
-                if os.path.exists(sfma_txt_path):
-                    with open(sfma_txt_path, "rb") as f:
-                        st.download_button(
-                            "保存数据",
-                            f,
-                            file_name=output_filename.replace(".txt", "-sfma.txt"),
-                            mime="text/plain",
-                            help="下载SFMA数据(TXT)",
-                            key="btn_sfma_data",
-                        )
-
-            if os.path.exists(img_sfma):
-                st.image(
-                    img_sfma,
-                    caption="SFMA面形",
-                    use_container_width=True,
-                )
-            else:
-                st.warning("未生成SFMA面形")
-
-        with col2:
-            st.subheader(f"SFMA面形 (>{sfma_threshold_nm}nm)")
-            if os.path.exists(img_sfma_high):
-                st.image(
-                    img_sfma_high,
-                    caption=f"SFMA面形 (>{sfma_threshold_nm}nm)",
-                    use_container_width=True,
-                )
-            else:
-                st.warning("未生成SFMA高阈值图")
-
-        # 第二行：局部角分布 和 局部角分布高阈值
-        col3, col4 = st.columns(2)
-
-        with col3:
-            sub_c3, sub_c4 = st.columns([2, 1])
-            with sub_c3:
-                st.subheader("局部角分布")
-            with sub_c4:
-                tilt_txt_path = output_path.replace(".txt", "-tilt.txt")
-                if os.path.exists(tilt_txt_path):
-                    with open(tilt_txt_path, "rb") as f:
-                        st.download_button(
-                            "保存数据",
-                            f,
-                            file_name=output_filename.replace(".txt", "-tilt.txt"),
-                            mime="text/plain",
-                            help="下载局部角数据(TXT)",
-                            key="btn_tilt_data",
-                        )
-
-            if os.path.exists(img_tilt):
-                st.image(
-                    img_tilt,
-                    caption="局部角分布",
-                    use_container_width=True,
-                )
-            else:
-                st.warning("未生成局部角分布")
-
-        with col4:
-            st.subheader(f"局部角分布 (>{tilt_threshold_urad}μrad)")
-            img_tilt_high = img_base + "-tilt-high.png"
-            if os.path.exists(img_tilt_high):
-                st.image(
-                    img_tilt_high,
-                    caption=f"局部角分布 (>{tilt_threshold_urad}μrad)",
-                    use_container_width=True,
-                )
-            else:
-                st.warning("未生成高局部角分布图")
@@ -0,0 +1,351 @@
+"""
+批量分析
+对目录或通配符匹配到的全部XYZ文件并行运行 process_xyz,汇总各文件指标
+
+使用方法:
+    python batch.py "data/*.xyz" -o output --workers 4 --timeout 600
+    python batch.py data/ -o output              # 目录: 分析其中全部 .xyz 文件
+
+每个文件完成后立即追加到输出目录下的 batch-journal.jsonl;
+中断后以相同参数重新运行会跳过已成功的文件,仅处理剩余和失败的文件
+"""
+
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from binning import parse_exclusion_zones
+from perf import PERF_KEY, numeric_metrics
+from process_xyz import RENDER_PROFILES, process_xyz
+from result_cache import DEFAULT_CACHE_DIR, ResultCache, cached_process_xyz
+
+JOURNAL_NAME = "batch-journal.jsonl"
+SUMMARY_FIELDS = [
+    "file",
+    "status",
+    "sfma_nm",
+    "tilt_urad",
+    "nce_nm",
+    "scale_mm",
+    "seconds",
+    "error",
+]
+
+
+def collect_inputs(patterns):
+    """展开目录和通配符,返回去重并排序后的XYZ文件绝对路径"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "*.xyz"))
+        else:
+            matches = glob.glob(pattern)
+        paths.update(os.path.abspath(p) for p in matches if os.path.isfile(p))
+    return sorted(paths)
+
+
+def output_path_for(input_path, output_dir):
+    """输出文件路径,与界面中的命名一致: <文件名>-processed.txt"""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{stem}-processed.txt")
+
+
+def load_journal(journal_path):
+    """读取日志,返回 {输入文件: 最后一条记录};中断时写了一半的行忽略"""
+    records = {}
+    if not os.path.exists(journal_path):
+        return records
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["file"]] = record
+    return records
+
+
+def _analyze(input_path, output_path, params, conn, cache_dir=None):
+    """子进程入口: 运行 process_xyz,日志写入同名 .log 文件,结果经管道返回"""
+    log_path = output_path.replace(".txt", ".log")
+    try:
+        with open(log_path, "w", encoding="utf-8") as log:
+            with contextlib.redirect_stdout(log):
+                # 文件之间已按进程并行,每个进程内依次绘图
+                if cache_dir is None:
+                    metrics = process_xyz(
+                        input_path, output_path, plot_workers=1, **params
+                    )
+                else:
+                    metrics = cached_process_xyz(
+                        input_path,
+                        output_path,
+                        ResultCache(cache_dir),
+                        plot_workers=1,
+                        **params,
+                    )
+        if metrics is None:
+            conn.send(("error", "没有有效数据", None))
+        else:
+            # 各阶段耗时随指标写入日志 (结果缓存命中时没有)
+            result = numeric_metrics(metrics)
+            if PERF_KEY in metrics:
+                result[PERF_KEY] = metrics[PERF_KEY]
+            conn.send(("ok", None, result))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}", None))
+    finally:
+        conn.close()
+
+
+def run_batch(
+    inputs, output_dir, params, workers=1, timeout=None, journal=None, cache_dir=None
+):
+    """
+    以最多 workers 个进程并行分析 inputs,超过 timeout 秒的文件被终止
+
+    每个文件结束后调用 journal(record);cache_dir 不为 None 时使用结果缓存;
+    返回全部记录
+    """
+    ctx = multiprocessing.get_context()
+    pending = list(inputs)
+    running = {}
+    records = []
+
+    def finish(conn, status, error=None, metrics=None):
+        process, input_path, started = running.pop(conn)
+        process.join()
+        conn.close()
+        record = {
+            "file": input_path,
+            "status": status,
+            "seconds": round(time.monotonic() - started, 3),
+            "error": error,
+            "metrics": metrics,
+            "params": params,
+        }
+        records.append(record)
+        if journal is not None:
+            journal(record)
+
+        done = len(records)
+        total = done + len(pending) + len(running)
+        name = os.path.basename(input_path)
+        print(f"[{done}/{total}] {name}: {status} ({record['seconds']:.1f} s)")
+        if error:
+            print(f"    {error}")
+
+    while pending or running:
+        while pending and len(running) < workers:
+            input_path = pending.pop(0)
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_analyze,
+                args=(input_path, output_path_for(input_path, output_dir), params),
+                kwargs={"conn": send_conn, "cache_dir": cache_dir},
+                daemon=True,
+            )
+            process.start()
+            send_conn.close()
+            running[recv_conn] = (process, input_path, time.monotonic())
+
+        wait_for = None
+        if timeout is not None:
+            oldest = min(started for _, _, started in running.values())
+            wait_for = max(0.0, oldest + timeout - time.monotonic())
+
+        for conn in wait(list(running), timeout=wait_for):
+            try:
+                status, error, metrics = conn.recv()
+            except EOFError:
+                exitcode = running[conn][0].exitcode
+                status, error, metrics = "error", f"子进程异常退出 ({exitcode})", None
+            finish(conn, status, error, metrics)
+
+        if timeout is not None:
+            now = time.monotonic()
+            for conn, (process, _, started) in list(running.items()):
+                if now - started >= timeout:
+                    process.terminate()
+                    finish(conn, "timeout", f"超过 {timeout:g} s 未完成")
+
+    return records
+
+
+def summary_row(record):
+    """日志记录转换为汇总表的一行 (显示单位)"""
+    metrics = record.get("metrics") or {}
+
+    def scaled(key, factor):
+        value = metrics.get(key)
+        return None if value is None else value * factor
+
+    return {
+        "file": os.path.basename(record["file"]),
+        "status": record["status"],
+        "sfma_nm": scaled("sfma", 1e9),
+        "tilt_urad": scaled("tilt", 1.0),
+        "nce_nm": scaled("nce", 1e9),
+        "scale_mm": scaled("scale", 1e3),
+        "seconds": record.get("seconds"),
+        "error": record.get("error"),
+    }
+
+
+def write_summary(rows, output_dir):
+    """写出 summary.csv 和 summary.json"""
+    csv_path = os.path.join(output_dir, "summary.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    # NaN (如预处理数据输入时的分辨率) 不是合法的JSON,写为 null
+    json_rows = [
+        {
+            key: (
+                None if isinstance(value, float) and not math.isfinite(value) else value
+            )
+            for key, value in row.items()
+        }
+        for row in rows
+    ]
+    json_path = os.path.join(output_dir, "summary.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(json_rows, f, ensure_ascii=False, indent=2, allow_nan=False)
+
+    return csv_path, json_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量面形分析")
+    parser.add_argument("inputs", nargs="+", help="XYZ文件、通配符或目录")
+    parser.add_argument("-o", "--output-dir", default="output", help="输出目录")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="并行进程数"
+    )
+    parser.add_argument("--timeout", type=float, help="单个文件的超时时间 (s)")
+    parser.add_argument(
+        "--restart", action="store_true", help="忽略已有日志,重新分析全部文件"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        nargs="?",
+        const=DEFAULT_CACHE_DIR,
+        help=f"使用结果缓存,相同文件和参数直接取出已有结果 (默认 {DEFAULT_CACHE_DIR})",
+    )
+    parser.add_argument("--scale", type=float, help="数据分辨率 (mm),默认读取文件头")
+    parser.add_argument("--step-x", type=float, default=3.4, help="X方向口径 (mm)")
+    parser.add_argument("--step-y", type=float, default=0.5, help="Y方向口径 (mm)")
+    parser.add_argument(
+        "--slit-height", type=float, default=8.0, help="调平狭缝宽度 (mm)"
+    )
+    parser.add_argument(
+        "--edge-clearance", type=float, default=50.0, help="边缘清除量 (mm)"
+    )
+    parser.add_argument("--exclusion-zones", help="排除区域文件 (mm,格式同界面)")
+    parser.add_argument(
+        "--sfma-threshold", type=float, default=7.5, help="SFMA阈值 (nm)"
+    )
+    parser.add_argument(
+        "--tilt-threshold", type=float, default=3.0, help="局部角阈值 (μrad)"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        help="分块处理大面形,每个进程的内存预算 (MB);默认整体载入内存",
+    )
+    parser.add_argument(
+        "--render-profile",
+        choices=list(RENDER_PROFILES),
+        default="archival",
+        help="图表输出规格: archival 300 dpi PNG, preview 低分辨率PNG, svg/pdf 矢量图",
+    )
+    args = parser.parse_args(argv)
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("没有找到XYZ文件")
+
+    stems = [os.path.basename(output_path_for(p, "")) for p in inputs]
+    if len(set(stems)) != len(stems):
+        parser.error("存在同名的输入文件,输出会相互覆盖")
+
+    exclusion_zones = []
+    if args.exclusion_zones:
+        with open(args.exclusion_zones, "r", encoding="utf-8") as f:
+            exclusion_zones = parse_exclusion_zones(f.read())
+
+    # 将mm转换为m
+    params = {
+        "scale": None if args.scale is None else args.scale * 0.001,
+        "step_x": args.step_x * 0.001,
+        "step_y": args.step_y * 0.001,
+        "slit_height": args.slit_height * 0.001,
+        "edge_clearance": args.edge_clearance * 0.001,
+        "sfma_threshold": args.sfma_threshold * 1e-9,  # nm -> m
+        "tilt_threshold": args.tilt_threshold * 1e-6,  # urad -> rad
+        "exclusion_zones": exclusion_zones,
+        "render_profile": args.render_profile,
+    }
+    if args.memory_budget is not None:
+        params["memory_budget"] = args.memory_budget * 1024**2
+    # 与日志中的参数比较时统一为JSON形式 (元组 -> 列表)
+    params = json.loads(json.dumps(params))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    journal_path = os.path.join(args.output_dir, JOURNAL_NAME)
+    if args.restart and os.path.exists(journal_path):
+        os.remove(journal_path)
+
+    previous = load_journal(journal_path)
+    todo = [
+        p
+        for p in inputs
+        if not (
+            p in previous
+            and previous[p]["status"] == "ok"
+            and previous[p]["params"] == params
+        )
+    ]
+    print(f"共 {len(inputs)} 个文件,已完成 {len(inputs) - len(todo)} 个")
+
+    with open(journal_path, "a", encoding="utf-8") as journal:
+
+        def append(record):
+            journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            journal.flush()
+            previous[record["file"]] = record
+
+        run_batch(
+            todo,
+            args.output_dir,
+            params,
+            args.workers,
+            args.timeout,
+            append,
+            args.cache_dir,
+        )
+
+    rows = [summary_row(previous[p]) for p in inputs if p in previous]
+    csv_path, json_path = write_summary(rows, args.output_dir)
+    failed = sum(row["status"] != "ok" for row in rows)
+    print(f"汇总: {csv_path}, {json_path} (失败 {failed} 个)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,392 @@
+"""
+性能基准测试
+生成合成的Zygo XYZ文件,比较旧版逐行解析与分块向量化读取的耗时
+
+使用方法:
+    python benchmark.py [--diameter 300] [--pitch 0.175]
+
+    # 基准套件: 多个口径下 process_xyz 各阶段的耗时和内存峰值,结果写入JSON
+    python benchmark.py --suite --sizes 100 200 300 --output bench.json
+    python benchmark.py --suite --compare bench-old.json   # 与之前的结果对比
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import matplotlib
+import numpy as np
+
+matplotlib.use("Agg")
+
+from perf import PERF_KEY
+from process_xyz import calculate_dynamic_sfma, process_xyz, remove_tilt
+from sfma import slit_columns
+from xyz_reader import read_xyz
+
+# 基准结果文件格式版本
+SUITE_VERSION = 1
+
+
+def write_synthetic_xyz(
+    path, diameter_mm=300.0, pitch_mm=0.175, dropout=0.002, seed=0, patches=0
+):
+    """
+    生成合成的Zygo格式XYZ文件
+
+    圆形口径外的像素以及随机丢失的像素写为 "No Data";
+    patches > 0 时另有 patches 个成片丢失的圆斑 (颗粒、反光等,直径 1~5mm)
+    """
+    rng = np.random.default_rng(seed)
+    n = int(round(diameter_mm / pitch_mm)) + 1
+    scale = pitch_mm * 0.001
+
+    iy, ix = np.mgrid[0:n, 0:n]
+    cx = cy = (n - 1) / 2.0
+    x = (ix - cx) * scale
+    y = (cy - iy) * scale
+    r = np.sqrt(x**2 + y**2)
+    radius = diameter_mm * 0.0005
+
+    # 面形: 倾斜 + 离焦 + 少量随机高频起伏,单位微米
+    z_um = (
+        0.2 * x / radius + 0.5 * (r / radius) ** 2 + 0.01 * rng.standard_normal((n, n))
+    )
+    valid = (r <= radius) & (rng.random((n, n)) >= dropout)
+    for _ in range(patches):
+        center = rng.uniform(-radius, radius, 2)
+        patch_r = rng.uniform(0.5e-3, 2.5e-3)
+        valid &= (x - center[0]) ** 2 + (y - center[1]) ** 2 > patch_r**2
+
+    header = [
+        "Zygo XYZ Data File - Format 1",
+        '1 8 3 5 "Thu Sep 12 10:32:39 2025"',
+        "0 0 0 0 0 0",
+        f"0 0 {n} {n}",
+        '""',
+        '""',
+        '""',
+        f"0 0.5 6.328e-007 0.5 1 0 {scale:.8f} 1757694759",
+        f'{n} {n} 0 0 0 0 ""',
+        "0 1 0 0 0 0 0 0 0 0",
+        "1 0 0 0 0 0 0 0 0",
+        '0 ""',
+        "1 0",
+        "#",
+    ]
+
+    with open(path, "w") as f:
+        f.write("\n".join(header) + "\n")
+        for row in range(n):
+            lines = []
+            for col in range(n):
+                if valid[row, col]:
+                    lines.append(f"{col} {row} {z_um[row, col]:.6f}\n")
+                else:
+                    lines.append(f"{col} {row} No Data\n")
+            f.write("".join(lines))
+        f.write("#\n")
+
+    return int(valid.sum())
+
+
+def legacy_parse(input_path):
+    """旧版 process_xyz 的解析方式: readlines + 逐行 split + 列表"""
+    with open(input_path, "r") as f:
+        lines = f.readlines()
+
+    raw_data = []
+    for line in lines[14:]:
+        parts = line.strip().split()
+        if len(parts) < 3:
+            continue
+
+        try:
+            ix = int(parts[0])
+            iy = int(parts[1])
+            if parts[2] == "No":
+                continue
+            z_um = float(parts[2])
+            raw_data.append((ix, iy, z_um))
+        except ValueError:
+            continue
+
+    return raw_data
+
+
+def bench_parser(path):
+    """比较两种解析方式的耗时并校验结果一致"""
+    t0 = time.perf_counter()
+    raw_data = legacy_parse(path)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ix, iy, z_um = read_xyz(path)
+    t_reader = time.perf_counter() - t0
+
+    legacy = np.array(raw_data, dtype=np.float64).reshape(-1, 3)
+    assert len(legacy) == len(z_um)
+    assert np.array_equal(legacy[:, 0], ix)
+    assert np.array_equal(legacy[:, 1], iy)
+    assert np.array_equal(legacy[:, 2], z_um)
+
+    print(f"有效点数: {len(z_um)}")
+    print(f"旧版解析: {t_legacy:.3f} s")
+    print(f"分块读取: {t_reader:.3f} s  (加速 {t_legacy / t_reader:.1f}x)")
+
+
+def synthetic_map(diameter_mm=300.0, step_x_mm=3.4, step_y_mm=0.5, seed=0):
+    """
+    生成与 process_xyz 分箱结果同格式的合成面形 (x, y, z),单位米
+    """
+    rng = np.random.default_rng(seed)
+    radius = diameter_mm * 0.0005
+    step_x, step_y = step_x_mm * 0.001, step_y_mm * 0.001
+
+    grid_x = (
+        np.floor(-radius / step_x) * step_x
+        + np.arange(int(np.ceil(2 * radius / step_x)) + 1) * step_x
+    )
+    grid_y = (
+        np.floor(-radius / step_y) * step_y
+        + np.arange(int(np.ceil(2 * radius / step_y)) + 1) * step_y
+    )
+    GX, GY = np.meshgrid(grid_x, grid_y)
+    inside = np.sqrt(GX**2 + GY**2) <= radius
+
+    x, y = GX[inside], GY[inside]
+    r = np.sqrt(x**2 + y**2) / radius
+    z = 2e-7 * x / radius + 5e-7 * r**2 + 1e-8 * rng.standard_normal(len(x))
+    return x, y, z
+
+
+def _scan_columns(x, slit_w=0.026, slit_step_x=0.013):
+    """SFMA 扫描的列数,与 calculate_dynamic_sfma 的网格推断方式一致"""
+    x_sorted = np.unique(x)
+    step_x = np.median(np.diff(x_sorted))
+    n_cols = int(round((x_sorted[-1] - x_sorted[0]) / step_x)) + 1
+    slit_px_w = int(round(slit_w / step_x))
+    return len(slit_columns(n_cols, slit_px_w, int(round(slit_step_x / step_x))))
+
+
+def bench_sfma(x, y, z, engines=("loop", "integral", "batched"), rtol=1e-6):
+    """比较各SFMA引擎的耗时,并以第一个引擎为参考校验结果"""
+    z_resid = remove_tilt(x, y, z)
+    n_columns = _scan_columns(x)
+    print(f"数据点数: {len(x)}, 扫描列数: {n_columns}")
+
+    results, timings = {}, {}
+    for engine in engines:
+        t0 = time.perf_counter()
+        results[engine] = calculate_dynamic_sfma(x, y, z_resid, engine=engine)
+        timings[engine] = time.perf_counter() - t0
+
+    reference = results[engines[0]]
+    scale = np.nanmax(np.abs(reference))
+    for engine in engines:
+        assert np.array_equal(np.isnan(reference), np.isnan(results[engine]))
+        max_diff = np.nanmax(np.abs(results[engine] - reference))
+        assert max_diff <= rtol * scale, f"{engine} 与 {engines[0]} 结果不一致"
+        print(
+            f"SFMA {engine:>8}: {timings[engine]:.3f} s, "
+            f"每列 {timings[engine] / n_columns * 1e3:.2f} ms "
+            f"(加速 {timings[engines[0]] / timings[engine]:.1f}x), "
+            f"最大偏差 {max_diff:.3e} m"
+        )
+
+
+def profile_run(input_path, output_path, track_memory=False, **params):
+    """
+    运行一次 process_xyz (绘图依次进行,各阶段耗时互不重叠),
+    按阶段汇总其返回的性能记录
+
+    返回 (各阶段记录, 总耗时 s, 内存峰值 MB 或 None)
+    """
+    metrics = process_xyz(
+        input_path, output_path, plot_workers=1, track_memory=track_memory, **params
+    )
+    perf = metrics[PERF_KEY]
+    stages = {}
+    for record in perf["stages"]:
+        stage = stages.setdefault(record["stage"], {"seconds": 0.0})
+        stage["seconds"] += record["seconds"]
+        if "peak_mb" in record:
+            stage["peak_mb"] = max(stage.get("peak_mb", 0.0), record["peak_mb"])
+    return stages, perf["seconds"], perf["peak_mb"]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, pitch_mm=0.175, repeat=1, track_memory=True, **params):
+    """
+    基准套件: 对每个口径生成合成XYZ文件,测量 process_xyz 各阶段的耗时和内存峰值
+
+    耗时取 repeat 次运行中各阶段的最小值;内存单独运行一次 (tracemalloc
+    会拖慢纯Python代码,不与计时混在一起)。返回可JSON序列化的结果
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for diameter in sizes:
+            input_path = os.path.join(temp_dir, f"wafer-{diameter:g}mm.xyz")
+            output_path = os.path.join(temp_dir, f"wafer-{diameter:g}mm-processed.txt")
+            n_points = write_synthetic_xyz(input_path, diameter, pitch_mm, patches=20)
+            file_mb = os.path.getsize(input_path) / 1e6
+            print(f"口径 {diameter:g}mm: {n_points} 点, {file_mb:.1f} MB")
+
+            stages, total = {}, None
+            for _ in range(repeat):
+                run_stages, run_total, _ = profile_run(
+                    input_path, output_path, **params
+                )
+                total = run_total if total is None else min(total, run_total)
+                for name, record in run_stages.items():
+                    best = stages.setdefault(name, dict(record))
+                    best["seconds"] = min(best["seconds"], record["seconds"])
+
+            peak_mb = None
+            if track_memory:
+                memory_stages, _, peak_mb = profile_run(
+                    input_path, output_path, track_memory=True, **params
+                )
+                for name, record in memory_stages.items():
+                    stages[name]["peak_mb"] = record["peak_mb"]
+
+            for name, record in stages.items():
+                peak = record.get("peak_mb")
+                peak_text = "" if peak is None else f", 峰值 {peak:8.1f} MB"
+                print(f"    {name:<14} {record['seconds']:8.3f} s{peak_text}")
+            peak_text = "" if peak_mb is None else f", 峰值 {peak_mb:.1f} MB"
+            print(f"    {'总计':<12} {total:8.3f} s{peak_text}")
+
+            results.append(
+                {
+                    "diameter_mm": diameter,
+                    "pitch_mm": pitch_mm,
+                    "points": n_points,
+                    "file_mb": round(file_mb, 3),
+                    "total_seconds": total,
+                    "peak_mb": peak_mb,
+                    "stages": stages,
+                }
+            )
+
+    return {
+        "version": SUITE_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "params": params,
+        "results": results,
+    }
+
+
+def compare_suites(current, previous):
+    """逐口径、逐阶段对比两次基准结果的耗时 (比值 < 1 为变快)"""
+    before = {r["diameter_mm"]: r for r in previous["results"]}
+    print(f"\n对比 {previous.get('commit')} -> {current.get('commit')}")
+    for result in current["results"]:
+        old = before.get(result["diameter_mm"])
+        if old is None:
+            continue
+        print(f"口径 {result['diameter_mm']:g}mm:")
+        rows = [(name, record["seconds"]) for name, record in result["stages"].items()]
+        rows.append(("总计", result["total_seconds"]))
+        old_seconds = {name: r["seconds"] for name, r in old["stages"].items()}
+        old_seconds["总计"] = old["total_seconds"]
+        for name, seconds in rows:
+            if name in old_seconds and old_seconds[name] > 0:
+                print(
+                    f"    {name:<14} {old_seconds[name]:8.3f} s -> {seconds:8.3f} s "
+                    f"({seconds / old_seconds[name]:.2f}x)"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="面形分析性能基准测试")
+    parser.add_argument("--diameter", type=float, default=300.0, help="口径 (mm)")
+    parser.add_argument("--pitch", type=float, default=0.175, help="像素间距 (mm)")
+    parser.add_argument(
+        "--map", help="SFMA 对比使用的已处理数据 (x y z 文本,如 example/005-avg.txt)"
+    )
+    parser.add_argument(
+        "--suite", action="store_true", help="运行基准套件 (各阶段耗时和内存峰值)"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="+",
+        default=[100.0, 200.0, 300.0],
+        help="基准套件的口径 (mm)",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="计时重复次数,取最小值")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="不测量内存 (省去一次运行)"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        help="基准套件以分块方式处理,内存预算 (MB)",
+    )
+    parser.add_argument("--output", help="基准结果JSON文件")
+    parser.add_argument("--compare", help="与之前的基准结果JSON对比")
+    args = parser.parse_args()
+
+    if args.suite:
+        suite = run_suite(
+            args.sizes,
+            args.pitch,
+            repeat=args.repeat,
+            track_memory=not args.no_memory,
+            edge_clearance=0.005,
+            memory_budget=(
+                None if args.memory_budget is None else args.memory_budget * 1024**2
+            ),
+        )
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(suite, f, ensure_ascii=False, indent=2)
+            print(f"基准结果: {args.output}")
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                compare_suites(suite, json.load(f))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "synthetic.xyz")
+        print(f"生成合成数据: 口径 {args.diameter}mm, 间距 {args.pitch}mm")
+        write_synthetic_xyz(path, args.diameter, args.pitch)
+        print(f"文件大小: {os.path.getsize(path) / 1e6:.1f} MB")
+        bench_parser(path)
+
+    if args.map:
+        print(f"\nSFMA 引擎对比: {args.map}")
+        x, y, z = np.loadtxt(args.map, unpack=True)
+    else:
+        print(f"\nSFMA 引擎对比: 口径 {args.diameter}mm")
+        x, y, z = synthetic_map(args.diameter)
+    bench_sfma(x, y, z)
+
+
+if __name__ == "__main__":
+    main()
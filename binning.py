@@ -0,0 +1,244 @@
+"""
+子口径分箱模块
+将物理坐标下的数据点按 (step_x, step_y) 网格求平均
+"""
+
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+import numpy as np
+from matplotlib.path import Path
+
+
+@dataclass
+class BinnedGrid:
+    """
+    分箱结果
+
+    z_sum, count: 每个子口径内高度值之和与点数,形状 (n_rows, n_cols),
+                  行对应 k_y,列对应 k_x
+    start_x, start_y: 网格起点,单位米
+    step_x, step_y: 子口径尺寸,单位米
+    k0_x, k0_y: 第0列/第0行对应的分箱编号
+    """
+
+    z_sum: np.ndarray
+    count: np.ndarray
+    start_x: float
+    start_y: float
+    step_x: float
+    step_y: float
+    k0_x: int = 0
+    k0_y: int = 0
+
+    @property
+    def shape(self):
+        return self.count.shape
+
+    @property
+    def geometry(self):
+        """网格几何参数,用作掩膜缓存的键"""
+        return (
+            self.shape,
+            self.start_x,
+            self.start_y,
+            self.step_x,
+            self.step_y,
+            self.k0_x,
+            self.k0_y,
+        )
+
+    def rows(self, start, stop):
+        """第 start 至 stop-1 行组成的子网格 (数组为视图),用于按行带处理"""
+        return replace(
+            self,
+            z_sum=self.z_sum[start:stop],
+            count=self.count[start:stop],
+            k0_y=self.k0_y + start,
+        )
+
+    @property
+    def occupied(self):
+        """含有数据点的子口径"""
+        return self.count > 0
+
+    def centers(self):
+        """各列/各行子口径中心坐标"""
+        n_rows, n_cols = self.shape
+        grid_x = self.start_x + (self.k0_x + np.arange(n_cols)) * self.step_x
+        grid_y = self.start_y + (self.k0_y + np.arange(n_rows)) * self.step_y
+        return grid_x, grid_y
+
+    def mean(self, mask=None):
+        """
+        平均高度的二维网格,空子口径为 NaN
+
+        mask: 可选的布尔网格,为 False 的子口径同样置为 NaN
+        """
+        valid = self.occupied if mask is None else (self.occupied & mask)
+        grid = np.full(self.shape, np.nan)
+        grid[valid] = self.z_sum[valid] / self.count[valid]
+        return grid
+
+    def points(self, mask=None):
+        """
+        稀疏形式的分箱结果,按 (k_y, k_x) 升序排列
+
+        返回:
+            x, y, z: 子口径中心坐标和平均高度
+        """
+        valid = self.occupied if mask is None else (self.occupied & mask)
+        rows, cols = np.nonzero(valid)
+        x = self.start_x + (self.k0_x + cols) * self.step_x
+        y = self.start_y + (self.k0_y + rows) * self.step_y
+        z = self.z_sum[rows, cols] / self.count[rows, cols]
+        return x, y, z
+
+
+def bin_points(x, y, z, step_x, step_y):
+    """
+    将数据点分箱到 (step_x, step_y) 网格并累加
+
+    网格起点为 floor(min / step) * step,每个点归入四舍五入后最近的子口径;
+    np.bincount 按输入顺序逐点累加,结果与逐点字典累加完全一致
+    """
+    start_x = np.floor(np.min(x) / step_x) * step_x
+    start_y = np.floor(np.min(y) / step_y) * step_y
+
+    k_x = np.round((x - start_x) / step_x).astype(np.int64)
+    k_y = np.round((y - start_y) / step_y).astype(np.int64)
+
+    k0_x, k0_y = int(k_x.min()), int(k_y.min())
+    n_cols = int(k_x.max()) - k0_x + 1
+    n_rows = int(k_y.max()) - k0_y + 1
+
+    flat = np.ravel_multi_index((k_y - k0_y, k_x - k0_x), (n_rows, n_cols))
+    z_sum = np.bincount(flat, weights=z, minlength=n_rows * n_cols)
+    count = np.bincount(flat, minlength=n_rows * n_cols)
+
+    return BinnedGrid(
+        z_sum=z_sum.reshape(n_rows, n_cols),
+        count=count.reshape(n_rows, n_cols),
+        start_x=start_x,
+        start_y=start_y,
+        step_x=step_x,
+        step_y=step_y,
+        k0_x=k0_x,
+        k0_y=k0_y,
+    )
+
+
+def max_radius(binned):
+    """有数据子口径中心的最大半径,单位米;没有数据时为 -inf"""
+    rows, cols = np.nonzero(binned.occupied)
+    if len(rows) == 0:
+        return -np.inf
+    grid_x, grid_y = binned.centers()
+    return np.max(np.sqrt(grid_x[cols] ** 2 + grid_y[rows] ** 2))
+
+
+def clearance_radius(binned, edge_clearance, radius=None):
+    """
+    计算边缘清除后的保留半径
+
+    原始半径取有数据子口径中心的最大半径,四舍五入到毫米后减去清除量;
+    radius 为已知的最大半径 (如按行带分别求得后取最大),默认由 binned 计算
+
+    返回:
+        original_radius_mm: 原始半径,单位毫米
+        clearance_radius_mm: 清除后半径,单位毫米
+    """
+    if radius is None:
+        radius = max_radius(binned)
+
+    original_radius_mm = round(radius * 1000)  # 转换为mm并四舍五入
+    clearance_radius_mm = original_radius_mm - (edge_clearance * 1000)  # 减去清除量
+    return original_radius_mm, clearance_radius_mm
+
+
+def freeze_zones(exclusion_zones):
+    """将排除区域转换为可哈希的元组形式"""
+    if not exclusion_zones:
+        return ()
+
+    frozen = []
+    for zone in exclusion_zones:
+        kind = zone[0]
+        if kind == "annulus":
+            frozen.append(("annulus", float(zone[1]), float(zone[2])))
+        elif kind == "polygon":
+            vertices = tuple((float(px), float(py)) for px, py in zone[1])
+            frozen.append(("polygon", vertices))
+        else:
+            raise ValueError(f"未知的排除区域类型: {kind}")
+    return tuple(frozen)
+
+
+def parse_exclusion_zones(text):
+    """
+    解析排除区域文本,每行一个区域,单位毫米
+
+        annulus r_inner r_outer
+        polygon x1,y1 x2,y2 x3,y3 ...
+
+    返回单位为米的排除区域列表
+    """
+    zones = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts or parts[0].startswith("#"):
+            continue
+
+        kind = parts[0].lower()
+        if kind == "annulus" and len(parts) == 3:
+            zones.append(("annulus", float(parts[1]) * 1e-3, float(parts[2]) * 1e-3))
+        elif kind == "polygon" and len(parts) >= 4:
+            vertices = []
+            for vertex in parts[1:]:
+                px, py = vertex.split(",")
+                vertices.append((float(px) * 1e-3, float(py) * 1e-3))
+            zones.append(("polygon", vertices))
+        else:
+            raise ValueError(f"无法解析排除区域: {line.strip()}")
+    return zones
+
+
+@lru_cache(maxsize=32)
+def _geometry_mask(geometry, radius_limit, exclusion_zones):
+    """按网格几何计算保留掩膜,同一几何参数只计算一次"""
+    shape, start_x, start_y, step_x, step_y, k0_x, k0_y = geometry
+    n_rows, n_cols = shape
+    grid_x = start_x + (k0_x + np.arange(n_cols)) * step_x
+    grid_y = start_y + (k0_y + np.arange(n_rows)) * step_y
+    radius = np.sqrt(grid_x[np.newaxis, :] ** 2 + grid_y[:, np.newaxis] ** 2)
+
+    keep = radius <= radius_limit
+
+    for zone in exclusion_zones:
+        if zone[0] == "annulus":
+            _, r_inner, r_outer = zone
+            keep &= ~((radius >= r_inner) & (radius <= r_outer))
+        else:
+            GX, GY = np.meshgrid(grid_x, grid_y)
+            centers = np.column_stack([GX.ravel(), GY.ravel()])
+            inside = Path(zone[1]).contains_points(centers).reshape(shape)
+            keep &= ~inside
+
+    keep.flags.writeable = False
+    return keep
+
+
+def keep_mask(binned, radius_limit=np.inf, exclusion_zones=None, cached=True):
+    """
+    子口径保留掩膜: 半径不超过 radius_limit 且不在任何排除区域内
+
+    掩膜只依赖网格几何、保留半径和排除区域,按这些参数缓存,
+    相同几何的多个文件复用同一掩膜 (返回只读数组);
+    cached=False 时不缓存 (按行带处理时各行带几何不同,缓存无益)
+
+    exclusion_zones: 排除区域列表,单位米
+        ("annulus", r_inner, r_outer): 半径在 [r_inner, r_outer] 内的环带
+        ("polygon", [(x1, y1), (x2, y2), ...]): 多边形内部
+    """
+    mask = _geometry_mask if cached else _geometry_mask.__wrapped__
+    return mask(binned.geometry, float(radius_limit), freeze_zones(exclusion_zones))
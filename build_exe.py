@@ -59,6 +59,18 @@ a = Analysis(
     datas=[
         ('app.py', '.'),
         ('process_xyz.py', '.'),
+        ('xyz_reader.py', '.'),
+        ('binning.py', '.'),
+        ('sfma.py', '.'),
+        ('tilt.py', '.'),
+        ('surface_grid.py', '.'),
+        ('result_cache.py', '.'),
+        ('result_io.py', '.'),
+        ('perf.py', '.'),
+        ('progress.py', '.'),
+        ('jobs.py', '.'),
+        ('out_of_core.py', '.'),
+        ('stage_cache.py', '.'),
         ('analyze_data.py', '.'),
     ] + datas,
     hiddenimports=[
@@ -0,0 +1,397 @@
+"""
+后台分析任务队列
+界面提交的分析作为任务排队,由固定数量的工作线程依次执行,
+同时运行的分析不超过工作线程数;页面只按任务ID查询进度和结果。
+
+每个任务是 job_dir 下以任务ID命名的目录,包含上传的文件、job.json (状态、参数)、
+metrics.json (指标) 和全部输出文件;进程重启后未完成的任务重新排队,
+已完成的任务仍可按ID取出结果
+"""
+
+import contextlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+from perf import PERF_KEY, numeric_metrics
+from process_xyz import OUTPUT_SUFFIXES, output_files, process_xyz
+from progress import AnalysisCancelled, CancelToken
+from result_cache import cached_process_xyz, dir_size
+
+# 默认任务目录、同时运行的任务数、保留的已结束任务数和其占用的磁盘上限
+DEFAULT_JOB_DIR = os.environ.get(
+    "SURFACE_ANALYSIS_JOBS",
+    os.path.join(os.path.expanduser("~"), ".cache", "surface-analysis-jobs"),
+)
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_JOBS = 50
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+JOB_NAME = "job.json"
+METRICS_NAME = "metrics.json"
+
+# 保存在 job.json 中的字段 (其余字段只在内存中,如进度)
+_PERSISTED = (
+    "id",
+    "file_name",
+    "params",
+    "meta",
+    "status",
+    "error",
+    "created",
+    "started",
+    "finished",
+)
+
+
+def output_path_for(job_dir, file_name):
+    """任务的输出文件路径,与界面中的命名一致: <文件名>-processed.txt"""
+    stem = os.path.splitext(file_name)[0]
+    return os.path.join(job_dir, f"{stem}-processed.txt")
+
+
+def _write_json(path, value):
+    """先写临时文件再替换,读取方不会看到写了一半的文件"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+class JobQueue:
+    """
+    持久化的分析任务队列
+
+    submit() 保存上传的文件并排队,返回任务ID;workers 个工作线程按提交顺序
+    运行 cached_process_xyz (共用 stage_cache 和 result_cache;
+    参数中开启 track_memory / cprofile 时不使用缓存,直接运行 process_xyz;
+    tracemalloc 和 cProfile 记录整个进程,这类任务独占运行: 等待正在运行的任务结束,
+    运行期间其他工作线程不开始新任务)。
+    status() 返回任务状态和进度,分析过程中指标和已生成的输出文件随时可查;
+    result() 返回已完成任务的指标和全部输出文件内容
+    """
+
+    def __init__(
+        self,
+        job_dir=DEFAULT_JOB_DIR,
+        workers=DEFAULT_WORKERS,
+        max_jobs=DEFAULT_MAX_JOBS,
+        max_bytes=DEFAULT_MAX_BYTES,
+        stage_cache=None,
+        result_cache=None,
+        plot_workers=None,
+    ):
+        self.job_dir = job_dir
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.stage_cache = stage_cache
+        self.result_cache = result_cache
+        self.plot_workers = plot_workers
+        os.makedirs(job_dir, exist_ok=True)
+
+        self._jobs = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        # 运行名额 (见 _slot): 运行中的普通任务数、等待独占的任务数、是否有任务独占
+        self._slots = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._exclusive = False
+        self._pending = queue.Queue()
+
+        self._recover()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _dir(self, job_id):
+        return os.path.join(self.job_dir, job_id)
+
+    def _save(self, job):
+        record = {k: job[k] for k in _PERSISTED}
+        _write_json(os.path.join(self._dir(job["id"]), JOB_NAME), record)
+
+    def _recover(self):
+        """读取已有任务;上次运行中断的任务重新排队"""
+        jobs = []
+        for name in os.listdir(self.job_dir):
+            try:
+                with open(os.path.join(self.job_dir, name, JOB_NAME), "r") as f:
+                    jobs.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        for job in sorted(jobs, key=lambda job: job["created"]):
+            job.update(progress=0.0, stage=None, done=0, total=0, outputs={})
+            job["metrics"] = self._load_metrics(job["id"])
+            if job["status"] in FINISHED:
+                job["outputs"] = self._existing_outputs(job)
+            else:
+                job.update(status=QUEUED, started=None)
+                self._save(job)
+                self._pending.put(job["id"])
+            self._jobs[job["id"]] = job
+
+    def _load_metrics(self, job_id):
+        try:
+            with open(os.path.join(self._dir(job_id), METRICS_NAME), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _existing_outputs(self, job):
+        """{后缀: 路径},后缀 "" 为预处理数据,见 OUTPUT_SUFFIXES"""
+        output_path = output_path_for(self._dir(job["id"]), job["file_name"])
+        render_profile = job["params"].get("render_profile", "archival")
+        paths = output_files(output_path, render_profile)
+        return {
+            suffix: path
+            for suffix, path in zip(("",) + OUTPUT_SUFFIXES, paths)
+            if os.path.exists(path)
+        }
+
+    def submit(self, file_bytes, file_name, params, meta=None):
+        """
+        保存上传的文件并排队,返回任务ID
+
+        params: process_xyz 的分析参数 (可JSON序列化);meta: 调用方附带的信息,原样保存
+        """
+        job_id = uuid.uuid4().hex
+        file_name = os.path.basename(file_name)
+        os.makedirs(self._dir(job_id))
+        with open(os.path.join(self._dir(job_id), file_name), "wb") as f:
+            f.write(file_bytes)
+
+        job = {
+            "id": job_id,
+            "file_name": file_name,
+            "params": json.loads(json.dumps(params)),
+            "meta": meta or {},
+            "status": QUEUED,
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "progress": 0.0,
+            "stage": None,
+            "done": 0,
+            "total": 0,
+            "metrics": None,
+            "outputs": {},
+        }
+        self._save(job)
+        with self._lock:
+            self._jobs[job_id] = job
+        self._pending.put(job_id)
+        return job_id
+
+    def status(self, job_id):
+        """任务状态的副本,不存在时返回 None;queue_position 为排在前面的任务数"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            status = dict(job, outputs=dict(job["outputs"]))
+            status["queue_position"] = sum(
+                other["status"] == QUEUED and other["created"] < job["created"]
+                for other in self._jobs.values()
+            )
+        return status
+
+    def jobs(self):
+        """全部任务的状态,按提交时间从新到旧"""
+        with self._lock:
+            ids = list(self._jobs)
+        statuses = [self.status(job_id) for job_id in ids]
+        return sorted(
+            (s for s in statuses if s is not None),
+            key=lambda s: s["created"],
+            reverse=True,
+        )
+
+    def result(self, job_id):
+        """
+        已完成任务的结果: {"metrics", "files": {后缀: 文件内容}, "input": 上传的文件内容},
+        任务未完成或不存在时返回 None
+        """
+        status = self.status(job_id)
+        if status is None or status["status"] != DONE:
+            return None
+
+        files = {}
+        for suffix, path in status["outputs"].items():
+            with open(path, "rb") as f:
+                files[suffix] = f.read()
+        with open(os.path.join(self._dir(job_id), status["file_name"]), "rb") as f:
+            input_bytes = f.read()
+        return {"metrics": status["metrics"], "files": files, "input": input_bytes}
+
+    def cancel(self, job_id):
+        """取消排队中或运行中的任务;运行中的任务在下一个检查点停止"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return
+            if job["status"] == QUEUED:
+                job.update(status=CANCELLED, finished=time.time())
+                self._save(job)
+                return
+            token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _work(self):
+        """工作线程: 依次取出排队的任务并运行"""
+        while True:
+            job_id = self._pending.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != QUEUED:
+                    continue
+                token = CancelToken()
+                self._tokens[job_id] = token
+                job.update(status=RUNNING, started=time.time())
+                self._save(job)
+
+            try:
+                self._run(job, token)
+            finally:
+                with self._lock:
+                    self._tokens.pop(job_id, None)
+                    job["finished"] = time.time()
+                    self._save(job)
+                self._evict()
+
+    def _run(self, job, token):
+        job_id = job["id"]
+        input_path = os.path.join(self._dir(job_id), job["file_name"])
+        output_path = output_path_for(self._dir(job_id), job["file_name"])
+
+        def on_metrics(metrics):
+            self._update(job_id, metrics=numeric_metrics(metrics))
+
+        def on_output(suffix, path):
+            with self._lock:
+                job["outputs"][suffix] = path
+
+        def on_progress(fraction, stage, done, total):
+            self._update(job_id, progress=fraction, stage=stage, done=done, total=total)
+
+        callbacks = dict(
+            plot_workers=self.plot_workers,
+            on_metrics=on_metrics,
+            on_output=on_output,
+            on_progress=on_progress,
+            cancel=token,
+        )
+        params = job["params"]
+        profiled = bool(params.get("track_memory") or params.get("cprofile"))
+        try:
+            with self._slot(job_id, profiled, token):
+                if profiled:
+                    # 性能分析时不使用缓存,记录完整的计算过程
+                    metrics = process_xyz(
+                        input_path, output_path, **callbacks, **params
+                    )
+                else:
+                    metrics = cached_process_xyz(
+                        input_path,
+                        output_path,
+                        cache=self.result_cache,
+                        stage_cache=self.stage_cache,
+                        **callbacks,
+                        **params,
+                    )
+        except AnalysisCancelled:
+            self._update(job_id, status=CANCELLED)
+            return
+        except Exception as e:
+            self._update(job_id, status=FAILED, error=f"{type(e).__name__}: {e}")
+            return
+
+        if metrics is None:
+            self._update(job_id, status=FAILED, error="没有有效数据")
+            return
+
+        saved = numeric_metrics(metrics)
+        if PERF_KEY in metrics:
+            saved[PERF_KEY] = metrics[PERF_KEY]
+        _write_json(os.path.join(self._dir(job_id), METRICS_NAME), saved)
+        self._update(job_id, status=DONE, metrics=saved, progress=1.0)
+
+    @contextlib.contextmanager
+    def _slot(self, job_id, exclusive, token):
+        """
+        任务的运行名额: 普通任务可同时运行;exclusive 的任务等待其他任务都结束后独占运行,
+        等待期间不再开始新的普通任务。等待中可取消 (抛出 AnalysisCancelled)
+        """
+        with self._slots:
+            if exclusive:
+                self._waiting += 1
+            try:
+                while self._exclusive or (
+                    self._running if exclusive else self._waiting
+                ):
+                    token.check()
+                    self._update(job_id, stage="等待其他任务结束")
+                    self._slots.wait(0.5)
+            finally:
+                if exclusive:
+                    self._waiting -= 1
+                    self._slots.notify_all()
+            if exclusive:
+                self._exclusive = True
+            else:
+                self._running += 1
+        try:
+            yield
+        finally:
+            with self._slots:
+                if exclusive:
+                    self._exclusive = False
+                else:
+                    self._running -= 1
+                self._slots.notify_all()
+
+    def _evict(self):
+        """
+        从最早的已结束任务开始删除,直到已结束的任务不超过 max_jobs 个、
+        其目录 (上传的文件和输出文件) 总大小不超过 max_bytes
+        """
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job["status"] in FINISHED),
+                key=lambda job: job["created"],
+            )
+        sizes = [dir_size(self._dir(job["id"])) for job in finished]
+
+        count, total = len(finished), sum(sizes)
+        evicted = []
+        for job, size in zip(finished, sizes):
+            if count <= self.max_jobs and total <= self.max_bytes:
+                break
+            evicted.append(job)
+            count -= 1
+            total -= size
+
+        with self._lock:
+            for job in evicted:
+                # 另一工作线程可能已同时删除
+                self._jobs.pop(job["id"], None)
+        for job in evicted:
+            shutil.rmtree(self._dir(job["id"]), ignore_errors=True)
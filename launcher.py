@@ -4,6 +4,7 @@ XYZ文件分析工具 - 启动器
 """
 import sys
 import os
+import multiprocessing
 import webbrowser
 import threading
 import time
@@ -16,6 +17,9 @@ def open_browser():
 
 def main():
     """主启动函数"""
+    # 打包后的exe中,SFMA并行计算的子进程需要此调用
+    multiprocessing.freeze_support()
+
     is_frozen = getattr(sys, 'frozen', False)
     
     if is_frozen:
@@ -0,0 +1,162 @@
+"""
+超大面形数据的分块 (out-of-core) 处理
+设置内存预算 memory_budget 时,原始XYZ数据点不整体载入内存: 先遍历一次统计范围,
+再分块解析并直接累加到磁盘映射的分箱网格 (np.memmap);边缘清除按行带进行,
+SFMA 按列带、局部角按行带计算 (见 sfma.sfma_banded 和 tilt.iter_slope_bands)。
+各块/带的大小由预算推算,峰值内存取决于预算和分箱后的子口径数,与输入文件大小无关
+"""
+
+import tempfile
+
+import numpy as np
+
+from binning import BinnedGrid, clearance_radius, keep_mask, max_radius
+from xyz_reader import iter_xyz_chunks
+
+# 各计算中每单位数据占用的内存 (字节),由预算推算块/带大小;按 tracemalloc 实测取整
+#   解析与分箱: 每字节输入文本
+#   分箱网格按行带处理 (边缘清除、取出子口径): 每个网格点
+#   SFMA / 局部角: 每个网格点,按引擎区分
+PARSE_BYTES_PER_TEXT_BYTE = 12
+CLIP_BYTES_PER_CELL = 48
+SFMA_BYTES_PER_CELL = {"integral": 256, "batched": 96, "loop": 64}
+TILT_BYTES_PER_CELL = {"vectorized": 384, "loop": 32}
+
+# 解析数据块的最小字节数
+MIN_CHUNK_BYTES = 64 * 1024
+
+
+def disk_array(shape, dtype=np.float64, fill_value=None):
+    """
+    磁盘映射的数组,初始为0 (或 fill_value)
+
+    映射到匿名临时文件 (tempfile.TemporaryFile,位于系统临时目录,可由 TMPDIR 指定),
+    数组及其视图都不再使用时文件自动删除
+    """
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    array = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=shape)
+    if fill_value is not None:
+        # 按行写入,不产生整个数组大小的临时数组
+        for row in array.reshape(shape[0], -1):
+            row.fill(fill_value)
+    return array
+
+
+def band_size(memory_budget, bytes_per_unit, unit_count, minimum=1):
+    """预算内一次处理的行/列数: 每行/列 unit_count 个单位,每单位 bytes_per_unit 字节"""
+    return max(minimum, int(memory_budget // (bytes_per_unit * max(unit_count, 1))))
+
+
+def chunk_bytes(memory_budget):
+    """预算内每次解析的文本字节数"""
+    return max(MIN_CHUNK_BYTES, int(memory_budget // PARSE_BYTES_PER_TEXT_BYTE))
+
+
+def pixel_center(extent):
+    """数据范围的中点 (像素),作为物理坐标原点"""
+    center_ix = (extent.min_ix + extent.max_ix) / 2.0
+    center_iy = (extent.min_iy + extent.max_iy) / 2.0
+    return center_ix, center_iy
+
+
+def stream_bin_xyz(
+    input_path, extent, center, scale, step_x, step_y, memory_budget, progress=None
+):
+    """
+    分块解析XYZ文件,每块换算为物理坐标后直接累加到磁盘映射的分箱网格
+
+    网格起点和尺寸由 scan_xyz 得到的索引范围 extent 算出,与 binning.bin_points
+    对全部数据点的结果相同;同一子口径内的累加顺序按块分组,差异在舍入误差量级。
+    progress(已分箱点数, 总点数) 在每个数据块之后调用
+
+    返回 z_sum/count 为 np.memmap 的 binning.BinnedGrid
+    """
+    center_ix, center_iy = center
+
+    def physical(ix, iy):
+        return (ix - center_ix) * scale, (center_iy - iy) * scale
+
+    # x 随 ix 增大,y 随 iy 减小,范围端点即坐标的最小/最大值
+    min_x, min_y = physical(np.array(extent.min_ix), np.array(extent.max_iy))
+    max_x, max_y = physical(np.array(extent.max_ix), np.array(extent.min_iy))
+    start_x = np.floor(min_x / step_x) * step_x
+    start_y = np.floor(min_y / step_y) * step_y
+
+    k0_x = int(np.round((min_x - start_x) / step_x))
+    k0_y = int(np.round((min_y - start_y) / step_y))
+    n_cols = int(np.round((max_x - start_x) / step_x)) - k0_x + 1
+    n_rows = int(np.round((max_y - start_y) / step_y)) - k0_y + 1
+
+    z_sum = disk_array((n_rows, n_cols))
+    count = disk_array((n_rows, n_cols), dtype=np.int64)
+    flat_sum = z_sum.reshape(-1)
+    flat_count = count.reshape(-1)
+
+    n_done = 0
+    for ix, iy, z_um in iter_xyz_chunks(input_path, chunk_bytes(memory_budget)):
+        if len(z_um) == 0:
+            continue
+        x, y = physical(ix, iy)
+        k_x = np.round((x - start_x) / step_x).astype(np.int64) - k0_x
+        k_y = np.round((y - start_y) / step_y).astype(np.int64) - k0_y
+        del x, y
+
+        # 块内先按子口径合并,再累加到网格,只访问块内出现的子口径
+        flat = np.ravel_multi_index((k_y, k_x), (n_rows, n_cols))
+        cells, inverse = np.unique(flat, return_inverse=True)
+        flat_sum[cells] += np.bincount(inverse, weights=z_um * 1e-6)
+        flat_count[cells] += np.bincount(inverse, minlength=len(cells))
+
+        n_done += len(z_um)
+        if progress is not None:
+            progress(n_done, extent.n_points)
+
+    return BinnedGrid(
+        z_sum=z_sum,
+        count=count,
+        start_x=start_x,
+        start_y=start_y,
+        step_x=step_x,
+        step_y=step_y,
+        k0_x=k0_x,
+        k0_y=k0_y,
+    )
+
+
+def clip_bins(binned, edge_clearance, exclusion_zones, memory_budget):
+    """
+    按行带进行边缘清除和区域排除,取出保留的子口径
+
+    与 process_xyz 中整体计算的分箱阶段结果相同: 先逐行带求最大半径,
+    再逐行带计算保留掩膜并取出子口径,按 (k_y, k_x) 升序拼接
+
+    返回:
+        x, y, z: 保留的子口径中心坐标和平均高度
+        radii: clearance_radius 的结果,未做边缘清除时为 None
+        clipped: 是否做了边缘清除或区域排除
+    """
+    n_rows, n_cols = binned.shape
+    max_rows = band_size(memory_budget, CLIP_BYTES_PER_CELL, n_cols)
+    bands = [
+        binned.rows(start, min(start + max_rows, n_rows))
+        for start in range(0, n_rows, max_rows)
+    ]
+
+    clipped = edge_clearance > 0 or bool(exclusion_zones)
+    radii = None
+    radius_limit = np.inf
+    if edge_clearance > 0:
+        radius = max(max_radius(band) for band in bands)
+        radii = clearance_radius(binned, edge_clearance, radius=radius)
+        radius_limit = radii[1] / 1000  # 转换回米
+
+    parts = []
+    for band in bands:
+        keep = None
+        if clipped:
+            keep = keep_mask(band, radius_limit, exclusion_zones, cached=False)
+        parts.append(band.points(keep))
+
+    x, y, z = (np.concatenate(arrays) for arrays in zip(*parts))
+    return x, y, z, radii, clipped
@@ -0,0 +1,169 @@
+"""
+分析流程的性能记录
+StageProfiler 包装分阶段缓存,记录 process_xyz 每个阶段的耗时、是否命中缓存,
+可选记录内存峰值 (tracemalloc) 和整个运行的 cProfile 统计;
+结果作为 metrics["perf"] 返回,每个阶段结束时另以 JSON 写入日志 "perf"
+"""
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+
+from stage_cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+# 指标字典中性能记录的键
+PERF_KEY = "perf"
+
+# cProfile 统计保留的函数数 (按累计耗时排序)
+CPROFILE_LINES = 30
+
+# tracemalloc 和 cProfile 是进程全局的: 记录内存或函数耗时的运行依次进行,
+# 否则并发的运行 (如后台任务的多个工作线程) 会相互重置峰值、提前停止跟踪
+_PROFILE_LOCK = threading.Lock()
+
+
+def numeric_metrics(metrics):
+    """去掉性能记录,其余指标转换为 float (用于写入JSON和缓存)"""
+    return {k: float(v) for k, v in metrics.items() if k != PERF_KEY}
+
+
+class StageProfiler:
+    """
+    记录各阶段耗时的分阶段缓存
+
+    接口与 stage_cache.StageCache 相同,实际缓存交给 inner (StageCache 或 NO_CACHE),
+    按阶段名 (键的第一项,如 "parse"、"sfma"、"tilt.png") 记录耗时和是否命中缓存。
+    track_memory=True 时记录各阶段相对开始时的内存峰值,cprofile=True 时
+    统计整个运行的函数耗时;两者都只在依次执行的阶段中有意义,
+    此时 serial 为 True,调用方应依次生成输出文件。
+    serial 的运行在 with 块内独占 tracemalloc/cProfile,其他线程中的此类运行等待其结束
+    """
+
+    def __init__(self, inner, track_memory=False, cprofile=False):
+        self.inner = inner
+        self.track_memory = track_memory
+        self.cprofile = cprofile
+        self.stages = []
+        self.seconds = None
+        self.peak_bytes = 0
+        self._lock = threading.Lock()
+        self._profile = None
+        self._started_tracing = False
+        self._locked = False
+        self._t0 = None
+
+    @property
+    def serial(self):
+        return self.track_memory or self.cprofile
+
+    def __enter__(self):
+        if self.serial:
+            _PROFILE_LOCK.acquire()
+            self._locked = True
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.seconds = time.perf_counter() - self._t0
+            if self._profile is not None:
+                self._profile.disable()
+            if self.track_memory:
+                self.peak_bytes = max(
+                    self.peak_bytes, tracemalloc.get_traced_memory()[1]
+                )
+                if self._started_tracing:
+                    tracemalloc.stop()
+        finally:
+            if self._locked:
+                self._locked = False
+                _PROFILE_LOCK.release()
+        return False
+
+    def _measure(self, name, run, cached=None):
+        """
+        运行 run(mark) 并记录耗时,返回其结果
+
+        run 把实际的计算函数交给 mark 包装后再传给 inner;计算函数未被调用即为命中缓存。
+        cached(value) 可另外判断未调用计算函数时是否确实取自缓存
+        """
+        computed = []
+
+        def mark(compute):
+            def wrapped(*args):
+                computed.append(True)
+                return compute(*args)
+
+            return wrapped
+
+        tracing = self.track_memory and tracemalloc.is_tracing()
+        if tracing:
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        t0 = time.perf_counter()
+        value = run(mark)
+        record = {
+            "stage": name,
+            "seconds": time.perf_counter() - t0,
+            "cached": not computed and (cached is None or cached(value)),
+        }
+
+        if tracing:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            record["peak_mb"] = (peak_bytes - start_bytes) / 1e6
+        with self._lock:
+            # reset_peak 清除了之前的峰值,整个运行的峰值在这里累计
+            if tracing:
+                self.peak_bytes = max(self.peak_bytes, peak_bytes)
+            self.stages.append(record)
+        logger.info(json.dumps(record))
+        return value
+
+    def get(self, key, compute):
+        return self._measure(key[0], lambda mark: self.inner.get(key, mark(compute)))
+
+    def digest(self, path, compute=file_digest):
+        # 不缓存 (NO_CACHE) 时不计算哈希、返回 None,不算命中
+        return self._measure(
+            "digest",
+            lambda mark: self.inner.digest(path, mark(compute)),
+            cached=lambda value: value is not None,
+        )
+
+    def write_file(self, key, path, writer):
+        self._measure(
+            key[0], lambda mark: self.inner.write_file(key, path, mark(writer))
+        )
+
+    def report(self):
+        """
+        性能记录: {"stages": [各阶段记录], "seconds": 总耗时,
+        "peak_mb": 内存峰值 (未记录时为 None), "cprofile": 函数耗时统计文本或 None}
+        """
+        cprofile_text = None
+        if self._profile is not None:
+            buffer = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=buffer)
+            stats.sort_stats("cumulative").print_stats(CPROFILE_LINES)
+            cprofile_text = buffer.getvalue()
+
+        return {
+            "stages": list(self.stages),
+            "seconds": self.seconds,
+            "peak_mb": self.peak_bytes / 1e6 if self.track_memory else None,
+            "cprofile": cprofile_text,
+        }
@@ -1,11 +1,95 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
 from matplotlib import rcParams
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
+
+from binning import bin_points, clearance_radius, freeze_zones, keep_mask
+from out_of_core import (
+    SFMA_BYTES_PER_CELL,
+    TILT_BYTES_PER_CELL,
+    band_size,
+    chunk_bytes,
+    clip_bins,
+    disk_array,
+    pixel_center,
+    stream_bin_xyz,
+)
+from perf import PERF_KEY, StageProfiler
+from progress import StageProgress
+from result_io import (
+    is_processed_input,
+    read_processed,
+    save_results,
+    write_points,
+)
+from sfma import (
+    sfma_batched,
+    sfma_integral,
+    sfma_loop,
+    sfma_banded,
+    sfma_parallel,
+    solve_plane_moments,
+)
+from stage_cache import NO_CACHE
+from surface_grid import SurfaceGrid
+from tilt import iter_slope_bands, local_slopes_loop, local_slopes_vectorized
+from xyz_reader import read_xyz, read_xyz_header, scan_xyz
 
 # 设置中文字体支持
 rcParams["font.sans-serif"] = ["Arial Unicode MS", "SimHei", "sans-serif"]
 rcParams["axes.unicode_minus"] = False
 
+# 文件头缺失分辨率时使用的默认值,单位米
+DEFAULT_SCALE = 0.000175
+
+# 除预处理数据外,process_xyz 生成的各文件名后缀 (替换输出路径中的 ".txt")
+OUTPUT_SUFFIXES = (
+    "-sfma.png",
+    "-sfma-high.png",
+    "-sfma.txt",
+    "-tilt.png",
+    "-tilt.txt",
+    "-tilt-high.png",
+    "-nce.png",
+    "-nce.txt",
+    "-results.npz",
+)
+
+
+# 图像输出规格: 名称 -> (文件扩展名, savefig 参数)
+#   "preview": 界面显示用,低分辨率且不计算紧凑边界 (省去一次额外绘制)
+#   "archival": 300 dpi PNG,紧凑边界 (默认,与原有输出一致)
+#   "svg" / "pdf": 矢量图
+RENDER_PROFILES = {
+    "preview": (".png", {"dpi": 100}),
+    "archival": (".png", {"dpi": 300, "bbox_inches": "tight", "pad_inches": 0.1}),
+    "svg": (".svg", {"bbox_inches": "tight", "pad_inches": 0.1}),
+    "pdf": (".pdf", {"bbox_inches": "tight", "pad_inches": 0.1}),
+}
+
+
+def profile_suffix(suffix, render_profile="archival"):
+    """OUTPUT_SUFFIXES 中的图像后缀按输出规格替换扩展名,例如 -sfma.png -> -sfma.svg"""
+    if suffix.endswith(".png"):
+        return suffix[: -len(".png")] + RENDER_PROFILES[render_profile][0]
+    return suffix
+
+
+def output_files(output_path, render_profile="archival"):
+    """
+    process_xyz 以 output_path 为输出时生成的全部文件,
+    依次对应预处理数据和 OUTPUT_SUFFIXES
+    """
+    return [output_path] + [
+        output_path.replace(".txt", profile_suffix(s, render_profile))
+        for s in OUTPUT_SUFFIXES
+    ]
+
 
 def remove_tilt(x, y, z):
     """拟合平面 z = ax + by + c 并返回残差"""
@@ -31,6 +115,11 @@ def calculate_dynamic_sfma(
     slit_h=0.008,
     slit_step_x=0.013,
     slit_step_y=0.001,
+    engine="loop",
+    workers=None,
+    grid=None,
+    progress=None,
+    memory_budget=None,
 ):
     """
     动态移动狭缝模拟 (SFMA)
@@ -42,243 +131,89 @@ def calculate_dynamic_sfma(
         slit_w, slit_h: 狭缝的宽度和高度,单位米
         slit_step_x: slit在X方向的移动步长,单位米 (默认: 0.026m = 26mm)
         slit_step_y: slit在Y方向的移动步长,单位米 (默认: 0.0001m = 1mm)
+        engine: 计算引擎 (默认: "loop")
+            "loop": 逐窗口 lstsq 拟合
+            "integral": 积分图求窗口矩,每个窗口 O(1),见 sfma.sfma_integral
+            "batched": 每列窗口批量求解,见 sfma.sfma_column_batched
+        workers: 并行进程数,大于1时将扫描列分组交给进程池 (默认: None, 单进程)
+        grid: 已网格化的 SurfaceGrid,提供时直接使用其高度网格,不再由 x, y, z 推断
+        progress: 进度回调 progress(已完成扫描列数, 总列数),见 sfma 中各引擎
+        memory_budget: 内存预算,单位字节;提供时按列带依次计算 (见 sfma.sfma_banded),
+                       列带宽度由预算决定,累加结果放在磁盘映射数组中,workers 不起作用
+                       (默认: None, 整体计算)
     """
 
-    min_x, max_x = np.min(x), np.max(x)
-    min_y, max_y = np.min(y), np.max(y)
-
-    x_sorted = np.sort(np.unique(x))
-    y_sorted = np.sort(np.unique(y))
-    step_x = np.median(np.diff(x_sorted)) if len(x_sorted) > 1 else (max_x - min_x)
-    step_y = np.median(np.diff(y_sorted)) if len(y_sorted) > 1 else (max_y - min_y)
-
-    n_cols = int(round((max_x - min_x) / step_x)) + 1
-    n_rows = int(round((max_y - min_y) / step_y)) + 1
-
-    col_indices = np.round((x - min_x) / step_x).astype(int)
-    row_indices = np.round((y - min_y) / step_y).astype(int)
-
-    grid_z = np.full((n_rows, n_cols), np.nan)
-    grid_z[row_indices, col_indices] = z
-
-    grid_x = min_x + np.arange(n_cols) * step_x
-    grid_y = min_y + np.arange(n_rows) * step_y
-    GX, GY = np.meshgrid(grid_x, grid_y)
+    if grid is None:
+        grid = SurfaceGrid.from_points(x, y, z)
+    grid_z = grid.grid_z
+    step_x, step_y = grid.step_x, grid.step_y
 
     slit_px_w = int(round(slit_w / step_x))
     slit_px_h = int(round(slit_h / step_y))
     slit_step_px_x = int(round(slit_step_x / step_x))  # X方向移动步长(像素)
     slit_step_px_y = int(round(slit_step_y / step_y))  # Y方向移动步长(像素)
 
-    # 使用均值累积
-    layout_sum = np.zeros((n_rows, n_cols))
-    layout_count = np.zeros((n_rows, n_cols))
-
-    # 蛇形移动: 使用物理距离步长(转换为像素)
-    for col_idx, col_start_idx in enumerate(range(-slit_px_w, n_cols, slit_step_px_x)):
-        col_end_idx = col_start_idx + slit_px_w
-        valid_start = max(0, col_start_idx)
-        valid_end = min(n_cols, col_end_idx)
-
-        if valid_start >= valid_end:
-            continue
+    grid_x, grid_y = grid.grid_x, grid.grid_y
+    slit_args = (slit_px_w, slit_px_h, slit_step_px_x, slit_step_px_y)
 
-        col_z = grid_z[:, valid_start:valid_end]
-        col_x = GX[:, valid_start:valid_end]
-        col_y = GY[:, valid_start:valid_end]
+    if engine not in ("integral", "batched", "loop"):
+        raise ValueError(f"未知的SFMA引擎: {engine}")
 
-        # 偶数列向上(从0开始),奇数列向下(从最大开始)
-        if col_idx % 2 == 0:
-            y_range = range(0, n_rows - slit_px_h + 1, slit_step_px_y)
-        else:
-            y_range = range(n_rows - slit_px_h, -1, -slit_step_px_y)
-
-        for y_start_idx in y_range:
-            y_end_idx = y_start_idx + slit_px_h
-
-            win_z = col_z[y_start_idx:y_end_idx, :]
-            win_x = col_x[y_start_idx:y_end_idx, :]
-            win_y = col_y[y_start_idx:y_end_idx, :]
-
-            mask = ~np.isnan(win_z)
-            if np.sum(mask) < 10:
-                continue
-
-            z_f = win_z[mask]
-            x_f = win_x[mask]
-            y_f = win_y[mask]
-
-            A = np.c_[x_f, y_f, np.ones(len(x_f))]
-            coeff, _, _, _ = np.linalg.lstsq(A, z_f, rcond=None)
-            a, b, c = coeff
-
-            z_fit = a * win_x + b * win_y + c
-            residual = win_z - z_fit
-
-            valid_res_mask = ~np.isnan(residual)
-            acc_sum_slice = layout_sum[y_start_idx:y_end_idx, valid_start:valid_end]
-            acc_count_slice = layout_count[y_start_idx:y_end_idx, valid_start:valid_end]
-
-            # 累积求和和计数
-            acc_sum_slice[valid_res_mask] += residual[valid_res_mask]
-            acc_count_slice[valid_res_mask] += 1
+    if memory_budget is not None:
+        max_cols = band_size(
+            memory_budget, SFMA_BYTES_PER_CELL[engine], grid_z.shape[0], slit_px_w
+        )
+        layout_sum, layout_count = sfma_banded(
+            engine,
+            grid_z,
+            grid_x,
+            grid_y,
+            *slit_args,
+            max_cols=max_cols,
+            layout_sum=disk_array(grid_z.shape),
+            layout_count=disk_array(grid_z.shape),
+            progress=progress,
+        )
+        # 只在数据点处求均值,不生成整幅均值网格
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return grid.sample(layout_sum) / grid.sample(layout_count)
+
+    if workers is not None and workers > 1:
+        layout_sum, layout_count = sfma_parallel(
+            engine,
+            grid_z,
+            grid_x,
+            grid_y,
+            *slit_args,
+            workers=workers,
+            progress=progress,
+        )
+    elif engine == "integral":
+        layout_sum, layout_count = sfma_integral(
+            grid_z, *slit_args, progress=progress, valid=grid.valid
+        )
+    elif engine == "batched":
+        layout_sum, layout_count = sfma_batched(grid_z, *slit_args, progress=progress)
+    else:
+        layout_sum, layout_count = sfma_loop(
+            grid_z,
+            grid_x,
+            grid_y,
+            *slit_args,
+            progress=progress,
+            meshgrid=grid.meshgrid,
+        )
 
     # 计算均值
     with np.errstate(divide="ignore", invalid="ignore"):
         result_map = layout_sum / layout_count
 
-    z_dynamic = result_map[row_indices, col_indices]
+    z_dynamic = grid.sample(result_map)
     return z_dynamic
 
 
-def calculate_local_tilt(x, y, z):
-    """
-    计算局部倾斜角度 (梯度幅值)
-    使用中心差分法计算X和Y方向斜率,边缘使用前向/后向差分,角点使用局部平面拟合
-    """
-
-    min_x, max_x = np.min(x), np.max(x)
-    min_y, max_y = np.min(y), np.max(y)
-
-    x_sorted = np.sort(np.unique(x))
-    y_sorted = np.sort(np.unique(y))
-    step_x = np.median(np.diff(x_sorted)) if len(x_sorted) > 1 else (max_x - min_x)
-    step_y = np.median(np.diff(y_sorted)) if len(y_sorted) > 1 else (max_y - min_y)
-
-    n_cols = int(round((max_x - min_x) / step_x)) + 1
-    n_rows = int(round((max_y - min_y) / step_y)) + 1
-
-    grid_z = np.full((n_rows, n_cols), np.nan)
-    col_indices = np.round((x - min_x) / step_x).astype(int)
-    row_indices = np.round((y - min_y) / step_y).astype(int)
-
-    col_indices = np.clip(col_indices, 0, n_cols - 1)
-    row_indices = np.clip(row_indices, 0, n_rows - 1)
-
-    grid_z[row_indices, col_indices] = z
-
-    slope_x = np.full((n_rows, n_cols), np.nan)
-    slope_y = np.full((n_rows, n_cols), np.nan)
-
-    def fit_local_plane(i, j, grid_z, step_x, step_y):
-        """拟合3x3邻域的平面并返回斜率"""
-        points_x, points_y, points_z = [], [], []
-
-        for di in [-1, 0, 1]:
-            for dj in [-1, 0, 1]:
-                ni, nj = i + di, j + dj
-                if 0 <= ni < grid_z.shape[0] and 0 <= nj < grid_z.shape[1]:
-                    if not np.isnan(grid_z[ni, nj]):
-                        points_x.append(nj * step_x)
-                        points_y.append(ni * step_y)
-                        points_z.append(grid_z[ni, nj])
-
-        if len(points_z) >= 3:
-            A = np.c_[points_x, points_y, np.ones(len(points_z))]
-            try:
-                coeff, _, _, _ = np.linalg.lstsq(A, points_z, rcond=None)
-                return coeff[0], coeff[1]
-            except:
-                return np.nan, np.nan
-        return np.nan, np.nan
-
-    for i in range(n_rows):
-        for j in range(n_cols):
-            if np.isnan(grid_z[i, j]):
-                continue
-
-            is_left_edge = j == 0
-            is_right_edge = j == n_cols - 1
-            is_top_edge = i == 0
-            is_bottom_edge = i == n_rows - 1
-
-            is_corner = (is_left_edge or is_right_edge) and (
-                is_top_edge or is_bottom_edge
-            )
-            is_edge = (
-                is_left_edge or is_right_edge or is_top_edge or is_bottom_edge
-            ) and not is_corner
-
-            if is_corner:
-                # 角点使用局部平面拟合
-                sx, sy = fit_local_plane(i, j, grid_z, step_x, step_y)
-                slope_x[i, j] = sx
-                slope_y[i, j] = sy
-            elif is_edge:
-                # 边缘点使用双侧差分(如果可能),否则使用单侧差分
-                # X方向
-                if is_left_edge:
-                    if (
-                        j + 2 < n_cols
-                        and not np.isnan(grid_z[i, j + 1])
-                        and not np.isnan(grid_z[i, j + 2])
-                    ):
-                        # 使用前向二阶差分
-                        slope_x[i, j] = (
-                            -3 * grid_z[i, j] + 4 * grid_z[i, j + 1] - grid_z[i, j + 2]
-                        ) / (2 * step_x)
-                    elif not np.isnan(grid_z[i, j + 1]):
-                        slope_x[i, j] = (grid_z[i, j + 1] - grid_z[i, j]) / step_x
-                elif is_right_edge:
-                    if (
-                        j - 2 >= 0
-                        and not np.isnan(grid_z[i, j - 1])
-                        and not np.isnan(grid_z[i, j - 2])
-                    ):
-                        # 使用后向二阶差分
-                        slope_x[i, j] = (
-                            3 * grid_z[i, j] - 4 * grid_z[i, j - 1] + grid_z[i, j - 2]
-                        ) / (2 * step_x)
-                    elif not np.isnan(grid_z[i, j - 1]):
-                        slope_x[i, j] = (grid_z[i, j] - grid_z[i, j - 1]) / step_x
-                else:
-                    # 顶部或底部边缘,X方向可以用中心差分
-                    if not np.isnan(grid_z[i, j + 1]) and not np.isnan(
-                        grid_z[i, j - 1]
-                    ):
-                        slope_x[i, j] = (grid_z[i, j + 1] - grid_z[i, j - 1]) / (
-                            2 * step_x
-                        )
-
-                # Y方向
-                if is_top_edge:
-                    if (
-                        i + 2 < n_rows
-                        and not np.isnan(grid_z[i + 1, j])
-                        and not np.isnan(grid_z[i + 2, j])
-                    ):
-                        # 使用前向二阶差分
-                        slope_y[i, j] = (
-                            -3 * grid_z[i, j] + 4 * grid_z[i + 1, j] - grid_z[i + 2, j]
-                        ) / (2 * step_y)
-                    elif not np.isnan(grid_z[i + 1, j]):
-                        slope_y[i, j] = (grid_z[i + 1, j] - grid_z[i, j]) / step_y
-                elif is_bottom_edge:
-                    if (
-                        i - 2 >= 0
-                        and not np.isnan(grid_z[i - 1, j])
-                        and not np.isnan(grid_z[i - 2, j])
-                    ):
-                        # 使用后向二阶差分
-                        slope_y[i, j] = (
-                            3 * grid_z[i, j] - 4 * grid_z[i - 1, j] + grid_z[i - 2, j]
-                        ) / (2 * step_y)
-                    elif not np.isnan(grid_z[i - 1, j]):
-                        slope_y[i, j] = (grid_z[i, j] - grid_z[i - 1, j]) / step_y
-                else:
-                    # 左侧或右侧边缘,Y方向可以用中心差分
-                    if not np.isnan(grid_z[i + 1, j]) and not np.isnan(
-                        grid_z[i - 1, j]
-                    ):
-                        slope_y[i, j] = (grid_z[i + 1, j] - grid_z[i - 1, j]) / (
-                            2 * step_y
-                        )
-            else:
-                # 内部点使用局部平面拟合
-                sx, sy = fit_local_plane(i, j, grid_z, step_x, step_y)
-                slope_x[i, j] = sx
-                slope_y[i, j] = sy
-
+def _tilt_magnitude(slope_x, slope_y):
+    """由X/Y方向斜率计算局部倾斜角网格 (urad);只有一个方向有效时取其绝对值"""
     slope_x_urad = slope_x * 1e6
     slope_y_urad = slope_y * 1e6
 
@@ -293,23 +228,76 @@ def calculate_local_tilt(x, y, z):
 
     mask_only_y = np.isnan(slope_x_urad) & ~np.isnan(slope_y_urad)
     tilt_urad_grid[mask_only_y] = np.abs(slope_y_urad[mask_only_y])
+    return tilt_urad_grid
+
 
-    tilt_urad = tilt_urad_grid[row_indices, col_indices]
+def calculate_local_tilt(
+    x, y, z, engine="loop", grid=None, progress=None, memory_budget=None
+):
+    """
+    计算局部倾斜角度 (梯度幅值)
+    使用中心差分法计算X和Y方向斜率,边缘使用前向/后向差分,角点使用局部平面拟合
+
+    参数:
+        engine: 计算引擎 (默认: "loop")
+            "loop": 逐像素计算
+            "vectorized": 整体数组运算,见 tilt.local_slopes_vectorized
+        grid: 已网格化的 SurfaceGrid,提供时直接使用其高度网格,不再由 x, y, z 推断
+        progress: 进度回调 progress(已完成行数, 总行数)
+        memory_budget: 内存预算,单位字节;提供时按行带计算 (见 tilt.iter_slope_bands),
+                       每个行带完成后报告进度 (默认: None, 整体计算)
+    """
+
+    if grid is None:
+        grid = SurfaceGrid.from_points(x, y, z)
+    grid_z = grid.grid_z
+    step_x, step_y = grid.step_x, grid.step_y
+
+    if engine == "vectorized":
+        slopes = local_slopes_vectorized
+    elif engine == "loop":
+        slopes = local_slopes_loop
+    else:
+        raise ValueError(f"未知的局部角引擎: {engine}")
+
+    if memory_budget is None:
+        slope_x, slope_y = slopes(grid_z, step_x, step_y, progress)
+        tilt_urad_grid = _tilt_magnitude(slope_x, slope_y)
+    else:
+        n_rows, n_cols = grid_z.shape
+        max_rows = band_size(memory_budget, TILT_BYTES_PER_CELL[engine], n_cols)
+        tilt_urad_grid = disk_array(grid_z.shape)
+        for start, stop, slope_x, slope_y in iter_slope_bands(
+            slopes, grid_z, step_x, step_y, max_rows
+        ):
+            tilt_urad_grid[start:stop] = _tilt_magnitude(slope_x, slope_y)
+            if progress is not None:
+                progress(stop, n_rows)
+
+    tilt_urad = grid.sample(tilt_urad_grid)
     return tilt_urad
 
 
-def calculate_nce(x, y, z, field_size_x=0.026, field_size_y=0.008, offset_x=0.0):
-    """计算NCE(非可校正误差),对每个场移除局部倾斜"""
+def calculate_nce(
+    x, y, z, field_size_x=0.026, field_size_y=0.008, offset_x=0.0, grid=None
+):
+    """
+    计算NCE(非可校正误差),对每个场移除局部倾斜
+
+    每个点只做一次场编号,所有场的平面拟合由分组矩一次求解,
+    不再为每个场扫描全部数据点
+
+    grid: 已网格化的 SurfaceGrid,提供时直接使用其网格间距
+    """
     z_nce = np.full_like(z, np.nan)
 
     min_x, max_x = np.min(x), np.max(x)
     min_y, max_y = np.min(y), np.max(y)
 
     # 从数据推断物理间距
-    x_sorted = np.sort(np.unique(x))
-    y_sorted = np.sort(np.unique(y))
-    step_x = np.median(np.diff(x_sorted)) if len(x_sorted) > 1 else (max_x - min_x)
-    step_y = np.median(np.diff(y_sorted)) if len(y_sorted) > 1 else (max_y - min_y)
+    if grid is None:
+        grid = SurfaceGrid.from_points(x, y, z)
+    step_x, step_y = grid.step_x, grid.step_y
 
     start_x = min_x + offset_x
     n_cols = int(np.ceil((max_x - start_x) / field_size_x)) + 1
@@ -324,59 +312,161 @@ def calculate_nce(x, y, z, field_size_x=0.026, field_size_y=0.008, offset_x=0.0)
     expected_points = (field_size_x * field_size_y) / (step_x * step_y)
     min_points = max(10, int(expected_points * 0.1))
 
-    for i in range(len(x_edges) - 1):
-        for j in range(len(y_edges) - 1):
-            x_start, x_end = x_edges[i], x_edges[i + 1]
-            y_start, y_end = y_edges[j], y_edges[j + 1]
+    # 场编号: 与 x_edges[i] <= x < x_edges[i + 1] 的判定完全一致
+    field_col = np.searchsorted(x_edges, x, side="right") - 1
+    field_row = np.searchsorted(y_edges, y, side="right") - 1
+    inside = (field_col >= 0) & (field_col < n_cols) & (field_row >= 0)
+    inside &= field_row < n_rows
+
+    idx = np.nonzero(inside)[0]
+    col, row = field_col[idx], field_row[idx]
+    label = col * n_rows + row
+    n_fields = n_cols * n_rows
+
+    # 场内归一化坐标,保证法方程条件良好
+    u = (x[idx] - x_edges[col]) / field_size_x
+    v = (y[idx] - y_edges[row]) / field_size_y
+    z_in = z[idx]
+
+    def group_sum(weights):
+        return np.bincount(label, weights=weights, minlength=n_fields)
+
+    s1 = np.bincount(label, minlength=n_fields)
+    fitted = np.nonzero(s1 > min_points)[0]
+    if len(fitted) == 0:
+        return z_nce, grid_lines_x, grid_lines_y
+
+    moments = [
+        group_sum(w)[fitted]
+        for w in (u, v, u * u, u * v, v * v, z_in, u * z_in, v * z_in)
+    ]
+    a, b, c = solve_plane_moments(s1[fitted].astype(float), *moments)
+
+    # 将拟合系数映射回各点所在的场
+    slot = np.full(n_fields, -1)
+    slot[fitted] = np.arange(len(fitted))
+    point_slot = slot[label]
+    keep = point_slot >= 0
+    k = point_slot[keep]
+
+    z_fit = a[k] * u[keep] + b[k] * v[keep] + c[k]
+    z_nce[idx[keep]] = z_in[keep] - z_fit
 
-            mask = (x >= x_start) & (x < x_end) & (y >= y_start) & (y < y_end)
+    return z_nce, grid_lines_x, grid_lines_y
 
-            if np.sum(mask) > min_points:
-                x_field = x[mask]
-                y_field = y[mask]
-                z_field = z[mask]
 
-                A = np.c_[x_field, y_field, np.ones(len(x_field))]
-                coeff, _, _, _ = np.linalg.lstsq(A, z_field, rcond=None)
-                a, b, c = coeff
-                z_fit = a * x_field + b * y_field + c
+# 绘图方式
+#   "raster": 在规则网格上以 imshow 栅格绘制,无数据处透明 (默认)
+#   "contour": 原有方式,tricontourf 100级等高线 (高阈值图为散点)
+RENDER_MODES = ("raster", "contour")
 
-                z_nce[mask] = z_field - z_fit
 
-    return z_nce, grid_lines_x, grid_lines_y
+def _check_render(render, profile="archival"):
+    if render not in RENDER_MODES:
+        raise ValueError(f"未知的绘图方式: {render}")
+    if profile not in RENDER_PROFILES:
+        raise ValueError(f"未知的输出规格: {profile}")
+
+
+def _save_figure(fig, path, profile):
+    """按输出规格保存图像"""
+    ext, savefig_kw = RENDER_PROFILES[profile]
+    fig.savefig(path, format=ext[1:], **savefig_kw)
+
+
+def _raster_map(ax, x, y, values, cmap, grid=None):
+    """
+    将网格点数据按栅格绘制
+
+    x, y 为全部网格点 (用于推断网格),values 中为 NaN 的位置不着色;
+    grid 为由同一组 x, y 建立的 SurfaceGrid,提供时直接复用其网格几何,不再重新推断
+    """
+    if grid is None:
+        grid = SurfaceGrid.from_points(x, y, values)
+    else:
+        grid = grid.with_z(values)
+    extent = (
+        grid.min_x - grid.step_x / 2,
+        grid.max_x + grid.step_x / 2,
+        grid.min_y - grid.step_y / 2,
+        grid.max_y + grid.step_y / 2,
+    )
+    return ax.imshow(
+        np.ma.masked_invalid(grid.grid_z),
+        origin="lower",
+        extent=extent,
+        cmap=cmap,
+        interpolation="nearest",
+    )
+
+
+def _filled_map(ax, x, y, values, cmap, render, grid=None):
+    """绘制面形图,返回用于色标的对象"""
+    if render == "raster":
+        return _raster_map(ax, x, y, values, cmap, grid)
+    mask = ~np.isnan(values)
+    return ax.tricontourf(x[mask], y[mask], values[mask], levels=100, cmap=cmap)
+
+
+def _selected_map(ax, x, y, values, mask, cmap, render, grid=None):
+    """只绘制 mask 选中的点 (高阈值图),返回用于色标的对象"""
+    if render == "raster":
+        return _raster_map(ax, x, y, np.where(mask, values, np.nan), cmap, grid)
+    return ax.scatter(x[mask], y[mask], c=values[mask], cmap=cmap, s=5)
 
 
-def plot_sfma_heatmap(x, y, z_sfma, metric_val, output_image_path):
+def plot_sfma_heatmap(
+    x,
+    y,
+    z_sfma,
+    metric_val,
+    output_image_path,
+    render="raster",
+    profile="archival",
+    grid=None,
+):
     """生成SFMA热力图"""
-    plt.figure(figsize=(8, 6))
-    cmap = plt.get_cmap("jet")
+    _check_render(render, profile)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    cmap = matplotlib.colormaps["jet"]
 
     mask = ~np.isnan(z_sfma)
     if np.sum(mask) == 0:
         return
 
-    cntr = plt.tricontourf(x[mask], y[mask], z_sfma[mask], levels=100, cmap=cmap)
-    cbar = plt.colorbar(cntr)
+    cntr = _filled_map(ax, x, y, z_sfma, cmap, render, grid)
+    cbar = fig.colorbar(cntr, ax=ax)
     cbar.formatter.set_powerlimits((0, 0))
 
     r = np.max(np.sqrt(x**2 + y**2))
-    circle = plt.Circle((0, 0), r, color="k", fill=False, linewidth=1)
-    plt.gca().add_patch(circle)
+    circle = Circle((0, 0), r, color="k", fill=False, linewidth=1)
+    ax.add_patch(circle)
 
-    plt.axis("equal")
-    plt.xlabel("X (m)")
-    plt.ylabel("Y (m)")
-    plt.title(f"SFMA\nm3s = {metric_val * 1e9:.2f} nm")
+    ax.axis("equal")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    ax.set_title(f"SFMA\nm3s = {metric_val * 1e9:.2f} nm")
 
-    plt.savefig(output_image_path, dpi=300, bbox_inches="tight", pad_inches=0.1)
-    plt.close()
+    _save_figure(fig, output_image_path, profile)
     # print(f"Saved SFMA heatmap to {output_image_path}")
 
 
-def plot_sfma_high_heatmap(x, y, z_sfma, threshold, output_image_path):
+def plot_sfma_high_heatmap(
+    x,
+    y,
+    z_sfma,
+    threshold,
+    output_image_path,
+    render="raster",
+    profile="archival",
+    grid=None,
+):
     """生成大于特定阈值的SFMA热力图"""
-    plt.figure(figsize=(8, 6))
-    cmap = plt.get_cmap("jet")
+    _check_render(render, profile)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    cmap = matplotlib.colormaps["jet"]
 
     # threshold is in meters, convert to nm for display comparison if needed,
     # but here we compare in meters as z_sfma is in meters.
@@ -385,429 +475,894 @@ def plot_sfma_high_heatmap(x, y, z_sfma, threshold, output_image_path):
     mask = (~np.isnan(z_sfma)) & (np.abs(z_sfma) > threshold)
 
     if np.sum(mask) == 0:
-        plt.text(
+        ax.text(
             0.5,
             0.5,
             f"No data > {threshold * 1e9:.1f} nm",
             horizontalalignment="center",
             verticalalignment="center",
-            transform=plt.gca().transAxes,
+            transform=ax.transAxes,
         )
     else:
-        sc = plt.scatter(x[mask], y[mask], c=z_sfma[mask], cmap=cmap, s=5)
-        cbar = plt.colorbar(sc)
+        sc = _selected_map(ax, x, y, z_sfma, mask, cmap, render, grid)
+        cbar = fig.colorbar(sc, ax=ax)
         cbar.formatter.set_powerlimits((0, 0))
 
     r = np.max(np.sqrt(x**2 + y**2))
-    circle = plt.Circle((0, 0), r, color="k", fill=False, linewidth=1)
-    plt.gca().add_patch(circle)
+    circle = Circle((0, 0), r, color="k", fill=False, linewidth=1)
+    ax.add_patch(circle)
 
-    plt.axis("equal")
-    plt.xlabel("X (m)")
-    plt.ylabel("Y (m)")
-    plt.title(f"SFMA (> {threshold * 1e9:.1f} nm)")
+    ax.axis("equal")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    ax.set_title(f"SFMA (> {threshold * 1e9:.1f} nm)")
 
-    plt.savefig(output_image_path, dpi=300, bbox_inches="tight", pad_inches=0.1)
-    plt.close()
+    _save_figure(fig, output_image_path, profile)
 
 
-def plot_surface_heatmap(x, y, z_resid, pv, output_image_path):
+def plot_surface_heatmap(
+    x,
+    y,
+    z_resid,
+    pv,
+    output_image_path,
+    render="raster",
+    profile="archival",
+    grid=None,
+):
     """生成去一阶面形后的热力图"""
-    plt.figure(figsize=(8, 6))
-    cmap = plt.get_cmap("jet")
-    cntr = plt.tricontourf(x, y, z_resid, levels=100, cmap=cmap)
-    cbar = plt.colorbar(cntr)
+    _check_render(render, profile)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    cmap = matplotlib.colormaps["jet"]
+    cntr = _filled_map(ax, x, y, z_resid, cmap, render, grid)
+    cbar = fig.colorbar(cntr, ax=ax)
     cbar.formatter.set_powerlimits((0, 0))
 
     r = np.max(np.sqrt(x**2 + y**2))
-    circle = plt.Circle((0, 0), r, color="k", fill=False, linewidth=1)
-    plt.gca().add_patch(circle)
+    circle = Circle((0, 0), r, color="k", fill=False, linewidth=1)
+    ax.add_patch(circle)
 
-    plt.axis("equal")
-    plt.xlabel("X (m)")
-    plt.ylabel("Y (m)")
-    plt.title(f"去一阶面形\nPV = {pv * 1e6:.2f} um")
+    ax.axis("equal")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    ax.set_title(f"去一阶面形\nPV = {pv * 1e6:.2f} um")
 
-    plt.savefig(output_image_path, dpi=300, bbox_inches="tight", pad_inches=0.1)
-    plt.close()
+    _save_figure(fig, output_image_path, profile)
     # print(f"Saved heatmap to {output_image_path}")
 
 
 def plot_tilt_heatmap(
-    x, y, tilt_urad, mean_val, std_val, max_val, metric_val, output_image_path
+    x,
+    y,
+    tilt_urad,
+    mean_val,
+    std_val,
+    max_val,
+    metric_val,
+    output_image_path,
+    render="raster",
+    profile="archival",
+    grid=None,
 ):
     """生成局部倾斜角度热力图"""
-    plt.figure(figsize=(8, 6))
-    cmap = plt.get_cmap("jet")
+    _check_render(render, profile)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    cmap = matplotlib.colormaps["jet"]
 
     mask = ~np.isnan(tilt_urad)
     if np.sum(mask) == 0:
         print("No valid tilt data to plot.")
         return
 
-    cntr = plt.tricontourf(x[mask], y[mask], tilt_urad[mask], levels=100, cmap=cmap)
-    cbar = plt.colorbar(cntr)
+    cntr = _filled_map(ax, x, y, tilt_urad, cmap, render, grid)
+    cbar = fig.colorbar(cntr, ax=ax)
     cbar.set_label("μrad")
 
     r = np.max(np.sqrt(x**2 + y**2))
-    circle = plt.Circle((0, 0), r, color="k", fill=False, linewidth=1)
-    plt.gca().add_patch(circle)
+    circle = Circle((0, 0), r, color="k", fill=False, linewidth=1)
+    ax.add_patch(circle)
 
-    plt.axis("equal")
-    plt.xlabel("X (m)")
-    plt.ylabel("Y (m)")
-    plt.title(f"局部角分布\nmax= {max_val:.2f} μrad, m3s = {metric_val:.2f} μrad")
+    ax.axis("equal")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    ax.set_title(f"局部角分布\nmax= {max_val:.2f} μrad, m3s = {metric_val:.2f} μrad")
 
-    plt.savefig(output_image_path, dpi=300, bbox_inches="tight", pad_inches=0.1)
-    plt.close()
+    _save_figure(fig, output_image_path, profile)
     # print(f"Saved tilt heatmap to {output_image_path}")
 
 
-def plot_high_tilt_heatmap(x, y, tilt_urad, threshold, output_image_path):
+def plot_high_tilt_heatmap(
+    x,
+    y,
+    tilt_urad,
+    threshold,
+    output_image_path,
+    render="raster",
+    profile="archival",
+    grid=None,
+):
     """生成大于特定阈值的局部倾斜角度热力图"""
-    plt.figure(figsize=(8, 6))
-    cmap = plt.get_cmap("jet")
+    _check_render(render, profile)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    cmap = matplotlib.colormaps["jet"]
 
     mask = (~np.isnan(tilt_urad)) & (tilt_urad > threshold)
 
     if np.sum(mask) == 0:
         # 如果没有超过阈值的点，生成一个空图或者提示图
-        plt.text(
+        ax.text(
             0.5,
             0.5,
             f"No data > {threshold} μrad",
             horizontalalignment="center",
             verticalalignment="center",
-            transform=plt.gca().transAxes,
+            transform=ax.transAxes,
         )
     else:
-        # 使用 scatter 绘制散点，因为超过阈值的区域可能是不连续的
-        sc = plt.scatter(x[mask], y[mask], c=tilt_urad[mask], cmap=cmap, s=5)
-        cbar = plt.colorbar(sc)
+        # 只绘制超过阈值的点，因为超过阈值的区域可能是不连续的
+        sc = _selected_map(ax, x, y, tilt_urad, mask, cmap, render, grid)
+        cbar = fig.colorbar(sc, ax=ax)
         cbar.set_label("μrad")
 
     r = np.max(np.sqrt(x**2 + y**2))
-    circle = plt.Circle((0, 0), r, color="k", fill=False, linewidth=1)
-    plt.gca().add_patch(circle)
+    circle = Circle((0, 0), r, color="k", fill=False, linewidth=1)
+    ax.add_patch(circle)
 
-    plt.axis("equal")
-    plt.xlabel("X (m)")
-    plt.ylabel("Y (m)")
-    plt.title(f"局部角分布 (大于{threshold}μrad区域)")
+    ax.axis("equal")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    ax.set_title(f"局部角分布 (大于{threshold}μrad区域)")
 
-    plt.savefig(output_image_path, dpi=300, bbox_inches="tight", pad_inches=0.1)
-    plt.close()
+    _save_figure(fig, output_image_path, profile)
     # print(f"Saved high tilt heatmap to {output_image_path}")
 
 
-def plot_nce_heatmap(x, y, z_nce, std_val, grid_x, grid_y, output_image_path):
+def plot_nce_heatmap(
+    x,
+    y,
+    z_nce,
+    std_val,
+    grid_x,
+    grid_y,
+    output_image_path,
+    render="raster",
+    profile="archival",
+    grid=None,
+):
     """生成NCE面形热力图"""
-    plt.figure(figsize=(8, 6))
-    cmap = plt.get_cmap("jet")
+    _check_render(render, profile)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    cmap = matplotlib.colormaps["jet"]
 
     mask = ~np.isnan(z_nce)
     if np.sum(mask) == 0:
         print("No valid NCE data to plot.")
         return
 
-    cntr = plt.tricontourf(x[mask], y[mask], z_nce[mask], levels=100, cmap=cmap)
-    cbar = plt.colorbar(cntr)
+    cntr = _filled_map(ax, x, y, z_nce, cmap, render, grid)
+    cbar = fig.colorbar(cntr, ax=ax)
     cbar.formatter.set_powerlimits((0, 0))
 
     for gx in grid_x:
-        plt.axvline(gx, color="k", linewidth=0.5)
+        ax.axvline(gx, color="k", linewidth=0.5)
     for gy in grid_y:
-        plt.axhline(gy, color="k", linewidth=0.5)
+        ax.axhline(gy, color="k", linewidth=0.5)
 
     r = np.max(np.sqrt(x**2 + y**2))
-    circle = plt.Circle((0, 0), r, color="k", fill=False, linewidth=1)
-    plt.gca().add_patch(circle)
+    circle = Circle((0, 0), r, color="k", fill=False, linewidth=1)
+    ax.add_patch(circle)
 
-    plt.axis("equal")
-    plt.xlabel("X (m)")
-    plt.ylabel("Y (m)")
-    plt.title(f"NCE面形（96场布局）\n3std = {3 * std_val * 1e9:.2f} nm")
+    ax.axis("equal")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    ax.set_title(f"NCE面形（96场布局）\n3std = {3 * std_val * 1e9:.2f} nm")
 
-    plt.savefig(output_image_path, dpi=300, bbox_inches="tight", pad_inches=0.1)
-    plt.close()
+    _save_figure(fig, output_image_path, profile)
     # print(f"Saved NCE heatmap to {output_image_path}")
 
 
+def _robust_stats(values):
+    """中值和3σ过滤后的标准差"""
+    median = np.median(values)
+    std_raw = np.std(values)
+    filtered = values[np.abs(values - median) <= 3 * std_raw]
+    return median, np.std(filtered)
+
+
+def _write_outputs(
+    cache, output_path, outputs, render_profile, workers=None, on_output=None
+):
+    """
+    生成输出文件 outputs: [(后缀, 缓存键, writer)],图像扩展名按 render_profile 替换
+
+    绘图使用面向对象的 Figure API,不依赖 pyplot 的全局状态,
+    因此各文件可在 workers 个线程中并行生成 (默认: CPU 核数;为 1 时依次生成)。
+    每个文件完成后在调用线程中调用 on_output(后缀, 路径);
+    没有有效数据而未生成的文件不回调
+    """
+
+    def write(suffix, key, writer):
+        path = output_path.replace(".txt", profile_suffix(suffix, render_profile))
+        cache.write_file(key, path, writer)
+        return suffix, path
+
+    def done(suffix, path):
+        if on_output is not None and os.path.exists(path):
+            on_output(suffix, path)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(outputs))
+
+    if workers <= 1:
+        for job in outputs:
+            done(*write(*job))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(write, *job) for job in outputs]
+        try:
+            for future in as_completed(futures):
+                done(*future.result())
+        except BaseException:
+            # 取消或出错时不再开始其余的文件
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _raw_points(
+    cache, input_path, scale, step_x, step_y, edge_clearance, exclusion_zones
+):
+    """
+    原始XYZ文件的解析、物理坐标、分箱与边缘清除阶段
+
+    返回分箱后的 x, y, z、实际使用的分辨率和分箱阶段的缓存键;没有有效数据时返回 None
+    """
+
+    # 1. 解析 (键: 文件内容)
+    def parse():
+        header = read_xyz_header(input_path)
+        # 读取数据 (分块向量化解析)
+        return (header,) + read_xyz(input_path, header=header)
+
+    parse_key = ("parse", cache.digest(input_path))
+    header, ix_arr, iy_arr, z_um_arr = cache.get(parse_key, parse)
+
+    if scale is None:
+        scale = header.scale if header.scale is not None else DEFAULT_SCALE
+
+    SCALE = scale
+    STEP_X = step_x
+    STEP_Y = step_y
+
+    # print(f"Found {len(z_um_arr)} valid data points.")
+
+    if len(z_um_arr) == 0:
+        print("Error: No valid data points found in input file!")
+        return None
+
+    # 2. 物理坐标 (键: 分辨率)
+    def physical():
+        # 计算中心点(数据范围的中点)
+        min_ix, max_ix = int(ix_arr.min()), int(ix_arr.max())
+        min_iy, max_iy = int(iy_arr.min()), int(iy_arr.max())
+
+        CENTER_IX = (min_ix + max_ix) / 2.0
+        CENTER_IY = (min_iy + max_iy) / 2.0
+
+        # print(f"Calculated center: CENTER_IX={CENTER_IX:.1f}, CENTER_IY={CENTER_IY:.1f}")
+        # print(f"Data range: ix=[{min_ix}, {max_ix}], iy=[{min_iy}, {max_iy}]")
+
+        # 转换到物理坐标
+        x_phys = (ix_arr - CENTER_IX) * SCALE
+        y_phys = (CENTER_IY - iy_arr) * SCALE
+        z_phys = z_um_arr * 1e-6
+        return x_phys, y_phys, z_phys
+
+    physical_key = ("physical", parse_key, SCALE)
+    x_phys, y_phys, z_phys = cache.get(physical_key, physical)
+
+    # 3. 分箱与边缘清除 (键: 子口径尺寸、边缘清除量、排除区域)
+    def binning():
+        binned = bin_points(x_phys, y_phys, z_phys, STEP_X, STEP_Y)
+
+        # print(f"Grid starts: START_X={binned.start_x:.6f}, START_Y={binned.start_y:.6f}")
+        # print(f"Binned {len(z_phys)} data points into {binned.occupied.sum()} bins.")
+
+        # 应用边缘清除和排除区域
+        keep = None
+        radii = None
+        if edge_clearance > 0 or exclusion_zones:
+            radius_limit = np.inf
+            if edge_clearance > 0:
+                # 将原始半径四舍五入到毫米级别，然后减去清除量
+                radii = clearance_radius(binned, edge_clearance)
+                radius_limit = radii[1] / 1000  # 转换回米
+
+            keep = keep_mask(binned, radius_limit, exclusion_zones)
+
+        return binned.points(keep) + (radii, keep is not None)
+
+    binning_key = (
+        "binning",
+        physical_key,
+        STEP_X,
+        STEP_Y,
+        edge_clearance,
+        freeze_zones(exclusion_zones),
+    )
+    x_arr, y_arr, z_arr, radii, clipped = cache.get(binning_key, binning)
+    _print_clearance(radii, clipped, edge_clearance, len(z_arr))
+
+    return x_arr, y_arr, z_arr, SCALE, binning_key
+
+
+def _print_clearance(radii, clipped, edge_clearance, n_bins):
+    if radii is not None:
+        original_radius_mm, clearance_radius_mm = radii
+        print(f"原始最大半径: {original_radius_mm:.0f}mm")
+        print(f"清除后半径: {clearance_radius_mm:.0f}mm")
+    if clipped:
+        print(
+            f"After edge clearance ({edge_clearance * 1000:.1f}mm): {n_bins} bins remaining."
+        )
+
+
+def _streamed_points(
+    cache,
+    tracker,
+    input_path,
+    scale,
+    step_x,
+    step_y,
+    edge_clearance,
+    exclusion_zones,
+    memory_budget,
+):
+    """
+    分块模式下原始XYZ文件的各阶段,见 out_of_core;返回值与 _raw_points 相同
+
+    解析阶段只统计有效像素的范围,分箱阶段再次分块读取文件,
+    直接累加到磁盘映射的分箱网格,原始数据点不整体载入内存
+    """
+
+    # 1. 解析: 文件头和有效像素范围 (键: 文件内容)
+    def parse():
+        header = read_xyz_header(input_path)
+        extent = scan_xyz(
+            input_path, chunk_bytes(memory_budget), tracker.stage_callback("parse")
+        )
+        return header, extent
+
+    parse_key = ("parse", cache.digest(input_path), "scan")
+    header, extent = cache.get(parse_key, parse)
+
+    if scale is None:
+        scale = header.scale if header.scale is not None else DEFAULT_SCALE
+
+    if extent is None:
+        print("Error: No valid data points found in input file!")
+        return None
+
+    # 2. 物理坐标原点 (键: 分辨率)
+    physical_key = ("physical", parse_key, scale)
+    center = cache.get(physical_key, lambda: pixel_center(extent))
+
+    # 3. 分块分箱与按行带边缘清除 (键: 子口径尺寸、边缘清除量、排除区域)
+    def binning():
+        binned = stream_bin_xyz(
+            input_path,
+            extent,
+            center,
+            scale,
+            step_x,
+            step_y,
+            memory_budget,
+            tracker.stage_callback("binning"),
+        )
+        return clip_bins(binned, edge_clearance, exclusion_zones, memory_budget)
+
+    binning_key = (
+        "binning",
+        physical_key,
+        step_x,
+        step_y,
+        edge_clearance,
+        freeze_zones(exclusion_zones),
+    )
+    x_arr, y_arr, z_arr, radii, clipped = cache.get(binning_key, binning)
+    _print_clearance(radii, clipped, edge_clearance, len(z_arr))
+
+    return x_arr, y_arr, z_arr, scale, binning_key
+
+
+def _processed_points(cache, input_path, scale):
+    """
+    预处理数据 (*-processed.txt / *-results.npz) 的读取阶段: 数据已分箱,直接进入去倾斜及之后的阶段
+
+    返回 x, y, z、分辨率 (scale 为 None 时取 .npz 中记录的值,仍未知时为 NaN)
+    和读取阶段的缓存键;没有数据时返回 None
+    """
+    points_key = ("points", cache.digest(input_path))
+    x_arr, y_arr, z_arr, stored_scale = cache.get(
+        points_key, lambda: read_processed(input_path)
+    )
+    if len(z_arr) == 0:
+        print("Error: No valid data points found in input file!")
+        return None
+
+    if scale is None:
+        scale = stored_scale if stored_scale is not None else np.nan
+    return x_arr, y_arr, z_arr, scale, points_key
+
+
 def process_xyz(
     input_path,
     output_path,
-    scale=0.000175,
+    scale=None,
     step_x=0.0034,
     step_y=0.0005,
     slit_height=0.008,
     edge_clearance=0.05,
     sfma_threshold=7.5e-9,
     tilt_threshold=3e-6,
+    exclusion_zones=None,
+    sfma_engine="integral",
+    sfma_workers=None,
+    tilt_engine="vectorized",
+    render="raster",
+    render_profile="archival",
+    stage_cache=None,
+    plot_workers=None,
+    on_metrics=None,
+    on_output=None,
+    track_memory=False,
+    cprofile=False,
+    on_progress=None,
+    cancel=None,
+    memory_budget=None,
 ):
     """
     处理XYZ文件并生成分析结果
 
+    分析按阶段进行: 解析 → 物理坐标 → 分箱/边缘清除 → 去倾斜 →
+    SFMA/局部角/NCE面形图 → 统计 → 绘图与输出文件。
+    输入也可以是预处理数据 (*-processed.txt 或 *-results.npz,见 result_io),
+    此时跳过解析和分箱,scale 之外的分箱参数 (step_x, step_y, edge_clearance,
+    exclusion_zones) 不起作用。
+    提供 stage_cache 时每个阶段以上游阶段和自身参数为键缓存,
+    例如只修改阈值时仅重新绘制两张高阈值图。
+    提供 memory_budget 时以分块 (out-of-core) 方式处理放不进内存的大面形 (如拼接数据):
+    原始数据点流式分箱到磁盘映射的网格,SFMA 按列带、局部角按行带计算,
+    峰值内存由预算和分箱后的子口径数决定,与输入文件大小无关,见 out_of_core
+
     Args:
-        input_path: 输入XYZ文件路径
+        input_path: 输入文件路径: 原始XYZ文件,或预处理数据 *-processed.txt / *-results.npz;
+                    其他 .txt / .npz 文件抛出 ValueError
         output_path: 输出文件路径
-        scale: 原始数据分辨率,单位米 (默认: 0.000175m = 0.175mm)
+        scale: 原始数据分辨率,单位米 (默认: None, 使用文件头中的分辨率;
+               文件头缺失时使用 0.000175m = 0.175mm;
+               预处理数据输入时仅作记录,.txt 未提供时为 NaN)
         step_x: X方向子口径尺寸,单位米 (默认: 0.0034m = 3.4mm)
         step_y: Y方向子口径尺寸,单位米 (默认: 0.0005m = 0.5mm)
         slit_height: 调平狭缝宽度,单位米 (默认: 0.008m = 8mm)
         edge_clearance: 边缘清除量,单位米 (默认: 0.0m = 0mm, 不清除边缘)
         sfma_threshold: SFMA阈值,单位米 (默认: 7.5nm)
         tilt_threshold: 局部倾斜阈值,单位弧度 (默认: 3urad)
+        exclusion_zones: 额外排除区域(缺口、夹持区等),单位米,
+                         格式见 binning.keep_mask (默认: None)
+        sfma_engine: SFMA计算引擎,见 calculate_dynamic_sfma (默认: "integral")
+        sfma_workers: SFMA并行进程数 (默认: None, 单进程)
+        tilt_engine: 局部角计算引擎,见 calculate_local_tilt (默认: "vectorized")
+        render: 绘图方式,"raster" 栅格或 "contour" 等高线,见 RENDER_MODES
+                (默认: "raster")
+        render_profile: 图像输出规格,见 RENDER_PROFILES;决定图像的分辨率和文件格式,
+                        非 PNG 格式时图像文件扩展名随之改变,见 output_files
+                        (默认: "archival", 300 dpi PNG)
+        stage_cache: 分阶段缓存 stage_cache.StageCache (默认: None, 不缓存)
+        plot_workers: 并行生成图像和输出文件的线程数 (默认: None, CPU 核数)
+        on_metrics: 统计完成、开始绘图之前调用 on_metrics(指标) (默认: None)
+        on_output: 每个输出文件生成后调用 on_output(后缀, 路径),
+                   后缀见 OUTPUT_SUFFIXES,预处理数据为 "" (默认: None)
+        track_memory: 用 tracemalloc 记录各阶段的内存峰值 (默认: False)
+        cprofile: 用 cProfile 统计整个运行的函数耗时 (默认: False);
+                  track_memory 或 cprofile 开启时输出文件依次生成
+        on_progress: 进度回调 on_progress(总体进度 0~1, 阶段名, 阶段内完成数, 阶段内总数),
+                     SFMA 按扫描列、局部角按行报告,其余阶段完成时报告 (1, 1);
+                     在调用线程中调用 (默认: None)
+        cancel: 取消标志 progress.CancelToken;取消后在下一个阶段或扫描列/行
+                抛出 progress.AnalysisCancelled (默认: None)
+        memory_budget: 分块处理的内存预算,单位字节;决定每次解析的数据块和
+                       SFMA 列带/局部角行带的大小,不含分箱后各子口径的数组;
+                       此时 sfma_workers 不起作用 (默认: None, 整体载入内存)
+
+    Returns:
+        指标字典,没有有效数据时为 None;其中 "perf" 为性能记录:
+        各阶段耗时 (及内存峰值)、总耗时和 cProfile 统计,见 perf.StageProfiler.report
     """
     # print(f"Processing {input_path} -> {output_path}")
     # print(
     #     f"Parameters: scale={scale}m, step_x={step_x}m, step_y={step_y}m, slit_height={slit_height}m"
     # )
-
-    SCALE = scale
-    STEP_X = step_x
-    STEP_Y = step_y
-
-    # 第一遍: 读取数据确定中心和边界
-    # print("First pass: Reading data to determine center and bounds...")
-
-    with open(input_path, "r") as f:
-        lines = f.readlines()
-
-    # print(f"Read {len(lines)} lines from input.")
-
-    raw_data = []
-    for line in lines[14:]:
-        parts = line.strip().split()
-        if len(parts) < 3:
-            continue
-
-        try:
-            ix = int(parts[0])
-            iy = int(parts[1])
-            if parts[2] == "No":
-                continue
-            z_um = float(parts[2])
-            raw_data.append((ix, iy, z_um))
-        except ValueError:
-            continue
-
-    # print(f"Found {len(raw_data)} valid data points.")
-
-    if len(raw_data) == 0:
-        print("Error: No valid data points found in input file!")
+    _check_render(render, render_profile)
+    cache = NO_CACHE if stage_cache is None else stage_cache
+
+    # 阶段数: 解析、物理坐标、分箱 (预处理数据只有读取),预处理数据输出、
+    # 去倾斜、三项面形图、统计,以及各输出文件
+    processed = is_processed_input(input_path)
+    n_stages = (1 if processed else 3) + 6 + len(OUTPUT_SUFFIXES)
+    tracker = StageProgress(cache, n_stages, on_progress, cancel)
+
+    profiler = StageProfiler(tracker, track_memory=track_memory, cprofile=cprofile)
+    if profiler.serial:
+        # 内存峰值和 cProfile 只对依次执行的阶段有意义
+        plot_workers = 1
+    with profiler:
+        metrics = _analyze(
+            profiler,
+            tracker,
+            input_path,
+            output_path,
+            scale,
+            step_x,
+            step_y,
+            slit_height,
+            edge_clearance,
+            sfma_threshold,
+            tilt_threshold,
+            exclusion_zones,
+            sfma_engine,
+            sfma_workers,
+            tilt_engine,
+            render,
+            render_profile,
+            plot_workers,
+            on_metrics,
+            on_output,
+            memory_budget,
+        )
+    if metrics is None:
         return None
 
-    # 计算中心点(数据范围的中点)
-    ix_values = [d[0] for d in raw_data]
-    iy_values = [d[1] for d in raw_data]
-
-    min_ix, max_ix = min(ix_values), max(ix_values)
-    min_iy, max_iy = min(iy_values), max(iy_values)
-
-    CENTER_IX = (min_ix + max_ix) / 2.0
-    CENTER_IY = (min_iy + max_iy) / 2.0
-
-    # print(f"Calculated center: CENTER_IX={CENTER_IX:.1f}, CENTER_IY={CENTER_IY:.1f}")
-    # print(f"Data range: ix=[{min_ix}, {max_ix}], iy=[{min_iy}, {max_iy}]")
-
-    # 第二遍: 转换到物理坐标并分箱
-    # print("Second pass: Converting to physical coordinates and binning...")
+    metrics = dict(metrics)
+    metrics[PERF_KEY] = profiler.report()
+    return metrics
 
-    physical_points = []
-    for ix, iy, z_um in raw_data:
-        x = (ix - CENTER_IX) * SCALE
-        y = (CENTER_IY - iy) * SCALE
-        z_m = z_um * 1e-6
-        physical_points.append((x, y, z_m))
 
-    x_coords = [p[0] for p in physical_points]
-    y_coords = [p[1] for p in physical_points]
-
-    min_x, max_x = min(x_coords), max(x_coords)
-    min_y, max_y = min(y_coords), max(y_coords)
-
-    START_X = np.floor(min_x / STEP_X) * STEP_X
-    START_Y = np.floor(min_y / STEP_Y) * STEP_Y
-
-    # print(
-    #     f"Physical bounds: x=[{min_x:.6f}, {max_x:.6f}], y=[{min_y:.6f}, {max_y:.6f}]"
-    # )
-    # print(f"Grid starts: START_X={START_X:.6f}, START_Y={START_Y:.6f}")
-
-    # 数据分箱
-    bins = {}
-    data_count = 0
-
-    for x, y, z_m in physical_points:
-        k_x = int(round((x - START_X) / STEP_X))
-        k_y = int(round((y - START_Y) / STEP_Y))
-        key = (k_x, k_y)
-
-        if key not in bins:
-            bins[key] = [0.0, 0]
-
-        bins[key][0] += z_m
-        bins[key][1] += 1
-        data_count += 1
-
-    # print(f"Binned {data_count} data points into {len(bins)} bins.")
-
-    # 应用边缘清除
-    if edge_clearance > 0:
-        # 计算数据的径向范围
-        all_x = [START_X + k[0] * STEP_X for k in bins.keys()]
-        all_y = [START_Y + k[1] * STEP_Y for k in bins.keys()]
-        max_radius = max(np.sqrt(np.array(all_x) ** 2 + np.array(all_y) ** 2))
-
-        # 将原始半径四舍五入到毫米级别，然后减去清除量
-        original_radius_mm = round(max_radius * 1000)  # 转换为mm并四舍五入
-        clearance_radius_mm = original_radius_mm - (edge_clearance * 1000)  # 减去清除量
-        clearance_radius = clearance_radius_mm / 1000  # 转换回米
-
-        # 过滤掉边缘区域的数据点
-        filtered_bins = {}
-        for key, value in bins.items():
-            grid_x = START_X + key[0] * STEP_X
-            grid_y = START_Y + key[1] * STEP_Y
-            radius = np.sqrt(grid_x**2 + grid_y**2)
-            if radius <= clearance_radius:
-                filtered_bins[key] = value
-
-        bins = filtered_bins
-        print(f"原始最大半径: {original_radius_mm:.0f}mm")
-        print(f"清除后半径: {clearance_radius_mm:.0f}mm")
-        print(
-            f"After edge clearance ({edge_clearance * 1000:.1f}mm): {len(bins)} bins remaining."
+def _analyze(
+    cache,
+    tracker,
+    input_path,
+    output_path,
+    scale,
+    step_x,
+    step_y,
+    slit_height,
+    edge_clearance,
+    sfma_threshold,
+    tilt_threshold,
+    exclusion_zones,
+    sfma_engine,
+    sfma_workers,
+    tilt_engine,
+    render,
+    render_profile,
+    plot_workers,
+    on_metrics,
+    on_output,
+    memory_budget,
+):
+    """
+    process_xyz 的各阶段,参数含义见 process_xyz;tracker 为 progress.StageProgress,
+    提供阶段内的进度回调。没有有效数据时返回 None
+    """
+    if is_processed_input(input_path):
+        loaded = _processed_points(cache, input_path, scale)
+    elif memory_budget is not None:
+        loaded = _streamed_points(
+            cache,
+            tracker,
+            input_path,
+            scale,
+            step_x,
+            step_y,
+            edge_clearance,
+            exclusion_zones,
+            memory_budget,
         )
+    else:
+        loaded = _raw_points(
+            cache, input_path, scale, step_x, step_y, edge_clearance, exclusion_zones
+        )
+    if loaded is None:
+        return None
+    x_arr, y_arr, z_arr, SCALE, binning_key = loaded
 
     # 输出处理后的数据
-    plot_x, plot_y, plot_z = [], [], []
-    sorted_keys = sorted(bins.keys(), key=lambda k: (k[1], k[0]))
-
-    with open(output_path, "w") as f:
-        for k_x, k_y in sorted_keys:
-            grid_x = START_X + k_x * STEP_X
-            grid_y = START_Y + k_y * STEP_Y
-            sum_z, count = bins[(k_x, k_y)]
-            avg_z = sum_z / count
-
-            f.write(f"{grid_x:.15f} {grid_y:.15f} {avg_z:.15f}\n")
-            plot_x.append(grid_x)
-            plot_y.append(grid_y)
-            plot_z.append(avg_z)
+    cache.write_file(
+        ("processed.txt", binning_key),
+        output_path,
+        lambda path: write_points(path, x_arr, y_arr, z_arr, skip_nan=False),
+    )
+    if on_output is not None:
+        on_output("", output_path)
 
     # print(f"Saved processed data to {output_path}")
 
     # 可视化分析
-    if len(plot_x) > 0:
-        x_arr = np.array(plot_x)
-        y_arr = np.array(plot_y)
-        z_arr = np.array(plot_z)
-
-        # 计算z_resid用于SFMA和Tilt分析
-        z_resid = remove_tilt(x_arr, y_arr, z_arr)
-
+    if len(x_arr) > 0:
         # # 1. 去一阶面形 (已禁用)
         # z_resid, pv = calculate_surface_form(x_arr, y_arr, z_arr)
         # image_path = output_path.replace(".txt", ".png")
         # plot_surface_heatmap(x_arr, y_arr, z_resid, pv, image_path)
 
-        # # 2. NCE分析 (已禁用)
-        # z_nce, _, _ = calculate_nce(
-        #     x_arr, y_arr, z_arr, field_size_x=0.026, field_size_y=0.008
-        # )
-        # valid_nce = z_nce[~np.isnan(z_nce)]
-        # mean_nce = np.median(valid_nce)
-        # std_raw = np.std(valid_nce)
-        # mask_sigma = np.abs(valid_nce - mean_nce) <= 3 * std_raw
-        # filtered_nce = valid_nce[mask_sigma]
-        # std_nce = np.std(filtered_nce)
-        # nce_metric = mean_nce + 3 * std_nce
-        # disp_field_x = 0.026
-        # disp_field_y = 0.033
-        # n_disp_cols = int(np.ceil(np.max(np.abs(x_arr)) / disp_field_x))
-        # n_disp_rows = int(np.ceil(np.max(np.abs(y_arr)) / disp_field_y))
-        # gx = np.arange(-n_disp_cols, n_disp_cols + 1) * disp_field_x
-        # gy = np.arange(-n_disp_rows, n_disp_rows + 1) * disp_field_y
-        # nce_image_path = output_path.replace(".txt", "-nce.png")
-        # plot_nce_heatmap(x_arr, y_arr, z_nce, std_nce, gx, gy, nce_image_path)
-
-        # 1. SFMA分析
-        z_sfma = calculate_dynamic_sfma(
-            x_arr,
-            y_arr,
-            z_resid,
-            slit_h=slit_height,
+        # 4. 去倾斜 (无参数),计算z_resid用于SFMA和Tilt分析
+        def detilt():
+            z_resid = remove_tilt(x_arr, y_arr, z_arr)
+            # 网格化一次,供各项指标共用;分块模式下高度网格放在磁盘映射数组中
+            allocate = None
+            if memory_budget is not None:
+                allocate = partial(disk_array, fill_value=np.nan)
+            return z_resid, SurfaceGrid.from_points(x_arr, y_arr, z_resid, allocate)
+
+        detilt_key = ("detilt", binning_key)
+        z_resid, surface = cache.get(detilt_key, detilt)
+
+        # 5. 面形图 (键: 各自的计算参数;并行进程数不影响结果)
+        sfma_key = ("sfma", detilt_key, slit_height, sfma_engine)
+        z_sfma = cache.get(
+            sfma_key,
+            lambda: calculate_dynamic_sfma(
+                x_arr,
+                y_arr,
+                z_resid,
+                grid=surface,
+                slit_h=slit_height,
+                engine=sfma_engine,
+                workers=sfma_workers,
+                progress=tracker.stage_callback("sfma"),
+                memory_budget=memory_budget,
+            ),
         )
 
-        valid_sfma = z_sfma[~np.isnan(z_sfma)]
-        mean_sfma = np.median(valid_sfma)
-        std_sfma_raw = np.std(valid_sfma)
-        filtered_sfma = valid_sfma
-
-        std_sfma = np.std(filtered_sfma)
-        sfma_metric = np.median(filtered_sfma) + 3 * std_sfma
-        sfma_image_path = output_path.replace(".txt", "-sfma.png")
-        plot_sfma_heatmap(x_arr, y_arr, z_sfma, sfma_metric, sfma_image_path)
-
-        # 1.1 SFMA 高阈值分析
-        sfma_high_image_path = output_path.replace(".txt", "-sfma-high.png")
-        plot_sfma_high_heatmap(
-            x_arr, y_arr, z_sfma, sfma_threshold, sfma_high_image_path
+        tilt_key = ("tilt", detilt_key, tilt_engine)
+        tilt_urad = cache.get(
+            tilt_key,
+            lambda: calculate_local_tilt(
+                x_arr,
+                y_arr,
+                z_resid,
+                engine=tilt_engine,
+                grid=surface,
+                progress=tracker.stage_callback("tilt"),
+                memory_budget=memory_budget,
+            ),
         )
 
-        # 保存SFMA map到txt文件
-        sfma_txt_path = output_path.replace(".txt", "-sfma.txt")
-        with open(sfma_txt_path, "w") as f:
-            for i in range(len(x_arr)):
-                if not np.isnan(z_sfma[i]):
-                    f.write(f"{x_arr[i]:.15f} {y_arr[i]:.15f} {z_sfma[i]:.15f}\n")
-
-        # 2. 局部角分析
-        tilt_urad = calculate_local_tilt(x_arr, y_arr, z_resid)
-
-        valid_tilt = tilt_urad[~np.isnan(tilt_urad)]
-        median_tilt = np.median(valid_tilt)
-        std_tilt = np.std(valid_tilt)
-        max_tilt = np.max(valid_tilt)
-        tilt_metric = median_tilt + 3 * std_tilt
-
-        tilt_image_path = output_path.replace(".txt", "-tilt.png")
-        plot_tilt_heatmap(
-            x_arr,
-            y_arr,
-            tilt_urad,
-            median_tilt,
-            std_tilt,
-            max_tilt,
-            tilt_metric,
-            tilt_image_path,
+        # NCE使用未去倾斜的面形,每个场单独去倾斜
+        nce_key = ("nce", detilt_key)
+        z_nce = cache.get(
+            nce_key,
+            lambda: calculate_nce(
+                x_arr,
+                y_arr,
+                z_arr,
+                field_size_x=0.026,
+                field_size_y=0.008,
+                grid=surface,
+            )[0],
         )
 
-        # 保存Local Tilt map到txt文件
-        tilt_txt_path = output_path.replace(".txt", "-tilt.txt")
-        with open(tilt_txt_path, "w") as f:
-            for i in range(len(x_arr)):
-                if not np.isnan(tilt_urad[i]):
-                    f.write(f"{x_arr[i]:.15f} {y_arr[i]:.15f} {tilt_urad[i]:.15f}\n")
-
-        # 3. 局部倾斜角度分析 (>阈值)
-        high_tilt_image_path = output_path.replace(".txt", "-tilt-high.png")
-        # tilt_threshold is in radians, convert to urad for display if needed inside function?
-        # plot_high_tilt_heatmap expects threshold in urad (based on previous hardcoded 12.5)
-        # Wait, let's check plot_high_tilt_heatmap implementation.
-        # It takes tilt_urad and threshold. tilt_urad is in urad.
-        # So we need to pass threshold in urad.
-        plot_high_tilt_heatmap(
-            x_arr, y_arr, tilt_urad, tilt_threshold * 1e6, high_tilt_image_path
-        )
+        # 6. 统计
+        def statistics():
+            valid_sfma = z_sfma[~np.isnan(z_sfma)]
+            std_sfma = np.std(valid_sfma)
+            sfma_metric = np.median(valid_sfma) + 3 * std_sfma
+
+            valid_tilt = tilt_urad[~np.isnan(tilt_urad)]
+            median_tilt = np.median(valid_tilt)
+            std_tilt = np.std(valid_tilt)
+            max_tilt = np.max(valid_tilt)
+            tilt_metric = median_tilt + 3 * std_tilt
+
+            valid_nce = z_nce[~np.isnan(z_nce)]
+            if len(valid_nce) > 0:
+                mean_nce, std_nce = _robust_stats(valid_nce)
+                nce_metric = mean_nce + 3 * std_nce
+            else:
+                std_nce = nce_metric = np.nan
 
-        return {
+            return {
+                "sfma": sfma_metric,
+                "tilt": tilt_metric,
+                "median_tilt": median_tilt,
+                "std_tilt": std_tilt,
+                "max_tilt": max_tilt,
+                "nce": nce_metric,
+                "std_nce": std_nce,
+            }
+
+        stats = cache.get(("stats", sfma_key, tilt_key, nce_key), statistics)
+
+        metrics = {
             # "pv": pv,  # 已禁用
-            # "nce": nce_metric,  # 已禁用
-            "sfma": sfma_metric,
-            "tilt": tilt_metric,
+            "nce": stats["nce"],
+            "sfma": stats["sfma"],
+            "tilt": stats["tilt"],
+            "scale": SCALE,
         }
+        # 指标先于图像交给调用方,界面可以立即显示
+        if on_metrics is not None:
+            on_metrics(metrics)
+
+        def write_results(path):
+            maps = {
+                "x": x_arr,
+                "y": y_arr,
+                "z": z_arr,
+                "sfma": z_sfma,
+                "tilt": tilt_urad,
+                "nce": z_nce,
+            }
+            params = {
+                "scale": SCALE,
+                "step_x": step_x,
+                "step_y": step_y,
+                "slit_height": slit_height,
+                "edge_clearance": edge_clearance,
+                "sfma_threshold": sfma_threshold,
+                "tilt_threshold": tilt_threshold,
+                "exclusion_zones": exclusion_zones or [],
+                "sfma_engine": sfma_engine,
+                "tilt_engine": tilt_engine,
+            }
+            save_results(path, maps, surface, params, metrics)
+
+        # 7.3 NCE 显示用的场布局 (26mm x 33mm,以原点为中心)
+        def plot_nce(path):
+            disp_field_x = 0.026
+            disp_field_y = 0.033
+            n_disp_cols = int(np.ceil(np.max(np.abs(x_arr)) / disp_field_x))
+            n_disp_rows = int(np.ceil(np.max(np.abs(y_arr)) / disp_field_y))
+            gx = np.arange(-n_disp_cols, n_disp_cols + 1) * disp_field_x
+            gy = np.arange(-n_disp_rows, n_disp_rows + 1) * disp_field_y
+            plot_nce_heatmap(
+                x_arr,
+                y_arr,
+                z_nce,
+                stats["std_nce"],
+                gx,
+                gy,
+                path,
+                render,
+                render_profile,
+                surface,
+            )
+
+        # 7. 绘图与输出文件: [(后缀, 缓存键, writer)],各文件相互独立
+        outputs = [
+            # 7.1 SFMA
+            (
+                "-sfma.png",
+                ("sfma.png", sfma_key, render, render_profile),
+                lambda path: plot_sfma_heatmap(
+                    x_arr,
+                    y_arr,
+                    z_sfma,
+                    stats["sfma"],
+                    path,
+                    render,
+                    render_profile,
+                    surface,
+                ),
+            ),
+            # SFMA 高阈值分析
+            (
+                "-sfma-high.png",
+                ("sfma-high.png", sfma_key, sfma_threshold, render, render_profile),
+                lambda path: plot_sfma_high_heatmap(
+                    x_arr,
+                    y_arr,
+                    z_sfma,
+                    sfma_threshold,
+                    path,
+                    render,
+                    render_profile,
+                    surface,
+                ),
+            ),
+            # 保存SFMA map到txt文件
+            (
+                "-sfma.txt",
+                ("sfma.txt", sfma_key),
+                lambda path: write_points(path, x_arr, y_arr, z_sfma),
+            ),
+            # 7.2 局部角
+            (
+                "-tilt.png",
+                ("tilt.png", tilt_key, render, render_profile),
+                lambda path: plot_tilt_heatmap(
+                    x_arr,
+                    y_arr,
+                    tilt_urad,
+                    stats["median_tilt"],
+                    stats["std_tilt"],
+                    stats["max_tilt"],
+                    stats["tilt"],
+                    path,
+                    render,
+                    render_profile,
+                    surface,
+                ),
+            ),
+            # 保存Local Tilt map到txt文件
+            (
+                "-tilt.txt",
+                ("tilt.txt", tilt_key),
+                lambda path: write_points(path, x_arr, y_arr, tilt_urad),
+            ),
+            # 局部倾斜角度分析 (>阈值)
+            # plot_high_tilt_heatmap 的阈值单位为 urad
+            (
+                "-tilt-high.png",
+                ("tilt-high.png", tilt_key, tilt_threshold, render, render_profile),
+                lambda path: plot_high_tilt_heatmap(
+                    x_arr,
+                    y_arr,
+                    tilt_urad,
+                    tilt_threshold * 1e6,
+                    path,
+                    render,
+                    render_profile,
+                    surface,
+                ),
+            ),
+            # 7.3 NCE
+            ("-nce.png", ("nce.png", nce_key, render, render_profile), plot_nce),
+            # 保存NCE map到txt文件
+            (
+                "-nce.txt",
+                ("nce.txt", nce_key),
+                lambda path: write_points(path, x_arr, y_arr, z_nce),
+            ),
+            # 7.4 二进制结果文件: 全部面形、网格几何、参数和指标;
+            # 文件中记录的参数都在键中 (预处理数据输入时分箱参数不影响上游的键)
+            (
+                "-results.npz",
+                (
+                    "results.npz",
+                    sfma_key,
+                    tilt_key,
+                    nce_key,
+                    SCALE,
+                    step_x,
+                    step_y,
+                    edge_clearance,
+                    freeze_zones(exclusion_zones),
+                    sfma_threshold,
+                    tilt_threshold,
+                ),
+                write_results,
+            ),
+        ]
+
+        def output_done(suffix, path):
+            # 并行绘图线程中完成的阶段在这里报告进度
+            tracker.emit()
+            if on_output is not None:
+                on_output(suffix, path)
+
+        _write_outputs(
+            cache, output_path, outputs, render_profile, plot_workers, output_done
+        )
+        tracker.emit()
+
+        return metrics
 
 
 if __name__ == "__main__":
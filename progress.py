@@ -0,0 +1,104 @@
+"""
+分析进度与取消
+StageProgress 包装分阶段缓存: 每个阶段开始前检查取消标志,结束后报告总体进度;
+SFMA 扫描和局部角计算在阶段内部按列/行报告进度,见 stage_callback
+"""
+
+import threading
+
+from stage_cache import file_digest
+
+
+class AnalysisCancelled(Exception):
+    """分析被取消 (CancelToken.cancel)"""
+
+
+class CancelToken:
+    """取消标志,可在其他线程中调用 cancel();分析在下一个检查点抛出 AnalysisCancelled"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise AnalysisCancelled("分析已取消")
+
+
+class StageProgress:
+    """
+    报告进度、检查取消的分阶段缓存
+
+    接口与 stage_cache.StageCache 相同,实际缓存交给 inner;n_stages 为本次运行的阶段数
+    (含各输出文件)。进度回调 on_progress(总体进度 0~1, 阶段名, 阶段内完成数, 阶段内总数)
+    只在创建本对象的线程中调用,与 process_xyz 的 on_output 一致;
+    在其他线程 (并行绘图) 中完成的阶段,在调用线程下一次报告时计入
+    """
+
+    def __init__(self, inner, n_stages, on_progress=None, cancel=None):
+        self.inner = inner
+        self.n_stages = n_stages
+        self.on_progress = on_progress
+        self.cancel = cancel
+        self._completed = 0
+        self._last_stage = None
+        self._lock = threading.Lock()
+        self._owner = threading.get_ident()
+
+    def check(self):
+        """已取消时抛出 AnalysisCancelled"""
+        if self.cancel is not None:
+            self.cancel.check()
+
+    def _reporting(self):
+        return self.on_progress is not None and threading.get_ident() == self._owner
+
+    def _fraction(self, partial=0.0):
+        with self._lock:
+            completed = self._completed
+        return min((completed + partial) / self.n_stages, 1.0)
+
+    def _finish(self, stage):
+        with self._lock:
+            self._completed += 1
+            self._last_stage = stage
+        self.emit()
+
+    def emit(self):
+        """在调用线程中报告已完成的阶段"""
+        if self._reporting() and self._last_stage is not None:
+            self.on_progress(self._fraction(), self._last_stage, 1, 1)
+
+    def stage_callback(self, stage):
+        """
+        阶段内部的进度回调 report(完成数, 总数),供按列/行计算的引擎调用;
+        每次调用时检查取消
+        """
+
+        def report(done, total):
+            self.check()
+            if self._reporting() and total > 0:
+                self.on_progress(self._fraction(done / total), stage, done, total)
+
+        return report
+
+    def get(self, key, compute):
+        self.check()
+        value = self.inner.get(key, compute)
+        self._finish(key[0])
+        return value
+
+    def digest(self, path, compute=file_digest):
+        self.check()
+        return self.inner.digest(path, compute)
+
+    def write_file(self, key, path, writer):
+        self.check()
+        self.inner.write_file(key, path, writer)
+        self._finish(key[0])
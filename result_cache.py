@@ -0,0 +1,220 @@
+"""
+分析结果缓存
+以输入文件内容的哈希和全部分析参数为键,在磁盘上保存指标和输出文件;
+命中时直接复制已有结果,目录总大小超限时按最近使用时间淘汰
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+
+from perf import numeric_metrics
+from process_xyz import OUTPUT_SUFFIXES, output_files, process_xyz, profile_suffix
+from stage_cache import file_digest
+
+# 缓存格式版本,分析算法或输出格式变化时递增,使旧条目失效
+CACHE_VERSION = 2
+
+# 默认缓存目录和容量上限
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SURFACE_ANALYSIS_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "surface-analysis"),
+)
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# 不影响结果的参数,不参与缓存键
+_IGNORED_PARAMS = (
+    "input_path",
+    "output_path",
+    "sfma_workers",
+    "memory_budget",
+    "stage_cache",
+    "plot_workers",
+    "on_metrics",
+    "on_output",
+    "track_memory",
+    "cprofile",
+    "on_progress",
+    "cancel",
+)
+
+METRICS_NAME = "metrics.json"
+
+
+def analysis_params(**params):
+    """补全 process_xyz 的默认参数,返回可JSON序列化的参数字典"""
+    bound = inspect.signature(process_xyz).bind_partial(**params)
+    bound.apply_defaults()
+    resolved = {k: v for k, v in bound.arguments.items() if k not in _IGNORED_PARAMS}
+    # 元组统一为列表,保证相同参数得到相同的键
+    return json.loads(json.dumps(resolved))
+
+
+def cache_key(digest, params):
+    """由输入文件哈希和参数计算缓存键"""
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "input": digest, "params": params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _outputs(output_path, render_profile="archival"):
+    """(保存名, 输出文件路径) 列表"""
+    names = ["result.txt"] + [
+        "result" + profile_suffix(s, render_profile) for s in OUTPUT_SUFFIXES
+    ]
+    return list(zip(names, output_files(output_path, render_profile)))
+
+
+def dir_size(path):
+    """目录下全部文件的总字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    磁盘结果缓存
+
+    每个条目是 cache_dir 下以缓存键命名的目录,包含 metrics.json 和输出文件;
+    输出文件统一以 "result" 加后缀命名保存 (后缀见 OUTPUT_SUFFIXES,
+    图像扩展名随输出规格 render_profile 变化),取出时按新的输出路径还原文件名。条目目录的修改时间记录最近使用时间
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, output_path, render_profile="archival"):
+        """
+        命中时将缓存的输出文件复制到 output_path 对应的位置并返回指标,
+        未命中返回 None
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, METRICS_NAME), "r") as f:
+                metrics = json.load(f)
+            for name, target in _outputs(output_path, render_profile):
+                source = os.path.join(entry, name)
+                if os.path.exists(source):
+                    shutil.copyfile(source, target)
+        except (OSError, ValueError):
+            return None
+
+        os.utime(entry)
+        return metrics
+
+    def put(self, key, metrics, output_path, render_profile="archival"):
+        """保存一次分析的指标和输出文件,随后按容量上限淘汰旧条目"""
+        entry = self._entry(key)
+        staging = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for name, source in _outputs(output_path, render_profile):
+                if os.path.exists(source):
+                    shutil.copyfile(source, os.path.join(staging, name))
+            # 指标最后写入,作为条目完整的标志
+            with open(os.path.join(staging, METRICS_NAME), "w") as f:
+                json.dump(numeric_metrics(metrics), f)
+            os.replace(staging, entry)
+        except OSError:
+            # 其他进程已写入同一条目
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+
+    def entries(self):
+        """全部完整条目: [(修改时间, 大小, 路径)],按最近使用时间从旧到新"""
+        result = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            result.append((mtime, dir_size(path), path))
+        result.sort()
+        return result
+
+    def size(self):
+        """缓存占用的字节数"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        """删除最久未使用的条目,直到总大小不超过 max_bytes"""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """清空缓存"""
+        self.evict(0)
+
+
+def cached_process_xyz(input_path, output_path, cache=None, **params):
+    """
+    带结果缓存的 process_xyz
+
+    输入文件内容和参数都相同时直接返回缓存的指标,并把输出文件复制到
+    output_path 对应的位置;否则运行 process_xyz 并写入缓存。
+    命中时同样调用 params 中的 on_metrics / on_output 回调,on_progress 报告一次完成
+    (阶段名 "cache");
+    缓存中不保存性能记录,命中时返回的指标没有 "perf"
+    """
+    if cache is None:
+        cache = ResultCache()
+
+    stage_cache = params.get("stage_cache")
+    if stage_cache is not None:
+        # 与分阶段缓存共用文件哈希,同一文件只读取一次
+        digest = stage_cache.digest(input_path)
+    else:
+        digest = file_digest(input_path)
+
+    resolved = analysis_params(**params)
+    render_profile = resolved["render_profile"]
+    key = cache_key(digest, resolved)
+    metrics = cache.get(key, output_path, render_profile)
+    if metrics is not None:
+        print("Loaded results from cache.")
+        on_progress = params.get("on_progress")
+        if on_progress is not None:
+            on_progress(1.0, "cache", 1, 1)
+        on_metrics = params.get("on_metrics")
+        if on_metrics is not None:
+            on_metrics(metrics)
+        on_output = params.get("on_output")
+        if on_output is not None:
+            suffixes = ("",) + OUTPUT_SUFFIXES
+            paths = output_files(output_path, render_profile)
+            for suffix, path in zip(suffixes, paths):
+                if os.path.exists(path):
+                    on_output(suffix, path)
+        return metrics
+
+    metrics = process_xyz(input_path, output_path, **params)
+    if metrics is not None:
+        cache.put(key, metrics, output_path, render_profile)
+    return metrics
@@ -0,0 +1,189 @@
+"""
+分析结果文件的读写
+
+文本文件: 每行 "x y value" (15位小数),由 write_points 整块格式化写出,
+read_points 读取;预处理数据 (*-processed.txt / *-results.npz) 可由 read_processed
+读入作为分析输入
+
+二进制结果文件: 将预处理数据、SFMA/局部角/NCE面形图、网格几何、分析参数和指标保存在一个
+不压缩的 .npz 文件中;读取时可直接映射文件中的数组,不复制、不解析文本
+
+二进制文件内容 (各数组长度为网格点数 N):
+    x, y, z: 网格点坐标和高度,单位米
+    sfma: SFMA面形,单位米;tilt: 局部角,单位μrad;nce: NCE面形,单位米
+    row, col: 各网格点在规则网格中的行/列
+    grid_origin: 网格第0列/第0行的坐标 (min_x, min_y);grid_step: 网格间距;
+    grid_shape: 网格行列数
+    params, metrics: 分析参数和指标 (JSON 字符串,读取后为字典)
+    version: 文件格式版本
+"""
+
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+RESULTS_VERSION = 1
+
+# 面形数据数组
+MAP_NAMES = ("x", "y", "z", "sfma", "tilt", "nce")
+
+# 可直接作为分析输入的预处理数据 (见 read_processed): 文件扩展名和完整的文件名后缀;
+# 同为 .txt 的 -sfma.txt 等输出文件是面形图而不是高度数据,不能作为输入
+PROCESSED_EXTENSIONS = (".txt", ".npz")
+PROCESSED_SUFFIXES = ("-processed.txt", "-results.npz")
+
+# 文本输出: 每行 "x y value",15位小数
+ROW_FORMAT = "%.15f %.15f %.15f\n"
+# 每次整体格式化的行数和写缓冲区大小
+BLOCK_ROWS = 65536
+WRITE_BUFFER = 4 * 1024**2
+
+
+def write_points(path, x, y, values, skip_nan=True):
+    """
+    写出 "x y value" 文本,skip_nan=True 时跳过 value 为 NaN 的行
+
+    NaN 一次性掩去,按 BLOCK_ROWS 行整块格式化后经大缓冲区写出;
+    输出与逐行 f"{v:.15f}" 格式化的文件逐字节一致
+    """
+    columns = np.column_stack((x, y, values))
+    if skip_nan:
+        columns = columns[~np.isnan(values)]
+
+    with open(path, "w", buffering=WRITE_BUFFER) as f:
+        for start in range(0, len(columns), BLOCK_ROWS):
+            block = columns[start : start + BLOCK_ROWS]
+            f.write((ROW_FORMAT * len(block)) % tuple(block.ravel().tolist()))
+
+
+def read_points(path):
+    """
+    读取 "x y value" 文本 (例如 *-processed.txt)
+
+    np.loadtxt (numpy >= 1.23 为C实现) 整体解析,返回 x, y, value 三个连续数组
+    """
+    values = np.loadtxt(path, usecols=(0, 1, 2), ndmin=2)
+    return tuple(np.ascontiguousarray(values[:, i]) for i in range(3))
+
+
+def is_processed_input(path):
+    """
+    path 是否为预处理数据输入 (*-processed.txt / *-results.npz)
+
+    其他 .txt / .npz 文件 (如 -sfma.txt) 抛出 ValueError
+    """
+    name = path.lower()
+    if name.endswith(PROCESSED_SUFFIXES):
+        return True
+    if name.endswith(PROCESSED_EXTENSIONS):
+        raise ValueError(
+            f"不支持的输入文件: {os.path.basename(path)},"
+            "只接受原始XYZ文件、*-processed.txt 或 *-results.npz"
+        )
+    return False
+
+
+def read_processed(path):
+    """
+    读取预处理数据作为分析输入: "x y z" 文本 (.txt) 或 save_results 写出的 .npz
+
+    返回 x, y, z 和数据分辨率 (.npz 中记录的 scale;文本中没有,为 None)
+    """
+    if not path.lower().endswith(".npz"):
+        return read_points(path) + (None,)
+
+    results = load_results(path)
+    # 复制出映射的数组,不保持文件打开
+    x, y, z = (np.array(results[name]) for name in ("x", "y", "z"))
+    return x, y, z, results["params"].get("scale")
+
+
+def save_results(path, maps, grid, params, metrics):
+    """
+    写出结果文件
+
+    maps: {名称: 数组},名称见 MAP_NAMES
+    grid: 网格几何 surface_grid.SurfaceGrid
+    params, metrics: 可JSON序列化的字典
+    """
+    arrays = {name: np.asarray(maps[name], dtype=np.float64) for name in MAP_NAMES}
+    arrays.update(
+        row=np.asarray(grid.row_indices, dtype=np.int32),
+        col=np.asarray(grid.col_indices, dtype=np.int32),
+        grid_origin=np.array([grid.min_x, grid.min_y], dtype=np.float64),
+        grid_step=np.array([grid.step_x, grid.step_y], dtype=np.float64),
+        grid_shape=np.array(grid.shape, dtype=np.int64),
+        params=np.array(json.dumps(params)),
+        metrics=np.array(json.dumps({k: float(v) for k, v in metrics.items()})),
+        version=np.array(RESULTS_VERSION),
+    )
+    # np.savez 不压缩,各数组在文件中连续存放,可直接映射
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _map_npz(path):
+    """映射不压缩 .npz 中的各数组 (只读);标量和字符串直接读入"""
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[: -len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{name} 为压缩存储,无法映射")
+
+            # 本地文件头: 30字节固定部分 + 文件名 + 扩展字段,其后为 .npy 数据
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if len(shape) == 0 or dtype.hasobject or dtype.kind == "U":
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load_results(path, mmap=True):
+    """
+    读取 save_results 写出的结果文件
+
+    mmap=True 时数组直接映射文件 (只读,按需从磁盘读取),否则读入内存;
+    返回 {名称: 数组},其中 "params" 和 "metrics" 为字典
+    """
+    if mmap:
+        arrays = _map_npz(path)
+    else:
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+
+    version = int(arrays["version"])
+    if version > RESULTS_VERSION:
+        raise ValueError(f"不支持的结果文件版本: {version}")
+
+    arrays["params"] = json.loads(str(arrays["params"]))
+    arrays["metrics"] = json.loads(str(arrays["metrics"]))
+    return arrays
+
+
+def grid_values(results, name):
+    """将结果文件中的一项面形数据还原为二维网格,无数据处为 NaN"""
+    grid = np.full(tuple(results["grid_shape"]), np.nan)
+    grid[results["row"], results["col"]] = results[name]
+    return grid
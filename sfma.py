@@ -0,0 +1,577 @@
+"""
+SFMA 狭缝扫描计算引擎
+与 process_xyz.calculate_dynamic_sfma 的逐窗口 lstsq 循环结果一致,
+各引擎均返回残差累加和 layout_sum 与计数 layout_count
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 窗口内有效点少于该值时跳过拟合
+MIN_WINDOW_POINTS = 10
+
+# 法方程伪逆的截断阈值 (相对最大奇异值)
+PINV_RCOND = 1e-10
+
+
+def slit_columns(n_cols, slit_px_w, slit_step_px_x):
+    """
+    狭缝扫描的列位置
+
+    返回 (col_idx, valid_start, valid_end) 列表,col_idx 决定蛇形方向
+    """
+    columns = []
+    for col_idx, col_start_idx in enumerate(range(-slit_px_w, n_cols, slit_step_px_x)):
+        valid_start = max(0, col_start_idx)
+        valid_end = min(n_cols, col_start_idx + slit_px_w)
+        if valid_start < valid_end:
+            columns.append((col_idx, valid_start, valid_end))
+    return columns
+
+
+def slit_rows(n_rows, slit_px_h, slit_step_px_y, col_idx):
+    """
+    一列内狭缝的起始行
+
+    偶数列向上(从0开始),奇数列向下(从最大开始);
+    行数不能被步长整除时,两个方向经过的位置不同
+    """
+    if col_idx % 2 == 0:
+        return np.arange(0, n_rows - slit_px_h + 1, slit_step_px_y)
+    return np.arange(n_rows - slit_px_h, -1, -slit_step_px_y)
+
+
+def _summed_area(values):
+    """二维累加表,首行首列补零"""
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    np.cumsum(values, axis=0, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def _box_sum(table, r0, r1, c0, c1):
+    """利用累加表求矩形 [r0, r1) x [c0, c1) 内的和"""
+    return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+
+def solve_plane_moments(s1, sj, si, sjj, sij, sii, sz, sjz, siz):
+    """
+    由矩求解一批平面拟合 z = a*j + b*i + c
+
+    输入为各窗口在局部像素坐标下的矩 (数组);
+    使用法方程的伪逆,秩亏窗口(如仅有一列有效点)得到与 lstsq 相同的拟合面
+    """
+    normal = np.empty((len(s1), 3, 3))
+    normal[:, 0, 0] = sjj
+    normal[:, 0, 1] = normal[:, 1, 0] = sij
+    normal[:, 0, 2] = normal[:, 2, 0] = sj
+    normal[:, 1, 1] = sii
+    normal[:, 1, 2] = normal[:, 2, 1] = si
+    normal[:, 2, 2] = s1
+
+    rhs = np.stack([sjz, siz, sz], axis=1)
+    coeff = np.einsum(
+        "nij,nj->ni", np.linalg.pinv(normal, rcond=PINV_RCOND, hermitian=True), rhs
+    )
+    return coeff[:, 0], coeff[:, 1], coeff[:, 2]
+
+
+def sfma_loop(
+    grid_z,
+    grid_x,
+    grid_y,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+    columns=None,
+    progress=None,
+    meshgrid=None,
+):
+    """
+    逐窗口 SFMA 引擎 (参考实现)
+
+    蛇形移动,每个狭缝位置用 lstsq 拟合局部平面并累积残差;
+    columns 可指定只计算部分扫描列 (见 slit_columns),默认全部;
+    progress(已完成列数, 总列数) 在每列完成后调用;
+    meshgrid: 已有的 (GX, GY) 网格坐标 (如 SurfaceGrid.meshgrid),默认由 grid_x/grid_y 生成
+    """
+    n_rows, n_cols = grid_z.shape
+    GX, GY = np.meshgrid(grid_x, grid_y) if meshgrid is None else meshgrid
+
+    # 使用均值累积
+    layout_sum = np.zeros((n_rows, n_cols))
+    layout_count = np.zeros((n_rows, n_cols))
+
+    if columns is None:
+        columns = slit_columns(n_cols, slit_px_w, slit_step_px_x)
+
+    # 蛇形移动: 使用物理距离步长(转换为像素)
+    for n_done, (col_idx, valid_start, valid_end) in enumerate(columns, 1):
+        col_z = grid_z[:, valid_start:valid_end]
+        col_x = GX[:, valid_start:valid_end]
+        col_y = GY[:, valid_start:valid_end]
+
+        for y_start_idx in slit_rows(n_rows, slit_px_h, slit_step_px_y, col_idx):
+            y_end_idx = y_start_idx + slit_px_h
+
+            win_z = col_z[y_start_idx:y_end_idx, :]
+            win_x = col_x[y_start_idx:y_end_idx, :]
+            win_y = col_y[y_start_idx:y_end_idx, :]
+
+            mask = ~np.isnan(win_z)
+            if np.sum(mask) < MIN_WINDOW_POINTS:
+                continue
+
+            z_f = win_z[mask]
+            x_f = win_x[mask]
+            y_f = win_y[mask]
+
+            A = np.c_[x_f, y_f, np.ones(len(x_f))]
+            coeff, _, _, _ = np.linalg.lstsq(A, z_f, rcond=None)
+            a, b, c = coeff
+
+            z_fit = a * win_x + b * win_y + c
+            residual = win_z - z_fit
+
+            valid_res_mask = ~np.isnan(residual)
+            acc_sum_slice = layout_sum[y_start_idx:y_end_idx, valid_start:valid_end]
+            acc_count_slice = layout_count[y_start_idx:y_end_idx, valid_start:valid_end]
+
+            # 累积求和和计数
+            acc_sum_slice[valid_res_mask] += residual[valid_res_mask]
+            acc_count_slice[valid_res_mask] += 1
+
+        if progress is not None:
+            progress(n_done, len(columns))
+
+    return layout_sum, layout_count
+
+
+def sfma_column_batched(
+    grid_z,
+    layout_sum,
+    layout_count,
+    col_idx,
+    valid_start,
+    valid_end,
+    slit_px_h,
+    slit_step_px_y,
+):
+    """
+    一次处理一个扫描列的全部狭缝窗口
+
+    列内窗口形状相同,用 sliding_window_view 取得 (窗口数, h, w) 的视图,
+    一次批量求解所有 3x3 法方程,残差按窗口内行号分 h 次散加到累积网格
+    """
+    n_rows = grid_z.shape[0]
+    y_starts = slit_rows(n_rows, slit_px_h, slit_step_px_y, col_idx)
+    if len(y_starts) == 0:
+        return
+
+    col_z = grid_z[:, valid_start:valid_end]
+    win_z = sliding_window_view(col_z, slit_px_h, axis=0)[y_starts]
+    # (窗口数, w, h) -> (窗口数, h, w)
+    win_z = win_z.transpose(0, 2, 1)
+
+    mask = ~np.isnan(win_z)
+    s1 = mask.sum(axis=(1, 2)).astype(np.float64)
+    keep = s1 >= MIN_WINDOW_POINTS
+    if not np.any(keep):
+        return
+
+    y_starts, win_z, mask, s1 = y_starts[keep], win_z[keep], mask[keep], s1[keep]
+
+    # 窗口局部像素坐标,所有窗口相同
+    width = valid_end - valid_start
+    J = np.arange(width, dtype=np.float64)[np.newaxis, np.newaxis, :]
+    I = np.arange(slit_px_h, dtype=np.float64)[np.newaxis, :, np.newaxis]
+    V = mask.astype(np.float64)
+    Z = np.where(mask, win_z, 0.0)
+
+    a, b, c = solve_plane_moments(
+        s1,
+        (V * J).sum(axis=(1, 2)),
+        (V * I).sum(axis=(1, 2)),
+        (V * J * J).sum(axis=(1, 2)),
+        (V * I * J).sum(axis=(1, 2)),
+        (V * I * I).sum(axis=(1, 2)),
+        Z.sum(axis=(1, 2)),
+        (Z * J).sum(axis=(1, 2)),
+        (Z * I).sum(axis=(1, 2)),
+    )
+
+    residual = Z - (a[:, None, None] * J + b[:, None, None] * I + c[:, None, None])
+    residual[~mask] = 0.0
+
+    # 同一窗口内行号 k 固定时,各窗口的目标行互不相同,可直接散加
+    sum_view = layout_sum[:, valid_start:valid_end]
+    count_view = layout_count[:, valid_start:valid_end]
+    for k in range(slit_px_h):
+        sum_view[y_starts + k] += residual[:, k, :]
+        count_view[y_starts + k] += V[:, k, :]
+
+
+def sfma_batched(
+    grid_z,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+    columns=None,
+    progress=None,
+):
+    """
+    按列批量求解的 SFMA 引擎,见 sfma_column_batched;
+    progress(已完成列数, 总列数) 在每列完成后调用
+    """
+    n_rows, n_cols = grid_z.shape
+    layout_sum = np.zeros((n_rows, n_cols))
+    layout_count = np.zeros((n_rows, n_cols))
+
+    if columns is None:
+        columns = slit_columns(n_cols, slit_px_w, slit_step_px_x)
+
+    for n_done, (col_idx, valid_start, valid_end) in enumerate(columns, 1):
+        sfma_column_batched(
+            grid_z,
+            layout_sum,
+            layout_count,
+            col_idx,
+            valid_start,
+            valid_end,
+            slit_px_h,
+            slit_step_px_y,
+        )
+        if progress is not None:
+            progress(n_done, len(columns))
+
+    return layout_sum, layout_count
+
+
+def sfma_integral(
+    grid_z,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+    columns=None,
+    progress=None,
+    valid=None,
+):
+    """
+    积分图 SFMA 引擎
+
+    窗口的法方程只需要 1, j, i, j², ij, i², z, jz, iz 在有效像素上的和,
+    由二维累加表 O(1) 求得;各窗口的拟合系数再用差分数组累加回像素,
+    每个像素的残差和 = N*z - (j*Σa + i*Σb + Σc)。
+    全部列整体计算,progress(总列数, 总列数) 只在结束时调用一次;
+    valid: 已有的有效像素掩膜 (如 SurfaceGrid.valid),默认由 grid_z 计算
+    """
+    n_rows, n_cols = grid_z.shape
+    if valid is None:
+        valid = ~np.isnan(grid_z)
+
+    # 全局像素坐标 (整数)。j²、ij、i² 累加表的最大元素约为 n_rows·n_cols³/3、
+    # (n_rows·n_cols)²/4、n_cols·n_rows³/3,均小于 2**53 时矩在 float64 下精确;
+    # 超出时 (如约 12000x12000 以上的拼接网格) 有舍入误差,平移到窗口局部坐标的相减
+    # 会放大该误差,此时宜按列带计算 (sfma_banded),每带只用带内的列坐标
+    J = np.broadcast_to(np.arange(n_cols, dtype=np.float64), (n_rows, n_cols))
+    I = np.broadcast_to(np.arange(n_rows, dtype=np.float64)[:, None], (n_rows, n_cols))
+    V = valid.astype(np.float64)
+    Z = np.where(valid, grid_z, 0.0)
+
+    if columns is None:
+        columns = slit_columns(n_cols, slit_px_w, slit_step_px_x)
+
+    # 收集所有窗口
+    r0_list, c0_list, c1_list = [], [], []
+    for col_idx, valid_start, valid_end in columns:
+        rows = slit_rows(n_rows, slit_px_h, slit_step_px_y, col_idx)
+        r0_list.append(rows)
+        c0_list.append(np.full(len(rows), valid_start))
+        c1_list.append(np.full(len(rows), valid_end))
+
+    layout_sum = np.zeros((n_rows, n_cols))
+    layout_count = np.zeros((n_rows, n_cols))
+    if not r0_list:
+        return layout_sum, layout_count
+
+    r0 = np.concatenate(r0_list)
+    r1 = r0 + slit_px_h
+    c0 = np.concatenate(c0_list)
+    c1 = np.concatenate(c1_list)
+
+    def box(values):
+        return _box_sum(_summed_area(values), r0, r1, c0, c1)
+
+    s1 = box(V)
+    keep = s1 >= MIN_WINDOW_POINTS
+    r0, r1, c0, c1, s1 = r0[keep], r1[keep], c0[keep], c1[keep], s1[keep]
+
+    sj, si = box(V * J), box(V * I)
+    sjj, sij, sii = box(V * J * J), box(V * I * J), box(V * I * I)
+    sz, sjz, siz = box(Z), box(Z * J), box(Z * I)
+
+    # 平移到窗口局部坐标,改善法方程条件数
+    oj = c0.astype(np.float64)
+    oi = r0.astype(np.float64)
+    lsj = sj - oj * s1
+    lsi = si - oi * s1
+    lsjj = sjj - 2 * oj * sj + oj * oj * s1
+    lsij = sij - oj * si - oi * sj + oi * oj * s1
+    lsii = sii - 2 * oi * si + oi * oi * s1
+    lsjz = sjz - oj * sz
+    lsiz = siz - oi * sz
+
+    a, b, c = solve_plane_moments(s1, lsj, lsi, lsjj, lsij, lsii, sz, lsjz, lsiz)
+    c = c - a * oj - b * oi
+
+    # 差分数组: 将每个窗口的系数累加到其覆盖的像素
+    def scatter(values):
+        diff = np.zeros((n_rows + 1, n_cols + 1))
+        np.add.at(diff, (r0, c0), values)
+        np.add.at(diff, (r0, c1), -values)
+        np.add.at(diff, (r1, c0), -values)
+        np.add.at(diff, (r1, c1), values)
+        return np.cumsum(np.cumsum(diff, axis=0), axis=1)[:n_rows, :n_cols]
+
+    n_cover = scatter(np.ones(len(a)))
+    sum_a, sum_b, sum_c = scatter(a), scatter(b), scatter(c)
+
+    covered = valid & (n_cover > 0.5)
+    n_cover = np.round(n_cover)
+    layout_sum[covered] = (n_cover * Z - (J * sum_a + I * sum_b + sum_c))[covered]
+    layout_count[covered] = n_cover[covered]
+    if progress is not None:
+        progress(len(columns), len(columns))
+    return layout_sum, layout_count
+
+
+def _band_layout(
+    engine,
+    band_z,
+    band_x,
+    grid_y,
+    band_start,
+    columns,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+):
+    """
+    计算一组相邻扫描列在其覆盖列带内的部分累加结果
+
+    band_z, band_x: 列带 [band_start, band_start + 宽度) 内的高度网格和列坐标;
+    columns 中的列号为全图列号
+    """
+    # 列号平移到列带内,col_idx 保持不变以维持蛇形方向
+    band_columns = [
+        (col_idx, valid_start - band_start, valid_end - band_start)
+        for col_idx, valid_start, valid_end in columns
+    ]
+    args = (slit_px_w, slit_px_h, slit_step_px_x, slit_step_px_y)
+
+    if engine == "loop":
+        return sfma_loop(band_z, band_x, grid_y, *args, columns=band_columns)
+    if engine == "batched":
+        return sfma_batched(band_z, *args, columns=band_columns)
+    return sfma_integral(band_z, *args, columns=band_columns)
+
+
+def _sfma_band(
+    engine,
+    shm_name,
+    shape,
+    grid_x,
+    grid_y,
+    columns,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+):
+    """
+    工作进程: 计算一组相邻扫描列,返回其覆盖列带的部分累加结果
+
+    返回:
+        band_start: 列带在全图中的起始列
+        tile_sum, tile_count: 列带内的残差累加和与计数
+    """
+    # 子进程与主进程共用 resource_tracker,由主进程负责 unlink
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        grid_z = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        band_start = min(valid_start for _, valid_start, _ in columns)
+        band_end = max(valid_end for _, _, valid_end in columns)
+        band_z = np.array(grid_z[:, band_start:band_end])
+        del grid_z
+    finally:
+        shm.close()
+
+    tile_sum, tile_count = _band_layout(
+        engine,
+        band_z,
+        grid_x[band_start:band_end],
+        grid_y,
+        band_start,
+        columns,
+        slit_px_w,
+        slit_px_h,
+        slit_step_px_x,
+        slit_step_px_y,
+    )
+    return band_start, tile_sum, tile_count
+
+
+def sfma_parallel(
+    engine,
+    grid_z,
+    grid_x,
+    grid_y,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+    workers,
+    progress=None,
+):
+    """
+    多进程 SFMA: 将扫描列按相邻分组交给进程池
+
+    grid_z 放在共享内存中供各进程读取,各进程返回列带的部分累加结果,
+    最后在主进程中按分组顺序相加;蛇形方向不影响均值,列之间互不依赖。
+    progress(已完成列数, 总列数) 在主进程中每取回一组后调用;
+    progress 抛出异常 (如取消) 时未开始的分组不再计算
+    """
+    n_rows, n_cols = grid_z.shape
+    layout_sum = np.zeros((n_rows, n_cols))
+    layout_count = np.zeros((n_rows, n_cols))
+
+    columns = slit_columns(n_cols, slit_px_w, slit_step_px_x)
+    if not columns:
+        return layout_sum, layout_count
+
+    # 每个进程分到若干组,便于负载均衡
+    n_groups = min(len(columns), workers * 2)
+    bounds = np.linspace(0, len(columns), n_groups + 1).astype(int)
+    groups = [columns[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(grid_z.nbytes, 1))
+    try:
+        shared = np.ndarray(grid_z.shape, dtype=np.float64, buffer=shm.buf)
+        shared[:] = grid_z
+        del shared
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _sfma_band,
+                    engine,
+                    shm.name,
+                    grid_z.shape,
+                    grid_x,
+                    grid_y,
+                    group,
+                    slit_px_w,
+                    slit_px_h,
+                    slit_step_px_x,
+                    slit_step_px_y,
+                )
+                for group in groups
+            ]
+            n_done = 0
+            try:
+                for group, future in zip(groups, futures):
+                    band_start, tile_sum, tile_count = future.result()
+                    band_end = band_start + tile_sum.shape[1]
+                    layout_sum[:, band_start:band_end] += tile_sum
+                    layout_count[:, band_start:band_end] += tile_count
+                    n_done += len(group)
+                    if progress is not None:
+                        progress(n_done, len(columns))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return layout_sum, layout_count
+
+
+def column_bands(columns, max_cols):
+    """
+    将扫描列 (见 slit_columns) 按相邻分组,每组覆盖的列带宽度不超过 max_cols;
+    单个扫描列超过 max_cols 时独占一组
+    """
+    bands = []
+    for column in columns:
+        _, valid_start, valid_end = column
+        if bands and valid_end - bands[-1][0][1] <= max_cols:
+            bands[-1].append(column)
+        else:
+            bands.append([column])
+    return bands
+
+
+def sfma_banded(
+    engine,
+    grid_z,
+    grid_x,
+    grid_y,
+    slit_px_w,
+    slit_px_h,
+    slit_step_px_x,
+    slit_step_px_y,
+    max_cols,
+    layout_sum=None,
+    layout_count=None,
+    progress=None,
+):
+    """
+    按列带依次计算的 SFMA,用于放不进内存的网格 (如 np.memmap)
+
+    扫描列按 column_bands 分组,每次只读入一个列带 (宽度不超过 max_cols),
+    其部分累加结果加到 layout_sum/layout_count (可为磁盘映射数组,默认新建);
+    相邻列带重叠 slit_px_w - slit_step_px_x 列,重叠部分两侧的贡献相加,
+    与 sfma_parallel 相同,结果与整体计算一致。
+    progress(已完成列数, 总列数) 在每个列带完成后调用
+    """
+    n_rows, n_cols = grid_z.shape
+    if layout_sum is None:
+        layout_sum = np.zeros((n_rows, n_cols))
+    if layout_count is None:
+        layout_count = np.zeros((n_rows, n_cols))
+
+    columns = slit_columns(n_cols, slit_px_w, slit_step_px_x)
+    n_done = 0
+    for band in column_bands(columns, max_cols):
+        band_start = band[0][1]
+        band_end = max(valid_end for _, _, valid_end in band)
+        tile_sum, tile_count = _band_layout(
+            engine,
+            np.array(grid_z[:, band_start:band_end]),
+            grid_x[band_start:band_end],
+            grid_y,
+            band_start,
+            band,
+            slit_px_w,
+            slit_px_h,
+            slit_step_px_x,
+            slit_step_px_y,
+        )
+        layout_sum[:, band_start:band_end] += tile_sum
+        layout_count[:, band_start:band_end] += tile_count
+        del tile_sum, tile_count
+
+        n_done += len(band)
+        if progress is not None:
+            progress(n_done, len(columns))
+
+    return layout_sum, layout_count
@@ -0,0 +1,154 @@
+"""
+分析流程的分阶段内存缓存
+process_xyz 的每个阶段 (解析、物理坐标、分箱、去倾斜、各项面形图、统计、绘图)
+以其依赖的上游阶段和自身参数为键缓存结果;只修改下游参数时,上游阶段直接复用
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 默认内存上限
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+
+def file_digest(path, chunk_bytes=1024 * 1024):
+    """文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _freeze(value):
+    """缓存中的数组设为只读,防止下游阶段原地修改共享的数据"""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _freeze(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+    elif hasattr(value, "__dict__"):
+        _freeze(vars(value))
+    return value
+
+
+def _nbytes(value):
+    """缓存值占用内存的估计"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if hasattr(value, "__dict__"):
+        return sum(_nbytes(item) for item in vars(value).values())
+    return 0
+
+
+class StageCache:
+    """
+    各阶段结果的 LRU 缓存,总内存不超过 max_bytes
+
+    键为 (阶段名, 参数...) 元组,参数中包含上游阶段的键,
+    因此上游任一参数变化时下游的键随之变化
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._digests = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """返回 key 对应的结果,未缓存时调用 compute() 计算并保存"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        value = _freeze(compute())
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self._size += nbytes
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+        return value
+
+    def digest(self, path, compute=file_digest):
+        """
+        文件内容哈希,按 (路径, 大小, 修改时间) 记忆,同一文件只计算一次;
+        未记忆时调用 compute(path) 计算 (与 get 的 compute 相同,便于包装记录)
+        """
+        stat = os.stat(path)
+        stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if stamp in self._digests:
+                return self._digests[stamp]
+        digest = compute(path)
+        with self._lock:
+            self._digests[stamp] = digest
+        return digest
+
+    def write_file(self, key, path, writer):
+        """
+        输出文件阶段: 命中时直接写出缓存的文件内容,
+        否则调用 writer(path) 生成文件并缓存其内容
+        """
+
+        rendered = []
+
+        def render():
+            rendered.append(True)
+            writer(path)
+            if not os.path.exists(path):
+                # 没有有效数据时绘图函数不生成文件
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+
+        content = self.get(key, render)
+        # 以本次是否调用了 render 为准: 其他线程可能在检查与取值之间写入同一键
+        if not rendered and content is not None:
+            with open(path, "wb") as f:
+                f.write(content)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+            self._size = 0
+
+
+class _NoCache:
+    """不缓存: 每个阶段都重新计算"""
+
+    def get(self, key, compute):
+        return compute()
+
+    def digest(self, path, compute=file_digest):
+        return None
+
+    def write_file(self, key, path, writer):
+        writer(path)
+
+
+NO_CACHE = _NoCache()
@@ -0,0 +1,113 @@
+"""
+规则网格上的面形数据
+由散点 (x, y, z) 推断网格间距并网格化,供 SFMA、局部角、NCE 等指标共用
+"""
+
+from dataclasses import dataclass, replace
+from functools import cached_property
+
+import numpy as np
+
+
+@dataclass
+class SurfaceGrid:
+    """
+    网格化的面形数据
+
+    min_x, min_y: 网格第0列/第0行的坐标,单位米
+    step_x, step_y: 网格间距,单位米 (由相邻坐标差的中位数推断)
+    row_indices, col_indices: 每个数据点所在的行/列
+    grid_z: 高度网格,无数据处为 NaN
+    """
+
+    min_x: float
+    max_x: float
+    min_y: float
+    max_y: float
+    step_x: float
+    step_y: float
+    row_indices: np.ndarray
+    col_indices: np.ndarray
+    grid_z: np.ndarray
+
+    @classmethod
+    def from_points(cls, x, y, z, allocate=None):
+        """
+        由散点数据推断网格并网格化
+
+        allocate(shape): 创建全为 NaN 的高度网格 (如磁盘映射数组,见 out_of_core),
+        默认在内存中创建
+        """
+        min_x, max_x = np.min(x), np.max(x)
+        min_y, max_y = np.min(y), np.max(y)
+
+        x_sorted = np.unique(x)
+        y_sorted = np.unique(y)
+        step_x = np.median(np.diff(x_sorted)) if len(x_sorted) > 1 else (max_x - min_x)
+        step_y = np.median(np.diff(y_sorted)) if len(y_sorted) > 1 else (max_y - min_y)
+
+        n_cols = int(round((max_x - min_x) / step_x)) + 1
+        n_rows = int(round((max_y - min_y) / step_y)) + 1
+
+        col_indices = np.round((x - min_x) / step_x).astype(int)
+        row_indices = np.round((y - min_y) / step_y).astype(int)
+        col_indices = np.clip(col_indices, 0, n_cols - 1)
+        row_indices = np.clip(row_indices, 0, n_rows - 1)
+
+        if allocate is None:
+            grid_z = np.full((n_rows, n_cols), np.nan)
+        else:
+            grid_z = allocate((n_rows, n_cols))
+        grid_z[row_indices, col_indices] = z
+
+        return cls(
+            min_x=min_x,
+            max_x=max_x,
+            min_y=min_y,
+            max_y=max_y,
+            step_x=step_x,
+            step_y=step_y,
+            row_indices=row_indices,
+            col_indices=col_indices,
+            grid_z=grid_z,
+        )
+
+    def with_z(self, z):
+        """相同网格几何、不同高度值的新网格 (几何数组共享,不重新推断)"""
+        grid_z = np.full(self.shape, np.nan)
+        grid_z[self.row_indices, self.col_indices] = z
+        return replace(self, grid_z=grid_z)
+
+    @property
+    def shape(self):
+        return self.grid_z.shape
+
+    @property
+    def n_rows(self):
+        return self.grid_z.shape[0]
+
+    @property
+    def n_cols(self):
+        return self.grid_z.shape[1]
+
+    @cached_property
+    def valid(self):
+        """有数据的网格点"""
+        return ~np.isnan(self.grid_z)
+
+    @cached_property
+    def grid_x(self):
+        return self.min_x + np.arange(self.n_cols) * self.step_x
+
+    @cached_property
+    def grid_y(self):
+        return self.min_y + np.arange(self.n_rows) * self.step_y
+
+    @cached_property
+    def meshgrid(self):
+        """(GX, GY) 网格坐标"""
+        return np.meshgrid(self.grid_x, self.grid_y)
+
+    def sample(self, values):
+        """取出网格数组在各数据点处的值"""
+        return values[self.row_indices, self.col_indices]
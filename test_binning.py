@@ -0,0 +1,47 @@
+"""
+分箱回归测试: bin_points (np.bincount) 与旧版逐点字典累加的结果完全一致
+
+    python -m pytest -q test_binning.py
+"""
+
+import numpy as np
+import pytest
+
+from binning import bin_points
+
+
+def legacy_bins(x, y, z, step_x, step_y):
+    """旧版 process_xyz 的分箱: 逐点四舍五入并按 (k_x, k_y) 累加到字典"""
+    start_x = np.floor(min(x) / step_x) * step_x
+    start_y = np.floor(min(y) / step_y) * step_y
+
+    bins = {}
+    for px, py, pz in zip(x, y, z):
+        key = (int(round((px - start_x) / step_x)), int(round((py - start_y) / step_y)))
+        if key not in bins:
+            bins[key] = [0.0, 0]
+        bins[key][0] += pz
+        bins[key][1] += 1
+
+    points = []
+    for k_x, k_y in sorted(bins, key=lambda k: (k[1], k[0])):
+        sum_z, count = bins[(k_x, k_y)]
+        points.append((start_x + k_x * step_x, start_y + k_y * step_y, sum_z / count))
+    return np.array(points)
+
+
+@pytest.mark.parametrize("step_x, step_y", [(3.4e-3, 0.5e-3), (1e-3, 1e-3)])
+def test_matches_legacy(step_x, step_y):
+    rng = np.random.default_rng(3)
+    scale = 1.7e-4
+    ix, iy = np.meshgrid(np.arange(120), np.arange(90))
+    keep = rng.random(ix.shape) > 0.1
+    ix, iy = ix[keep], iy[keep]
+    x = (ix - 59.5) * scale
+    y = (44.5 - iy) * scale
+    z = rng.normal(0, 5e-8, len(x))
+
+    expected = legacy_bins(x.tolist(), y.tolist(), z.tolist(), step_x, step_y)
+    result = np.column_stack(bin_points(x, y, z, step_x, step_y).points())
+
+    assert np.array_equal(result, expected)
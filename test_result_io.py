@@ -0,0 +1,48 @@
+"""
+文本输出回归测试: write_points 与 np.savetxt / 旧版逐行 f"{v:.15f}" 写出的文件逐字节一致
+
+    python -m pytest -q test_result_io.py
+"""
+
+import numpy as np
+import pytest
+
+import result_io
+from result_io import write_points
+
+
+@pytest.fixture(scope="module")
+def columns():
+    """含 NaN、负零、极小/较大数值的三列数据"""
+    rng = np.random.default_rng(4)
+    n = 1000
+    x = rng.uniform(-0.15, 0.15, n)
+    y = rng.uniform(-0.15, 0.15, n)
+    values = rng.normal(0, 1e-7, n)
+    values[rng.random(n) < 0.2] = np.nan
+    values[:4] = [-0.0, 1e-18, -123.456789012345678, 4.5e6]
+    return x, y, values
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, result_io.BLOCK_ROWS])
+@pytest.mark.parametrize("skip_nan", [True, False])
+def test_matches_savetxt(tmp_path, monkeypatch, columns, block_rows, skip_nan):
+    monkeypatch.setattr(result_io, "BLOCK_ROWS", block_rows)
+    x, y, values = columns
+    write_points(tmp_path / "points.txt", x, y, values, skip_nan=skip_nan)
+
+    keep = ~np.isnan(values) if skip_nan else np.ones(len(values), dtype=bool)
+    expected = np.column_stack((x, y, values))[keep]
+    np.savetxt(tmp_path / "savetxt.txt", expected, fmt="%.15f")
+    with open(tmp_path / "legacy.txt", "w") as f:
+        for px, py, pv in expected:
+            f.write(f"{px:.15f} {py:.15f} {pv:.15f}\n")
+
+    result = read_bytes(tmp_path / "points.txt")
+    assert result == read_bytes(tmp_path / "savetxt.txt")
+    assert result == read_bytes(tmp_path / "legacy.txt")
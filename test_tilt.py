@@ -0,0 +1,81 @@
+"""
+局部角引擎回归测试: 整体数组运算和按行带计算与逐像素的参考实现 (loop) 结果一致
+
+    python -m pytest -q test_tilt.py
+"""
+
+import numpy as np
+import pytest
+
+from tilt import iter_slope_bands, local_slopes_loop, local_slopes_vectorized
+
+STEP_X = 3.4e-3
+STEP_Y = 0.5e-3
+
+
+@pytest.fixture(scope="module")
+def surface():
+    """
+    23x17 的合成网格,含随机缺失点、缺失的边缘段和只剩共线有效点的邻域
+    (平面拟合秩亏,退回 lstsq)
+    """
+    rng = np.random.default_rng(1)
+    rows, cols = np.mgrid[0:23, 0:17]
+    grid_z = 2e-8 * np.sin(cols / 3.0) * np.cos(rows / 5.0)
+    grid_z += rng.normal(0, 1e-9, grid_z.shape)
+    grid_z[rng.random(grid_z.shape) < 0.25] = np.nan
+    grid_z[0, 5:9] = np.nan
+    grid_z[10:14, -1] = np.nan
+
+    # (6, 8) 的邻域中只保留同一行的3个点
+    grid_z[5:8, 7:10] = np.nan
+    grid_z[6, 7:10] = [1e-8, 2e-8, 4e-8]
+
+    reference = local_slopes_loop(grid_z, STEP_X, STEP_Y)
+    return grid_z, reference
+
+
+def banded(slopes, max_rows):
+    """按行带计算并拼接成整个网格"""
+
+    def run(grid_z, step_x, step_y):
+        slope_x = np.full(grid_z.shape, np.nan)
+        slope_y = np.full(grid_z.shape, np.nan)
+        for start, stop, band_x, band_y in iter_slope_bands(
+            slopes, grid_z, step_x, step_y, max_rows
+        ):
+            slope_x[start:stop] = band_x
+            slope_y[start:stop] = band_y
+        return slope_x, slope_y
+
+    return run
+
+
+@pytest.mark.parametrize(
+    "slopes",
+    [
+        local_slopes_vectorized,
+        banded(local_slopes_vectorized, 1),
+        banded(local_slopes_vectorized, 4),
+        banded(local_slopes_vectorized, 7),
+        banded(local_slopes_loop, 5),
+    ],
+    ids=["vectorized", "vectorized-1", "vectorized-4", "vectorized-7", "loop-5"],
+)
+def test_matches_loop(surface, slopes):
+    grid_z, reference = surface
+    result = slopes(grid_z, STEP_X, STEP_Y)
+
+    for values, expected in zip(result, reference):
+        assert np.array_equal(np.isnan(values), np.isnan(expected))
+        scale = np.nanmax(np.abs(expected))
+        assert np.nanmax(np.abs(values - expected)) <= 1e-9 * scale
+
+
+def test_degenerate_stencil(surface):
+    """只有共线有效点的邻域与 lstsq 的最小范数解一致"""
+    grid_z, reference = surface
+    slope_x, slope_y = local_slopes_vectorized(grid_z, STEP_X, STEP_Y)
+    assert np.isfinite(reference[0][6, 8])
+    assert slope_x[6, 8] == pytest.approx(reference[0][6, 8], rel=1e-9)
+    assert slope_y[6, 8] == pytest.approx(reference[1][6, 8], rel=1e-9, abs=1e-12)
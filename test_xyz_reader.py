@@ -0,0 +1,64 @@
+"""
+XYZ读取回归测试: 分块向量化读取与旧版逐行解析 (benchmark.legacy_parse) 结果一致;
+文件头中无效的时间戳不影响读取
+
+    python -m pytest -q test_xyz_reader.py
+"""
+
+import numpy as np
+import pytest
+
+from benchmark import legacy_parse
+from xyz_reader import HEADER_LINES, parse_xyz_header, read_xyz
+
+HEADER = ["Zygo XYZ Data File - Format 1\n"] + [f"header {i}\n" for i in range(1, 14)]
+
+
+def data_lines(rng):
+    """数据区: 有效像素、"No Data"、空行、分段标记 "#",以及不足3列的行"""
+    lines = []
+    for row in range(40):
+        for col in range(25):
+            if rng.random() < 0.15:
+                lines.append(f"{col} {row} No Data\n")
+            else:
+                lines.append(f"{col} {row} {rng.normal(0, 0.05):.6f}\n")
+        if row % 7 == 3:
+            lines.append("\n")
+        if row == 20:
+            lines.append("#\n")
+    lines.append("1 2\n")
+    lines.append("#\n")
+    return lines
+
+
+@pytest.fixture(scope="module", params=["\n", "\r\n"], ids=["lf", "crlf"])
+def xyz_file(request, tmp_path_factory):
+    rng = np.random.default_rng(2)
+    assert len(HEADER) == HEADER_LINES
+    text = "".join(HEADER + data_lines(rng)).replace("\n", request.param)
+    path = tmp_path_factory.mktemp("xyz") / "sample.xyz"
+    with open(path, "w", newline="") as f:
+        f.write(text)
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 7, 64, 4096, 4 * 1024 * 1024])
+def test_matches_legacy(xyz_file, chunk_bytes):
+    legacy = np.array(legacy_parse(xyz_file), dtype=np.float64).reshape(-1, 3)
+    ix, iy, z_um = read_xyz(xyz_file, chunk_bytes=chunk_bytes)
+
+    assert len(legacy) > 0
+    assert np.array_equal(ix, legacy[:, 0])
+    assert np.array_equal(iy, legacy[:, 1])
+    assert np.array_equal(z_um, legacy[:, 2])
+
+
+@pytest.mark.parametrize("timestamp", ["0", "-5", "99999999999999999999", "abc"])
+def test_invalid_header_timestamp(timestamp):
+    """无效或超出范围的时间戳视为缺失,不影响其余元数据"""
+    lines = HEADER[:7] + [f"0 1 6.328e-07 0.5 1 1 0.000172 {timestamp}\n"]
+    header = parse_xyz_header(lines)
+    assert header.timestamp is None
+    assert header.scale == 0.000172
+    assert header.wavelength == 6.328e-07
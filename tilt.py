@@ -0,0 +1,320 @@
+"""
+局部倾斜角计算引擎
+由网格化的高度值计算每个像素的X/Y方向斜率:
+内部点和角点使用3x3邻域平面拟合,边缘点使用二阶单侧差分/中心差分
+"""
+
+import numpy as np
+
+
+def fit_local_plane(i, j, grid_z, step_x, step_y, row_offset=0):
+    """
+    拟合3x3邻域的平面并返回斜率
+
+    row_offset: grid_z 首行在整个网格中的行号。有效点共线时 lstsq 返回最小范数解,
+    它与坐标原点有关,按行带计算时需以整个网格的行号为坐标才与整体计算一致
+    """
+    points_x, points_y, points_z = [], [], []
+
+    for di in [-1, 0, 1]:
+        for dj in [-1, 0, 1]:
+            ni, nj = i + di, j + dj
+            if 0 <= ni < grid_z.shape[0] and 0 <= nj < grid_z.shape[1]:
+                if not np.isnan(grid_z[ni, nj]):
+                    points_x.append(nj * step_x)
+                    points_y.append((ni + row_offset) * step_y)
+                    points_z.append(grid_z[ni, nj])
+
+    if len(points_z) >= 3:
+        A = np.c_[points_x, points_y, np.ones(len(points_z))]
+        try:
+            coeff, _, _, _ = np.linalg.lstsq(A, points_z, rcond=None)
+            return coeff[0], coeff[1]
+        except:
+            return np.nan, np.nan
+    return np.nan, np.nan
+
+
+def local_slopes_loop(grid_z, step_x, step_y, progress=None, row_offset=0):
+    """
+    逐像素计算X/Y方向斜率 (参考实现)
+
+    progress(已完成行数, 总行数) 在每行完成后调用;
+    row_offset 为 grid_z 首行在整个网格中的行号,见 fit_local_plane
+    """
+    n_rows, n_cols = grid_z.shape
+
+    slope_x = np.full((n_rows, n_cols), np.nan)
+    slope_y = np.full((n_rows, n_cols), np.nan)
+
+    for i in range(n_rows):
+        for j in range(n_cols):
+            if np.isnan(grid_z[i, j]):
+                continue
+
+            is_left_edge = j == 0
+            is_right_edge = j == n_cols - 1
+            is_top_edge = i == 0
+            is_bottom_edge = i == n_rows - 1
+
+            is_corner = (is_left_edge or is_right_edge) and (
+                is_top_edge or is_bottom_edge
+            )
+            is_edge = (
+                is_left_edge or is_right_edge or is_top_edge or is_bottom_edge
+            ) and not is_corner
+
+            if is_corner:
+                # 角点使用局部平面拟合
+                sx, sy = fit_local_plane(i, j, grid_z, step_x, step_y, row_offset)
+                slope_x[i, j] = sx
+                slope_y[i, j] = sy
+            elif is_edge:
+                # 边缘点使用双侧差分(如果可能),否则使用单侧差分
+                # X方向
+                if is_left_edge:
+                    if (
+                        j + 2 < n_cols
+                        and not np.isnan(grid_z[i, j + 1])
+                        and not np.isnan(grid_z[i, j + 2])
+                    ):
+                        # 使用前向二阶差分
+                        slope_x[i, j] = (
+                            -3 * grid_z[i, j] + 4 * grid_z[i, j + 1] - grid_z[i, j + 2]
+                        ) / (2 * step_x)
+                    elif not np.isnan(grid_z[i, j + 1]):
+                        slope_x[i, j] = (grid_z[i, j + 1] - grid_z[i, j]) / step_x
+                elif is_right_edge:
+                    if (
+                        j - 2 >= 0
+                        and not np.isnan(grid_z[i, j - 1])
+                        and not np.isnan(grid_z[i, j - 2])
+                    ):
+                        # 使用后向二阶差分
+                        slope_x[i, j] = (
+                            3 * grid_z[i, j] - 4 * grid_z[i, j - 1] + grid_z[i, j - 2]
+                        ) / (2 * step_x)
+                    elif not np.isnan(grid_z[i, j - 1]):
+                        slope_x[i, j] = (grid_z[i, j] - grid_z[i, j - 1]) / step_x
+                else:
+                    # 顶部或底部边缘,X方向可以用中心差分
+                    if not np.isnan(grid_z[i, j + 1]) and not np.isnan(
+                        grid_z[i, j - 1]
+                    ):
+                        slope_x[i, j] = (grid_z[i, j + 1] - grid_z[i, j - 1]) / (
+                            2 * step_x
+                        )
+
+                # Y方向
+                if is_top_edge:
+                    if (
+                        i + 2 < n_rows
+                        and not np.isnan(grid_z[i + 1, j])
+                        and not np.isnan(grid_z[i + 2, j])
+                    ):
+                        # 使用前向二阶差分
+                        slope_y[i, j] = (
+                            -3 * grid_z[i, j] + 4 * grid_z[i + 1, j] - grid_z[i + 2, j]
+                        ) / (2 * step_y)
+                    elif not np.isnan(grid_z[i + 1, j]):
+                        slope_y[i, j] = (grid_z[i + 1, j] - grid_z[i, j]) / step_y
+                elif is_bottom_edge:
+                    if (
+                        i - 2 >= 0
+                        and not np.isnan(grid_z[i - 1, j])
+                        and not np.isnan(grid_z[i - 2, j])
+                    ):
+                        # 使用后向二阶差分
+                        slope_y[i, j] = (
+                            3 * grid_z[i, j] - 4 * grid_z[i - 1, j] + grid_z[i - 2, j]
+                        ) / (2 * step_y)
+                    elif not np.isnan(grid_z[i - 1, j]):
+                        slope_y[i, j] = (grid_z[i, j] - grid_z[i - 1, j]) / step_y
+                else:
+                    # 左侧或右侧边缘,Y方向可以用中心差分
+                    if not np.isnan(grid_z[i + 1, j]) and not np.isnan(
+                        grid_z[i - 1, j]
+                    ):
+                        slope_y[i, j] = (grid_z[i + 1, j] - grid_z[i - 1, j]) / (
+                            2 * step_y
+                        )
+            else:
+                # 内部点使用局部平面拟合
+                sx, sy = fit_local_plane(i, j, grid_z, step_x, step_y, row_offset)
+                slope_x[i, j] = sx
+                slope_y[i, j] = sy
+
+        if progress is not None:
+            progress(i + 1, n_rows)
+
+    return slope_x, slope_y
+
+
+def _plane_fit_slopes(grid_z, step_x, step_y, row_offset=0):
+    """
+    3x3邻域平面拟合的斜率 (全部像素)
+
+    以像素偏移 (dj, di) 为局部坐标,对9个邻域位置做NaN感知的矩求和,
+    再逐像素求解 3x3 法方程;完整邻域时等价于固定的 Prewitt 型卷积核。
+    法方程矩阵元素均为小整数,其行列式可精确判断秩亏 (有效点共线),
+    这类像素退回 lstsq 以保持与逐像素实现相同的最小范数解。
+
+    返回:
+        slope_x, slope_y: 斜率,有效点少于3个时为 NaN
+    """
+    n_rows, n_cols = grid_z.shape
+    padded = np.pad(grid_z, 1, constant_values=np.nan)
+
+    # 整数矩: 1, dj, di, dj², dj*di, di²
+    n = np.zeros((n_rows, n_cols), dtype=np.int64)
+    nj = np.zeros_like(n)
+    ni = np.zeros_like(n)
+    njj = np.zeros_like(n)
+    nij = np.zeros_like(n)
+    nii = np.zeros_like(n)
+    # 高度矩: z, dj*z, di*z
+    sz = np.zeros((n_rows, n_cols))
+    sjz = np.zeros_like(sz)
+    siz = np.zeros_like(sz)
+
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            z = padded[1 + di : 1 + di + n_rows, 1 + dj : 1 + dj + n_cols]
+            v = ~np.isnan(z)
+            zv = np.where(v, z, 0.0)
+            n += v
+            nj += dj * v
+            ni += di * v
+            njj += dj * dj * v
+            nij += dj * di * v
+            nii += di * di * v
+            sz += zv
+            sjz += dj * zv
+            siz += di * zv
+
+    det = (
+        njj * (nii * n - ni * ni)
+        - nij * (nij * n - ni * nj)
+        + nj * (nij * ni - nii * nj)
+    )
+
+    slope_x = np.full((n_rows, n_cols), np.nan)
+    slope_y = np.full((n_rows, n_cols), np.nan)
+
+    solvable = (n >= 3) & (det != 0)
+    normal = np.stack(
+        [
+            np.stack([njj, nij, nj], axis=-1),
+            np.stack([nij, nii, ni], axis=-1),
+            np.stack([nj, ni, n], axis=-1),
+        ],
+        axis=-2,
+    )[solvable].astype(np.float64)
+    rhs = np.stack([sjz, siz, sz], axis=-1)[solvable]
+    coeff = np.linalg.solve(normal, rhs[..., np.newaxis])[..., 0]
+
+    slope_x[solvable] = coeff[:, 0] / step_x
+    slope_y[solvable] = coeff[:, 1] / step_y
+
+    # 有效点共线 (秩亏) 的像素逐个用 lstsq 求最小范数解
+    degenerate = (n >= 3) & (det == 0) & ~np.isnan(grid_z)
+    for i, j in zip(*np.nonzero(degenerate)):
+        slope_x[i, j], slope_y[i, j] = fit_local_plane(
+            i, j, grid_z, step_x, step_y, row_offset
+        )
+
+    return slope_x, slope_y
+
+
+def local_slopes_vectorized(grid_z, step_x, step_y, progress=None, row_offset=0):
+    """
+    整体数组运算计算X/Y方向斜率,结果与 local_slopes_loop 一致;
+    progress(总行数, 总行数) 只在结束时调用一次;row_offset 见 fit_local_plane
+
+    内部点和角点: 3x3邻域平面拟合 (_plane_fit_slopes)
+    左/右边缘: X方向二阶单侧差分(退化为一阶),Y方向中心差分
+    上/下边缘: X方向中心差分,Y方向二阶单侧差分(退化为一阶)
+    """
+    n_rows, n_cols = grid_z.shape
+    padded = np.pad(grid_z, 2, constant_values=np.nan)
+
+    def shifted(di, dj):
+        return padded[2 + di : 2 + di + n_rows, 2 + dj : 2 + dj + n_cols]
+
+    def one_sided(z0, z1, z2, step, sign):
+        """二阶单侧差分,z2 无效时退化为一阶差分;sign=1 前向,-1 后向"""
+        v1 = ~np.isnan(z1)
+        v2 = ~np.isnan(z2)
+        with np.errstate(invalid="ignore"):
+            if sign > 0:
+                second = (-3 * z0 + 4 * z1 - z2) / (2 * step)
+                first = (z1 - z0) / step
+            else:
+                second = (3 * z0 - 4 * z1 + z2) / (2 * step)
+                first = (z0 - z1) / step
+        return np.where(v1 & v2, second, np.where(v1, first, np.nan))
+
+    z0 = grid_z
+    forward_x = one_sided(z0, shifted(0, 1), shifted(0, 2), step_x, 1)
+    backward_x = one_sided(z0, shifted(0, -1), shifted(0, -2), step_x, -1)
+    central_x = (shifted(0, 1) - shifted(0, -1)) / (2 * step_x)
+    forward_y = one_sided(z0, shifted(1, 0), shifted(2, 0), step_y, 1)
+    backward_y = one_sided(z0, shifted(-1, 0), shifted(-2, 0), step_y, -1)
+    central_y = (shifted(1, 0) - shifted(-1, 0)) / (2 * step_y)
+
+    rows = np.arange(n_rows)[:, np.newaxis]
+    cols = np.arange(n_cols)[np.newaxis, :]
+    is_left = np.broadcast_to(cols == 0, (n_rows, n_cols))
+    is_right = np.broadcast_to(cols == n_cols - 1, (n_rows, n_cols))
+    is_top = np.broadcast_to(rows == 0, (n_rows, n_cols))
+    is_bottom = np.broadcast_to(rows == n_rows - 1, (n_rows, n_cols))
+
+    valid = ~np.isnan(grid_z)
+    is_corner = (is_left | is_right) & (is_top | is_bottom)
+    is_edge = (is_left | is_right | is_top | is_bottom) & ~is_corner
+
+    slope_x, slope_y = _plane_fit_slopes(grid_z, step_x, step_y, row_offset)
+    slope_x[~valid] = np.nan
+    slope_y[~valid] = np.nan
+
+    # 左/右边缘 (不含角点)
+    side = valid & is_edge & (is_left | is_right)
+    slope_x[side & is_left] = forward_x[side & is_left]
+    slope_x[side & is_right] = backward_x[side & is_right]
+    slope_y[side] = central_y[side]
+
+    # 上/下边缘 (不含角点)
+    top_bottom = valid & is_edge & ~(is_left | is_right)
+    slope_x[top_bottom] = central_x[top_bottom]
+    slope_y[top_bottom & is_top] = forward_y[top_bottom & is_top]
+    slope_y[top_bottom & is_bottom] = backward_y[top_bottom & is_bottom]
+
+    if progress is not None:
+        progress(n_rows, n_rows)
+    return slope_x, slope_y
+
+
+# 斜率只依赖上下各2行以内的像素 (3x3邻域和二阶单侧差分)
+STENCIL_HALO = 2
+
+
+def iter_slope_bands(slopes, grid_z, step_x, step_y, max_rows):
+    """
+    按行带计算斜率,用于放不进内存的网格 (如 np.memmap)
+
+    slopes 为 local_slopes_loop 或 local_slopes_vectorized;每次读入 max_rows 行
+    及上下各 STENCIL_HALO 行,多取的行只作为邻域,其中的边缘判定不影响保留的行,
+    秩亏邻域以整个网格的行号为坐标 (row_offset),结果与整体计算一致。
+    逐个产出 (起始行, 结束行, slope_x, slope_y)
+    """
+    n_rows = grid_z.shape[0]
+    for start in range(0, n_rows, max_rows):
+        stop = min(start + max_rows, n_rows)
+        lo = max(0, start - STENCIL_HALO)
+        hi = min(n_rows, stop + STENCIL_HALO)
+        slope_x, slope_y = slopes(
+            np.array(grid_z[lo:hi]), step_x, step_y, row_offset=lo
+        )
+        yield start, stop, slope_x[start - lo : stop - lo], slope_y[
+            start - lo : stop - lo
+        ]
@@ -0,0 +1,258 @@
+"""
+Zygo XYZ 文件读取模块
+解析文件头元数据,分块读取数据区并向量化解析,一次遍历得到 ix/iy/z 数组;
+scan_xyz 只统计有效像素的范围,供分块 (out-of-core) 处理使用
+"""
+
+import os
+import warnings
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+# 文件头行数 (数据从第15行开始)
+HEADER_LINES = 14
+
+# 默认每次读取的字节数
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+@dataclass
+class XyzHeader:
+    """
+    XYZ文件头元数据
+
+    scale: 横向分辨率 (相机像素尺寸),单位米
+    wavelength: 测量波长,单位米
+    origin_x, origin_y, width, height: 相位数据区的原点和尺寸(像素)
+    timestamp: 测量时间
+    """
+
+    scale: Optional[float] = None
+    wavelength: Optional[float] = None
+    origin_x: Optional[int] = None
+    origin_y: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    timestamp: Optional[datetime] = None
+
+    @property
+    def n_pixels(self):
+        """文件头声明的像素总数,未知时返回 None"""
+        if self.width and self.height:
+            return self.width * self.height
+        return None
+
+
+def _field(parts, index, cast):
+    """取出第 index 个字段并转换类型,缺失或格式错误时返回 None"""
+    try:
+        return cast(parts[index])
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_xyz_header(lines):
+    """
+    解析XYZ文件头
+
+    第4行: PhaseOriginX PhaseOriginY PhaseWidth PhaseHeight
+    第8行: Source IntfScaleFactor Wavelength NumericAperture ObliquityFactor
+           Magnification CameraRes TimeStamp
+    """
+    header = XyzHeader()
+
+    if len(lines) > 3:
+        parts = lines[3].split()
+        header.origin_x = _field(parts, 0, int)
+        header.origin_y = _field(parts, 1, int)
+        header.width = _field(parts, 2, int)
+        header.height = _field(parts, 3, int)
+
+    if len(lines) > 7:
+        parts = lines[7].split()
+        header.wavelength = _field(parts, 2, float)
+        scale = _field(parts, 6, float)
+        if scale is not None and scale > 0:
+            header.scale = scale
+        timestamp = _field(parts, 7, int)
+        if timestamp is not None and timestamp > 0:
+            try:
+                header.timestamp = datetime.fromtimestamp(timestamp)
+            except (OverflowError, OSError, ValueError):
+                # 超出平台可表示范围的时间戳不影响分析,视为缺失
+                pass
+
+    return header
+
+
+def read_xyz_header(input_path):
+    """读取并解析XYZ文件头"""
+    with open(input_path, "r") as f:
+        lines = [f.readline() for _ in range(HEADER_LINES)]
+    return parse_xyz_header(lines)
+
+
+def _parse_lines(lines):
+    """逐行解析(慢速路径),用于含有非数据行的数据块"""
+    ix_list, iy_list, z_list = [], [], []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        try:
+            ix = int(parts[0])
+            iy = int(parts[1])
+            if parts[2] == "No":
+                continue
+            z_um = float(parts[2])
+        except ValueError:
+            continue
+        ix_list.append(ix)
+        iy_list.append(iy)
+        z_list.append(z_um)
+
+    return (
+        np.array(ix_list, dtype=np.int32),
+        np.array(iy_list, dtype=np.int32),
+        np.array(z_list, dtype=np.float64),
+    )
+
+
+def _parse_chunk(text):
+    """
+    向量化解析一个完整行组成的数据块
+
+    无效像素 ("No" / "No Data") 先替换为 nan 再整体转换,解析后剔除;
+    分段标记 "#" 直接忽略;若仍有无法解析的内容,退回逐行解析
+    """
+    numeric = text.replace("No Data", "nan").replace("No", "nan").replace("#", " ")
+    try:
+        with warnings.catch_warnings():
+            # 旧版numpy对无法解析的内容仅给出警告
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(numeric, sep=" ")
+    except (ValueError, DeprecationWarning):
+        values = None
+
+    if values is None or values.size % 3 != 0:
+        return _parse_lines(text.splitlines())
+
+    values = values.reshape(-1, 3)
+    valid = ~np.isnan(values[:, 2])
+    values = values[valid]
+
+    return (
+        values[:, 0].astype(np.int32),
+        values[:, 1].astype(np.int32),
+        np.ascontiguousarray(values[:, 2]),
+    )
+
+
+def iter_xyz_chunks(input_path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    按块迭代XYZ文件的数据区
+
+    每次产出 (ix, iy, z_um) 三个数组,仅包含有效像素;
+    内存占用由 chunk_bytes 决定,与文件大小无关
+    """
+    with open(input_path, "r") as f:
+        for _ in range(HEADER_LINES):
+            f.readline()
+
+        tail = ""
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+
+            block = tail + block
+            cut = block.rfind("\n")
+            if cut < 0:
+                tail = block
+                continue
+
+            tail = block[cut + 1 :]
+            yield _parse_chunk(block[: cut + 1])
+
+        if tail.strip():
+            yield _parse_chunk(tail)
+
+
+def read_xyz(input_path, chunk_bytes=DEFAULT_CHUNK_BYTES, header=None):
+    """
+    读取XYZ文件的全部有效数据点
+
+    按文件头声明的像素数预分配数组,数据块直接写入;
+    文件头缺失尺寸信息时按需扩容
+
+    返回:
+        ix, iy: 像素索引 (int32, 连续内存)
+        z_um: 高度值,单位微米 (float64, 连续内存)
+    """
+    if header is None:
+        header = read_xyz_header(input_path)
+
+    capacity = header.n_pixels or 0
+    ix_all = np.empty(capacity, dtype=np.int32)
+    iy_all = np.empty(capacity, dtype=np.int32)
+    z_all = np.empty(capacity, dtype=np.float64)
+
+    count = 0
+    for ix, iy, z_um in iter_xyz_chunks(input_path, chunk_bytes):
+        n = len(z_um)
+        if count + n > capacity:
+            capacity = max(2 * capacity, count + n)
+            ix_all = np.resize(ix_all, capacity)
+            iy_all = np.resize(iy_all, capacity)
+            z_all = np.resize(z_all, capacity)
+
+        ix_all[count : count + n] = ix
+        iy_all[count : count + n] = iy
+        z_all[count : count + n] = z_um
+        count += n
+
+    return ix_all[:count], iy_all[:count], z_all[:count]
+
+
+@dataclass
+class XyzExtent:
+    """
+    XYZ文件有效像素的数量和索引范围 (scan_xyz 的结果)
+
+    n_points: 有效像素数
+    min_ix, max_ix, min_iy, max_iy: 像素索引范围
+    """
+
+    n_points: int
+    min_ix: int
+    max_ix: int
+    min_iy: int
+    max_iy: int
+
+
+def scan_xyz(input_path, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None):
+    """
+    遍历一次数据区,只统计有效像素数和索引范围,不保存数据点
+
+    progress(已读取字节数, 文件字节数) 在每个数据块之后调用 (字节数按块大小估计)。
+    没有有效像素时返回 None
+    """
+    file_bytes = os.path.getsize(input_path)
+    n_points = 0
+    min_ix = min_iy = np.iinfo(np.int64).max
+    max_ix = max_iy = np.iinfo(np.int64).min
+
+    for n_chunks, (ix, iy, _) in enumerate(iter_xyz_chunks(input_path, chunk_bytes), 1):
+        if len(ix) > 0:
+            n_points += len(ix)
+            min_ix, max_ix = min(min_ix, int(ix.min())), max(max_ix, int(ix.max()))
+            min_iy, max_iy = min(min_iy, int(iy.min())), max(max_iy, int(iy.max()))
+        if progress is not None:
+            progress(min(n_chunks * chunk_bytes, file_bytes), file_bytes)
+
+    if n_points == 0:
+        return None
+    return XyzExtent(n_points, min_ix, max_ix, min_iy, max_iy)